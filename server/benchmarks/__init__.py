@@ -0,0 +1,19 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+'''
+Benchmarks of data preparation and of serving windows.
+
+Run them from the 'server' directory with 'python -m benchmarks'. See
+'python -m benchmarks --help' for saving and comparing baselines.
+'''
@@ -0,0 +1,168 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+'''
+Runs the benchmarks and compares them with a saved baseline.
+
+    python -m benchmarks --sizes small,medium --save baselines/before.json
+    python -m benchmarks --sizes small,medium --compare baselines/before.json
+
+It exits with 1 if a benchmark is slower than the baseline by more than the
+threshold, so it can be used to catch regressions. baselines/small.json is a
+baseline of the small size.
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.suite import BENCHMARKS, run_benchmark
+from benchmarks.synthetic import SIZES, write_recording
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmarks of Octopus Sensing Visualizer")
+    parser.add_argument("--sizes", default="small,medium",
+                        help=f"comma separated sizes of recordings, of {', '.join(SIZES)}")
+    parser.add_argument("--filter", default=None,
+                        help="only run benchmarks whose name matches this regular expression")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs")
+    parser.add_argument("--directory",
+                        default=os.path.join(tempfile.gettempdir(), "octopus_sensing_benchmarks"),
+                        help="where synthetic recordings are written and reused")
+    parser.add_argument("--save", default=None, help="save the results to this JSON file")
+    parser.add_argument("--compare", default=None,
+                        help="compare the results with a JSON file saved by --save")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown reported as a regression (default 0.1)")
+    args = parser.parse_args()
+
+    # Loading logs every file it reads
+    logging.basicConfig(level=logging.WARNING)
+
+    sizes = [size.strip() for size in args.sizes.split(",")]
+    benchmarks = [bench for bench in BENCHMARKS
+                  if args.filter is None or re.search(args.filter, bench.name)]
+    if len(benchmarks) == 0:
+        raise Exception(f"No benchmark matches '{args.filter}'")
+
+    results = []
+    print(f"{'benchmark':<32}{'size':<8}{'median':>12}{'min':>12}"
+          f"{'samples/s':>14}{'peak memory':>14}")
+    for size in sizes:
+        recording = write_recording(size, args.directory)
+        for bench in benchmarks:
+            result = run_benchmark(bench, recording, args.repeat)
+            results.append(result)
+            print(f"{result['name']:<32}{result['size']:<8}"
+                  f"{_format_seconds(result['median']):>12}{_format_seconds(result['min']):>12}"
+                  f"{_format_throughput(result['throughput']):>14}"
+                  f"{result['peak_memory'] / 2**20:>11.1f} MB", flush=True)
+
+    if args.save is not None:
+        save_results(args.save, results)
+    if args.compare is not None:
+        regressions = compare_results(load_results(args.compare), results, args.threshold)
+        if regressions > 0:
+            sys.exit(1)
+
+
+def save_results(path: str, results):
+    '''
+    Saves results, with a description of the machine they were measured on
+
+    @param str path: path of the JSON file
+    @param list(dict) results: outputs of run_benchmark
+    '''
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as results_file:
+        json.dump({"machine": _machine(), "results": results}, results_file, indent=2)
+
+
+def load_results(path: str):
+    '''
+    @rtype: list(dict)
+    @return: results saved by save_results
+    '''
+    with open(path, encoding="utf-8") as results_file:
+        saved = json.load(results_file)
+    if saved.get("machine") != _machine():
+        print(f"Warning: {path} was measured on another machine: {saved.get('machine')}")
+    return saved["results"]
+
+
+def compare_results(baseline, results, threshold: float):
+    '''
+    Prints how much each benchmark changed since the baseline
+
+    @param list(dict) baseline: earlier results
+    @param list(dict) results: current results
+    @param float threshold: relative slowdown that counts as a regression
+
+    @rtype: int
+    @return: number of regressions
+    '''
+    earlier = {(result["name"], result["size"]): result for result in baseline}
+    regressions = 0
+    print()
+    print(f"{'benchmark':<32}{'size':<8}{'baseline':>12}{'current':>12}{'change':>10}"
+          f"{'memory':>10}")
+    for result in results:
+        before = earlier.get((result["name"], result["size"]))
+        if before is None:
+            continue
+        change = result["median"] / before["median"] - 1
+        memory_change = result["peak_memory"] / max(before["peak_memory"], 1) - 1
+        mark = ""
+        if change > threshold:
+            mark = "  slower"
+            regressions += 1
+        elif change < -threshold:
+            mark = "  faster"
+        print(f"{result['name']:<32}{result['size']:<8}"
+              f"{_format_seconds(before['median']):>12}{_format_seconds(result['median']):>12}"
+              f"{change:>+10.1%}{memory_change:>+10.1%}{mark}")
+    return regressions
+
+
+def _machine():
+    return {"platform": platform.platform(), "processor": platform.processor(),
+            "cpus": os.cpu_count(), "python": platform.python_version(),
+            "numpy": np.__version__}
+
+
+def _format_seconds(seconds: float):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.1f} ms"
+    return f"{seconds:.2f} s"
+
+
+def _format_throughput(throughput):
+    if throughput is None:
+        return "-"
+    return f"{throughput / 1e6:.2f} M"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import configparser
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Tuple
+
+import cherrypy
+from cherrypy.lib.httputil import HeaderMap
+
+from octopus_sensing_visualizer.cache import clear_cache
+from octopus_sensing_visualizer.end_point import EndPoint
+from octopus_sensing_visualizer.prepare_data.eeg import prepare_power_bands, \
+    prepare_power_bands_on_the_fly, prepare_spectrogram
+from octopus_sensing_visualizer.prepare_data.gsr import prepare_phasic_tonic
+from octopus_sensing_visualizer.prepare_data.ppg import prepare_ppg_components
+
+from benchmarks.synthetic import Recording
+
+# Windows requested by the get_data benchmarks, spread over the recording
+WINDOWS_PER_RUN = 50
+WINDOW_SIZE = 3
+
+
+@dataclass
+class Benchmark():
+    '''
+    A measured operation. setup receives a Recording and returns the operation,
+    as a function without arguments, and the number of samples it processes.
+    '''
+    name: str
+    setup: Callable[[Recording], Tuple[Callable[[], Any], int]]
+    # Upper bound of repetitions, for the slow ones
+    max_repeat: Optional[int] = None
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str, max_repeat: Optional[int] = None):
+    '''
+    Registers the decorated setup function as a benchmark
+    '''
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name, setup, max_repeat))
+        return setup
+    return register
+
+
+def run_benchmark(bench: Benchmark, recording: Recording, repeat: int):
+    '''
+    Times a benchmark on a recording, then measures its peak memory in a separate
+    run, because tracing allocations slows them down.
+
+    @param Benchmark bench: the benchmark
+    @param Recording recording: the data it runs on
+    @param int repeat: number of timed runs
+
+    @rtype: dict
+    @return: median and minimum seconds, throughput in samples per second and peak
+             memory in bytes
+    '''
+    operation, samples = bench.setup(recording)
+    if bench.max_repeat is not None:
+        repeat = min(repeat, bench.max_repeat)
+
+    durations = []
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        operation()
+        durations.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(durations)
+    return {
+        "name": bench.name,
+        "size": recording.size,
+        "repeat": len(durations),
+        "median": median,
+        "min": min(durations),
+        "samples": samples,
+        "throughput": samples / median if median > 0 else None,
+        "peak_memory": peak_memory,
+    }
+
+
+def _config(recording: Recording, **server_options):
+    config = configparser.RawConfigParser(allow_no_value=True)
+    config.read(recording.config_path)
+    config.add_section('SERVER')
+    # Loading in worker processes would hide their memory from tracemalloc
+    config.set('SERVER', 'parallel_loading', 'false')
+    for option, value in server_options.items():
+        config.set('SERVER', option, str(value))
+    return config
+
+
+def _clear_caches(recording: Recording):
+    for section in ('EEG', 'GSR', 'PPG'):
+        clear_cache(_config(recording).get(section, 'path'))
+
+
+@benchmark("load_cold", max_repeat=3)
+def load_cold(recording: Recording):
+    '''Startup without the cache: parsing CSV files and extracting every feature'''
+    config = _config(recording)
+
+    def operation():
+        _clear_caches(recording)
+        EndPoint(config)
+    return operation, recording.samples
+
+
+@benchmark("load_warm")
+def load_warm(recording: Recording):
+    '''Startup with the cache built by an earlier run'''
+    config = _config(recording)
+    EndPoint(config)
+    return lambda: EndPoint(config), recording.samples
+
+
+@benchmark("prepare_power_bands", max_repeat=3)
+def power_bands(recording: Recording):
+    '''Power bands of every second of the whole recording'''
+    return (lambda: prepare_power_bands(recording.eeg, recording.eeg_sampling_rate, 3, 2),
+            recording.eeg.size)
+
+
+@benchmark("prepare_power_bands_on_the_fly")
+def power_bands_on_the_fly(recording: Recording):
+    '''Power bands of the windows that get_data requests'''
+    starts = _window_starts(recording)
+
+    def operation():
+        for start in starts:
+            prepare_power_bands_on_the_fly(recording.eeg, recording.eeg_sampling_rate,
+                                           start, WINDOW_SIZE)
+    samples = len(starts) * recording.eeg.shape[0] * WINDOW_SIZE * recording.eeg_sampling_rate
+    return operation, samples
+
+
+@benchmark("prepare_spectrogram", max_repeat=3)
+def spectrogram(recording: Recording):
+    '''Quantized spectrogram levels of the whole recording'''
+    sampling_rate = recording.eeg_sampling_rate
+    return (lambda: prepare_spectrogram(recording.eeg, sampling_rate, sampling_rate,
+                                        sampling_rate // 8),
+            recording.eeg.size)
+
+
+@benchmark("prepare_phasic_tonic", max_repeat=3)
+def phasic_tonic(recording: Recording):
+    '''Phasic and tonic components of the whole GSR recording'''
+    return (lambda: prepare_phasic_tonic(recording.gsr, recording.peripheral_sampling_rate),
+            recording.gsr.size)
+
+
+@benchmark("prepare_phasic_tonic_neurokit", max_repeat=1)
+def phasic_tonic_neurokit(recording: Recording):
+    '''Like prepare_phasic_tonic, with neurokit2's whole eda_process'''
+    return (lambda: prepare_phasic_tonic(recording.gsr, recording.peripheral_sampling_rate,
+                                         engine="neurokit"),
+            recording.gsr.size)
+
+
+@benchmark("prepare_ppg_components", max_repeat=3)
+def ppg_components(recording: Recording):
+    '''HR, HRV and breathing rate of every second of the whole PPG recording'''
+    return (lambda: prepare_ppg_components(recording.ppg, recording.peripheral_sampling_rate),
+            recording.ppg.size)
+
+
+@benchmark("prepare_ppg_components_heartpy", max_repeat=1)
+def ppg_components_heartpy(recording: Recording):
+    '''Like prepare_ppg_components, with heartpy analysing every window'''
+    return (lambda: prepare_ppg_components(recording.ppg, recording.peripheral_sampling_rate,
+                                           engine="heartpy"),
+            recording.ppg.size)
+
+
+def _get_data_benchmark(query: dict, headers: Optional[dict] = None,
+                        window_size: int = WINDOW_SIZE, compression: str = ""):
+    # get_data of a loaded EndPoint, called directly as CherryPy would call it for
+    # a GET request. Caches are disabled, so every request does the whole work.
+    def setup(recording: Recording):
+        end_point = _uncached_end_point(recording, compression)
+        starts = _window_starts(recording, window_size)
+
+        def operation():
+            for start in starts:
+                _get_data(end_point, headers, start_time=start, window_size=window_size,
+                          **query)
+        return operation, len(starts) * _window_samples(end_point, window_size)
+    return setup
+
+
+def _uncached_end_point(recording: Recording, compression: str):
+    # The first EndPoint builds the cache of the recording
+    EndPoint(_config(recording))
+    config = _config(recording, response_cache_size=0, compression=compression)
+    config.set('EEG', 'power_bands_cache_size', '0')
+    return EndPoint(config)
+
+
+def _get_data(end_point: EndPoint, headers: Optional[dict], **query):
+    cherrypy.request.method = 'GET'
+    cherrypy.request.headers = HeaderMap(headers or {})
+    cherrypy.response.headers = HeaderMap()
+    return end_point.get_data(**{key: str(value) for key, value in query.items()})
+
+
+def _window_samples(end_point: EndPoint, window_size: int):
+    # Samples of all signals in a window, before they are reduced to max_points
+    samples = 0
+    for key, value in end_point.data.items():
+        if key != "power_bands":
+            channels = value.shape[0] if value.ndim == 2 else 1
+            samples += channels * min(window_size * end_point.sampling_rate[key],
+                                      value.shape[-1])
+    return samples
+
+
+def _window_starts(recording: Recording, window_size: int = WINDOW_SIZE):
+    last_start = recording.length - window_size
+    step = max(last_start // WINDOWS_PER_RUN, 1)
+    return list(range(0, last_start + 1, step))[:WINDOWS_PER_RUN]
+
+
+benchmark("get_data_json")(_get_data_benchmark({"format": "json"}))
+benchmark("get_data_binary")(_get_data_benchmark({"format": "binary"}))
+benchmark("get_data_gzip")(_get_data_benchmark({"format": "binary"},
+                                               {"Accept-Encoding": "gzip"},
+                                               compression="gzip"))
+# A minute long window reduced to the width of a chart
+benchmark("get_data_max_points")(_get_data_benchmark({"format": "binary", "max_points": 1000},
+                                                     window_size=60))
@@ -0,0 +1,190 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+# Length in seconds, number of EEG channels and sampling rate of each size
+SIZES = {
+    "small": (60, 8, 128),
+    "medium": (600, 16, 256),
+    "large": (3600, 32, 256),
+}
+
+# GSR and PPG sensors are usually sampled slower than EEG
+PERIPHERAL_SAMPLING_RATE = 128
+
+# So every run generates exactly the same recordings
+SEED = 1234
+
+
+@dataclass
+class Recording():
+    '''
+    A synthetic session, written to a directory with its config file
+    '''
+    size: str
+    directory: str
+    config_path: str
+    length: int
+    eeg_sampling_rate: int
+    peripheral_sampling_rate: int
+    eeg: np.ndarray
+    gsr: np.ndarray
+    ppg: np.ndarray
+
+    @property
+    def samples(self):
+        '''Number of samples of all signals'''
+        return self.eeg.size + self.gsr.size + self.ppg.size
+
+
+def synthetic_eeg(length: int, channels: int, sampling_rate: int, rng: np.random.Generator):
+    '''
+    EEG-like signals: rhythms of every band with slowly changing amplitudes, on
+    top of 1/f background noise
+
+    @rtype: numpy.array (shape: channels * samples)
+    '''
+    samples = length * sampling_rate
+    times = np.arange(samples) / sampling_rate
+
+    # Pink noise, by shaping the spectrum of white noise
+    spectrum = np.fft.rfft(rng.standard_normal((channels, samples)), axis=-1)
+    frequencies = np.fft.rfftfreq(samples, 1 / sampling_rate)
+    frequencies[0] = frequencies[1]
+    eeg = np.fft.irfft(spectrum / np.sqrt(frequencies), n=samples, axis=-1)
+    eeg *= 10 / eeg.std(axis=-1, keepdims=True)
+
+    for frequency, amplitude in ((2, 8), (6, 5), (10, 12), (20, 4), (40, 2)):
+        phases = rng.uniform(0, 2 * np.pi, (channels, 1))
+        modulation = 1 + 0.5 * np.sin(2 * np.pi * rng.uniform(0.01, 0.1, (channels, 1)) *
+                                      times)
+        eeg += amplitude * modulation * np.sin(2 * np.pi * frequency * times + phases)
+    return eeg.astype(np.float32)
+
+
+def synthetic_ppg(length: int, sampling_rate: int, rng: np.random.Generator):
+    '''
+    PPG-like signal: a pulse wave with a dicrotic notch, whose rate varies with
+    breathing, plus noise and baseline wander
+
+    @rtype: numpy.array (shape: samples)
+    '''
+    samples = length * sampling_rate
+    times = np.arange(samples) / sampling_rate
+    heart_rate = 70 + 5 * np.sin(2 * np.pi * 0.25 * times) + \
+        3 * np.sin(2 * np.pi * 0.01 * times)
+    phase = np.cumsum(heart_rate / 60 / sampling_rate) % 1
+    pulse = np.exp(-((phase - 0.2) / 0.08) ** 2) + 0.4 * np.exp(-((phase - 0.5) / 0.1) ** 2)
+    ppg = 500 + 100 * pulse + 10 * np.sin(2 * np.pi * 0.05 * times) + \
+        2 * rng.standard_normal(samples)
+    return ppg.astype(np.float32)
+
+
+def synthetic_gsr(length: int, sampling_rate: int, rng: np.random.Generator):
+    '''
+    GSR-like signal: a drifting tonic level with skin conductance responses at
+    random moments, plus noise
+
+    @rtype: numpy.array (shape: samples)
+    '''
+    samples = length * sampling_rate
+    times = np.arange(samples) / sampling_rate
+    tonic = 5 + 0.5 * np.sin(2 * np.pi * times / max(length, 1)) + 0.002 * times / 60
+
+    # Responses every 10 seconds on average, with the usual rise and decay
+    impulses = np.zeros(samples)
+    onsets = rng.integers(0, samples, max(length // 10, 1))
+    impulses[onsets] = rng.uniform(0.1, 1, onsets.shape[0])
+    response_times = np.arange(int(20 * sampling_rate)) / sampling_rate
+    response = np.exp(-response_times / 4) - np.exp(-response_times / 0.75)
+    phasic = np.convolve(impulses, response)[:samples]
+
+    gsr = tonic + phasic + 0.01 * rng.standard_normal(samples)
+    return gsr.astype(np.float32)
+
+
+def write_recording(size: str, directory: str):
+    '''
+    Generates a session of a size and writes it, like a real one, as CSV files
+    and a config file. Files that already exist are reused.
+
+    @param str size: one of SIZES
+    @param str directory: where the files are written
+
+    @rtype: Recording
+    '''
+    if size not in SIZES:
+        raise ValueError(f"Unknown size '{size}'. Sizes are {', '.join(SIZES)}")
+    length, channels, sampling_rate = SIZES[size]
+    rng = np.random.default_rng(SEED)
+    eeg = synthetic_eeg(length, channels, sampling_rate, rng)
+    gsr = synthetic_gsr(length, PERIPHERAL_SAMPLING_RATE, rng)
+    ppg = synthetic_ppg(length, PERIPHERAL_SAMPLING_RATE, rng)
+
+    directory = os.path.join(directory, size)
+    os.makedirs(directory, exist_ok=True)
+    paths = {name: os.path.join(directory, f"{name}.csv") for name in ("eeg", "gsr", "ppg")}
+    if not os.path.isfile(paths["eeg"]):
+        header = ",".join(f"ch{channel}" for channel in range(channels))
+        np.savetxt(paths["eeg"], eeg.T, fmt="%.4f", delimiter=",", header=header, comments="")
+    if not os.path.isfile(paths["gsr"]):
+        np.savetxt(paths["gsr"], gsr, fmt="%.5f")
+    if not os.path.isfile(paths["ppg"]):
+        np.savetxt(paths["ppg"], ppg, fmt="%.3f")
+
+    config_path = os.path.join(directory, "octopus_sensing_visualizer_config.conf")
+    with open(config_path, "w", encoding="utf-8") as config_file:
+        config_file.write(_config_text(paths, sampling_rate))
+
+    return Recording(size=size, directory=directory, config_path=config_path, length=length,
+                     eeg_sampling_rate=sampling_rate,
+                     peripheral_sampling_rate=PERIPHERAL_SAMPLING_RATE,
+                     eeg=eeg, gsr=gsr, ppg=ppg)
+
+
+def _config_text(paths, eeg_sampling_rate):
+    # Every graph is enabled, so loading does all the work it can do
+    return f'''[EEG]
+path = {paths["eeg"]}
+sampling_rate = {eeg_sampling_rate}
+display_signal = true
+window_size = 3
+overlap = 2
+display_alpha_signal = true
+display_beta_signal = true
+display_gamma_signal = true
+display_theta_signal = true
+display_delta_signal = true
+display_power_band_bars = true
+
+[GSR]
+path = {paths["gsr"]}
+sampling_rate = {PERIPHERAL_SAMPLING_RATE}
+display_signal = true
+display_phasic = true
+display_tonic = true
+
+[PPG]
+path = {paths["ppg"]}
+sampling_rate = {PERIPHERAL_SAMPLING_RATE}
+display_signal = true
+window_size = 20
+overlap = 19
+display_hr = true
+display_hrv = true
+display_breathing_rate = true
+'''
@@ -0,0 +1,195 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import glob
+import hashlib
+import importlib.metadata
+import json
+import os
+import tempfile
+from typing import Any, Callable, Dict
+
+import numpy as np
+
+CACHE_DIR_NAME = ".octopus_sensing_cache"
+
+# Increase it whenever the content of the cached files changes
+CACHE_VERSION = 2
+
+
+def load_recording(path: str, loader: Callable[..., Any], use_cache: bool = True, **kwargs):
+    '''
+    Loads a recording through a binary cache kept next to it.
+
+    The first time, the recording is parsed with loader and converted to a
+    contiguous .npy file in a '.octopus_sensing_cache' directory beside the
+    recording. Later, the .npy file is opened as a read-only memory map, so
+    loading is instant and data is paged in on demand. The cache is keyed by the
+    path, size and modification time of the recording, so it's rebuilt whenever
+    the recording changes, and by the keyword arguments of loader.
+
+    @param str path: path of the recording
+    @param loader: a function that parses the recording. It returns either an
+                   array, or a tuple of an array and some JSON serializable values.
+
+    @keyword bool use_cache: if False, loader is called directly
+    @keyword kwargs: passed to loader
+
+    @rtype: same as loader
+    @return: output of loader, with the array replaced by its memory map
+    '''
+    if not use_cache:
+        return loader(path, **kwargs)
+
+    array_path, metadata_path = _cache_paths(path, loader, kwargs)
+    if os.path.isfile(array_path) and os.path.isfile(metadata_path):
+        with open(metadata_path, encoding="utf-8") as metadata_file:
+            extra = json.load(metadata_file)
+        array = np.load(array_path, mmap_mode="r")
+        return array if extra is None else (array, *extra)
+
+    result = loader(path, **kwargs)
+    if isinstance(result, tuple):
+        array, extra = result[0], list(result[1:])
+    else:
+        array, extra = result, None
+
+    try:
+        _remove_stale_entries(path, loader.__name__, (array_path, metadata_path))
+        _atomic_write(array_path, lambda f: np.save(f, np.ascontiguousarray(array)))
+        _atomic_write(metadata_path, lambda f: f.write(json.dumps(extra).encode("utf-8")))
+    except OSError:
+        # The directory of the recording may be read-only. We still have the data.
+        return result
+
+    array = np.load(array_path, mmap_mode="r")
+    return array if extra is None else (array, *extra)
+
+
+def load_features(path: str, name: str, data: np.ndarray, parameters: Dict[str, Any],
+                  compute: Callable[[], Dict[str, np.ndarray]], use_cache: bool = True):
+    '''
+    Loads features derived from a recording through a cache kept next to it.
+
+    Features are computed once and saved as an .npz file in the
+    '.octopus_sensing_cache' directory beside the recording. The cache is keyed by
+    a hash of the content of data and by parameters, so it's invalidated when
+    the recording or any of the parameters change.
+
+    @param str path: path of the recording the features are derived from
+    @param str name: name of the features, like 'power_bands'
+    @param numpy.array data: the data the features are computed from
+    @param dict parameters: everything else the result depends on, like window
+                            size and versions of the libraries that compute it.
+                            Values should be JSON serializable.
+    @param compute: a function that computes the features and returns a
+                    dictionary of arrays
+
+    @keyword bool use_cache: if False, compute is called directly
+
+    @rtype: dict(str, numpy.array)
+    @return: the features
+    '''
+    if not use_cache:
+        return compute()
+
+    key = _content_hash(data) + "|" + json.dumps(parameters, sort_keys=True)
+    features_path = _entry_prefix(path, name, key) + ".npz"
+    if os.path.isfile(features_path):
+        with np.load(features_path) as features:
+            return {feature: features[feature] for feature in features.files}
+
+    features = compute()
+    try:
+        _remove_stale_entries(path, name, (features_path,))
+        _atomic_write(features_path, lambda f: np.savez(f, **features))
+    except OSError:
+        # The directory of the recording may be read-only
+        pass
+    return features
+
+
+def library_version(name: str):
+    '''
+    Returns the installed version of a library, to be used in cache keys
+
+    @param str name: name of the distribution, like 'neurokit2'
+
+    @rtype: str
+    @return: version, or None if it's not installed
+    '''
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def clear_cache(path: str):
+    '''
+    Removes every cached file of a recording, including its derived features
+
+    @param str path: path of the recording
+    '''
+    for cached_path in glob.glob(_cache_prefix(path) + ".*"):
+        os.remove(cached_path)
+
+
+def _cache_prefix(path: str):
+    path = os.path.abspath(path)
+    return os.path.join(os.path.dirname(path), CACHE_DIR_NAME, os.path.basename(path))
+
+
+def _entry_prefix(path: str, name: str, key: str):
+    # <recording>.<name>.<digest of key>, so stale entries of a name are easy to find
+    digest = hashlib.sha1(f"{CACHE_VERSION}|{key}".encode("utf-8")).hexdigest()[:16]
+    return f"{_cache_prefix(path)}.{name}.{digest}"
+
+
+def _cache_paths(path: str, loader: Callable, kwargs: Dict[str, Any]):
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|" \
+          f"{loader.__module__}.{loader.__qualname__}|{sorted(kwargs.items())}"
+    prefix = _entry_prefix(path, loader.__name__, key)
+    return prefix + ".npy", prefix + ".json"
+
+
+def _remove_stale_entries(path: str, name: str, current_paths):
+    # Files of older versions of the same entry
+    for stale_path in glob.glob(f"{_cache_prefix(path)}.{name}.*"):
+        if stale_path not in current_paths:
+            os.remove(stale_path)
+
+
+def _content_hash(data: np.ndarray):
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{data.dtype.str}|{data.shape}".encode("utf-8"))
+    flat = np.ascontiguousarray(data).reshape(-1)
+    # Hashing in blocks, so a memory mapped array is never copied as a whole
+    block = 1 << 22
+    for idx in range(0, flat.shape[0], block):
+        hasher.update(memoryview(flat[idx:idx + block]))
+    return hasher.hexdigest()
+
+
+def _atomic_write(path: str, write: Callable):
+    # Writes to a temporary file first, so a crash never leaves a broken cache
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            write(temp_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,173 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import importlib
+import multiprocessing
+import threading
+from concurrent import futures
+from typing import Any, Callable, Hashable, Optional, Sequence
+
+
+class ComputePoolFull(Exception):
+    '''
+    Raised when too many computations are waiting for a worker
+    '''
+
+
+class ComputePool():
+    '''
+    A bounded pool of worker processes for the CPU-heavy parts of requests, like
+    computing power bands or serializing big windows as JSON.
+
+    Work done in a request thread holds the GIL, so concurrent requests run one
+    at a time. In worker processes they run in parallel, and request threads only
+    wait, so light requests like get_metadata are never stalled.
+
+    - Backpressure: at most max_pending computations are queued or running. More
+      are rejected with ComputePoolFull instead of piling up.
+    - Timeouts: waiting for a result is limited to timeout seconds.
+    - Superseding: a computation can be given a group, like a client scrubbing
+      through the recording. A newer computation of the same group cancels the
+      older one if it hasn't started yet, and its caller gets CancelledError.
+
+    Workers are started by start, or on the first computation, with the 'spawn'
+    method, since forking a multi-threaded server is not safe.
+    '''
+
+    def __init__(self, workers: int, max_pending: Optional[int] = None,
+                 timeout: Optional[float] = 30, preload: Sequence[str] = ()):
+        '''
+        @param int workers: number of worker processes
+
+        @keyword int max_pending: maximum number of queued and running
+                                  computations. Default is four per worker.
+        @keyword float timeout: maximum seconds to wait for a result. None waits
+                                forever.
+        @keyword preload: names of modules that workers import when they start,
+                          so the first computations don't wait for them
+        '''
+        if workers < 1:
+            raise ValueError("'workers' should be at least 1")
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else 4 * workers
+        self.timeout = timeout
+        self.preload = tuple(preload)
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.superseded = 0
+        self.__executor = None
+        self.__latest = {}
+        # Reentrant, since cancelling a future calls __done in the same thread
+        self.__lock = threading.RLock()
+
+    def run(self, function: Callable, *args, group: Optional[Hashable] = None) -> Any:
+        '''
+        Runs function(*args) in a worker process and returns its result.
+
+        function, args and the result are pickled, so function should be a module
+        level function, and args should be small, like a window of a signal.
+
+        @param function: the computation
+
+        @keyword group: computations of the same group supersede each other
+
+        @return: what function returns
+        @raise ComputePoolFull: if max_pending computations are already pending
+        @raise concurrent.futures.TimeoutError: if the result isn't ready in time
+        @raise concurrent.futures.CancelledError: if a newer computation of the
+                                                  same group superseded it
+        '''
+        with self.__lock:
+            # The computation this one supersedes frees its place first
+            if group is not None:
+                previous = self.__latest.pop(group, None)
+                if previous is not None and previous.cancel():
+                    self.superseded += 1
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise ComputePoolFull(f"{self.pending} computations are already pending")
+            future = self.__get_executor().submit(function, *args)
+            self.pending += 1
+            if group is not None:
+                self.__latest[group] = future
+        future.add_done_callback(self.__done)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except futures.TimeoutError:
+            future.cancel()
+            with self.__lock:
+                self.timeouts += 1
+            raise
+        finally:
+            if group is not None:
+                with self.__lock:
+                    if self.__latest.get(group) is future:
+                        del self.__latest[group]
+
+    def start(self):
+        '''
+        Starts the worker processes, instead of waiting for the first computation
+        '''
+        with self.__lock:
+            executor = self.__get_executor()
+            # Workers are started when there's work and no idle worker
+            for _ in range(self.workers):
+                executor.submit(_nothing)
+
+    def __get_executor(self):
+        if self.__executor is None:
+            self.__executor = futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_import_modules, initargs=(self.preload,))
+        return self.__executor
+
+    def __done(self, future):
+        with self.__lock:
+            self.pending -= 1
+            if not future.cancelled():
+                self.completed += 1
+
+    def stats(self):
+        '''
+        @rtype: dict
+        @return: counters of the computations
+        '''
+        with self.__lock:
+            return {"workers": self.workers,
+                    "max_pending": self.max_pending,
+                    "pending": self.pending,
+                    "completed": self.completed,
+                    "rejected": self.rejected,
+                    "timeouts": self.timeouts,
+                    "superseded": self.superseded}
+
+    def shutdown(self):
+        '''
+        Stops the worker processes. Pending computations are cancelled.
+        '''
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _import_modules(names):
+    for name in names:
+        importlib.import_module(name)
+
+
+def _nothing():
+    pass
@@ -0,0 +1,201 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import os
+import time
+import logging
+import threading
+import configparser
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from octopus_sensing_visualizer.modalities import modality_sections
+
+logger = logging.getLogger(__name__)
+
+# Name of the config file of each dataset in a directory of datasets
+DATASET_CONFIG_NAME = "octopus_sensing_visualizer_config.conf"
+
+
+class DatasetRegistry():
+    '''
+    Serves many recording sessions (datasets) from one server.
+
+    A dataset is loaded the first time it's accessed. When the loaded datasets
+    take more memory than the budget, the least recently used ones are evicted,
+    and loaded again on their next access. Datasets grow while they are served,
+    as their pyramids are built and their caches fill, so their sizes are read
+    again on every access.
+    '''
+
+    def __init__(self, config_paths: Dict[str, str], loader: Callable[[Any], Any],
+                 memory_budget: Optional[int] = None):
+        '''
+        @param dict config_paths: path of the config file of each dataset, by name
+        @param loader: a function that loads a dataset from its config. The loaded
+                       object should have a memory_size() method that returns its
+                       current size in bytes.
+
+        @keyword int memory_budget: maximum bytes of the loaded datasets. None
+                                    means no limit. The last accessed dataset is
+                                    never evicted, even if it's bigger.
+        '''
+        self.config_paths = config_paths
+        self.memory_budget = memory_budget
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.hits = 0
+        self.evictions = 0
+        self.__loader = loader
+        # name: dataset, the least recently used first
+        self.__loaded = OrderedDict()
+        self.__lock = threading.Lock()
+        # So a dataset is loaded once, even if many requests need it at the same time
+        self.__loading_locks = {name: threading.Lock() for name in config_paths}
+
+    def __contains__(self, name: str):
+        return name in self.config_paths
+
+    def get(self, name: str):
+        '''
+        Returns the dataset, loading it if it's not loaded
+        '''
+        dataset = self.__get_loaded(name)
+        if dataset is not None:
+            return dataset
+
+        with self.__loading_locks[name]:
+            # It may have been loaded while waiting for the lock
+            dataset = self.__get_loaded(name)
+            if dataset is not None:
+                return dataset
+
+            started = time.monotonic()
+            dataset = self.__loader(read_dataset_config(self.config_paths[name]))
+            duration = time.monotonic() - started
+            size = dataset.memory_size()
+            logger.info("Loaded dataset %s (%.1f MiB) in %.2f seconds",
+                        name, size / 2**20, duration)
+
+            with self.__lock:
+                self.__loaded[name] = dataset
+                self.loads += 1
+                self.load_seconds += duration
+                self.__evict()
+            return dataset
+
+    def __get_loaded(self, name):
+        with self.__lock:
+            if name not in self.__loaded:
+                return None
+            self.hits += 1
+            self.__loaded.move_to_end(name)
+            # The datasets may have grown since the last access
+            self.__evict()
+            return self.__loaded[name]
+
+    def __evict(self):
+        # Evicts the least recently used datasets until the rest fit in the budget
+        if self.memory_budget is None:
+            return
+        sizes = {name: dataset.memory_size() for name, dataset in self.__loaded.items()}
+        while len(self.__loaded) > 1 and sum(sizes.values()) > self.memory_budget:
+            name, _ = self.__loaded.popitem(last=False)
+            self.evictions += 1
+            logger.info("Evicted dataset %s (%.1f MiB)", name, sizes.pop(name) / 2**20)
+
+    def stats(self):
+        '''
+        Returns the load and eviction statistics, and the state of every dataset
+
+        @rtype: dict
+        '''
+        with self.__lock:
+            sizes = {name: dataset.memory_size() for name, dataset in self.__loaded.items()}
+            return {
+                "loads": self.loads,
+                "load_seconds": self.load_seconds,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "memory_size": sum(sizes.values()),
+                "memory_budget": self.memory_budget,
+                "datasets": [{"name": name,
+                              "loaded": name in self.__loaded,
+                              "memory_size": sizes.get(name, 0)}
+                             for name in sorted(self.config_paths)],
+            }
+
+
+def find_datasets(config: configparser.RawConfigParser) -> Dict[str, str]:
+    '''
+    Finds the datasets of the DATASETS section of the config.
+
+    'directory' is scanned for sub-directories that have an
+    octopus_sensing_visualizer_config.conf file. 'configs' is a comma separated
+    list of config files. Each dataset is named after the directory of its config.
+
+    @param configparser.RawConfigParser config: visualizer's configuration
+
+    @rtype: dict
+    @return: path of the config file of each dataset, by name
+    '''
+    config_paths = []
+    directory = config.get('DATASETS', 'directory', fallback=None)
+    if directory:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name, DATASET_CONFIG_NAME)
+            if os.path.isfile(path):
+                config_paths.append(path)
+    configs = config.get('DATASETS', 'configs', fallback=None)
+    if configs:
+        config_paths.extend(path.strip() for path in configs.split(",") if path.strip())
+
+    datasets = {}
+    for path in config_paths:
+        if not os.path.isfile(path):
+            raise Exception(f"Config file of dataset '{path}' doesn't exist")
+        name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        if name in datasets:
+            raise Exception(f"Two datasets are named '{name}': "
+                            f"'{datasets[name]}' and '{path}'")
+        datasets[name] = path
+    return datasets
+
+
+def read_dataset_config(path: str) -> configparser.RawConfigParser:
+    '''
+    Reads the config file of a dataset. Relative paths of the recordings are
+    relative to the directory of the config file.
+
+    Datasets are finished recordings, so live mode is turned off. They are
+    loaded by request threads of a running server, which must not be forked, so
+    their modalities are loaded one after the other instead of in processes.
+
+    @param str path: path of the config file
+
+    @rtype: configparser.RawConfigParser
+    '''
+    config = configparser.RawConfigParser(allow_no_value=True)
+    if not config.read(path):
+        raise Exception(f"Could not read the config file of dataset '{path}'")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    for section in modality_sections():
+        if config.has_option(section, 'path'):
+            config.set(section, 'path',
+                       os.path.join(directory, config.get(section, 'path')))
+    if not config.has_section('SERVER'):
+        config.add_section('SERVER')
+    config.set('SERVER', 'live', 'false')
+    config.set('SERVER', 'parallel_loading', 'false')
+    return config
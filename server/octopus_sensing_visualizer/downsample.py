@@ -0,0 +1,137 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import math
+
+import numpy as np
+
+
+def downsample(data: np.ndarray, max_points: int, aggregate: str = "min_max"):
+    '''
+    Reduces a signal to at most max_points samples
+
+    @param numpy.array data: a one or two dimensional array. It is reduced along
+                             its last axis (time).
+    @param int max_points: maximum number of samples to return
+
+    @keyword str aggregate: 'min_max' for downsample_min_max, 'mean' for
+                            downsample_mean
+
+    @rtype: numpy.array, float
+    @return: the reduced signal and the number of original samples per returned
+             sample
+    '''
+    if aggregate == "min_max":
+        return downsample_min_max(data, max_points)
+    if aggregate == "mean":
+        return downsample_mean(data, max_points)
+    raise ValueError("'aggregate' should be either 'min_max' or 'mean'")
+
+
+def downsample_min_max(data: np.ndarray, max_points: int):
+    '''
+    Reduces a signal to at most max_points samples, keeping its visual shape.
+
+    The signal is split into max_points/2 equal buckets and the minimum and the
+    maximum of each bucket are kept, in the order they appear. So peaks are never
+    lost, unlike plain decimation. Buckets that only contain NaN stay NaN.
+
+    @param numpy.array data: a one or two dimensional array. It is reduced along
+                             its last axis (time).
+    @param int max_points: maximum number of samples to return
+
+    @rtype: numpy.array, float
+    @return: the reduced signal and the number of original samples per returned
+             sample. When the signal is already short enough, it's returned
+             untouched and the ratio is 1.
+    '''
+    return reduce_min_max(data, data, max_points)
+
+
+def reduce_min_max(low: np.ndarray, high: np.ndarray, max_points: int):
+    '''
+    Same as downsample_min_max, but minimums are taken from low and maximums from
+    high. It's used to reduce already aggregated signals, like the levels of a
+    SignalPyramid.
+
+    @param numpy.array low: minimum of each sample
+    @param numpy.array high: maximum of each sample. Same shape as low.
+    @param int max_points: maximum number of samples to return
+
+    @rtype: numpy.array, float
+    @return: the reduced signal and the number of samples of low per returned sample
+    '''
+    if max_points < 2:
+        raise ValueError("'max_points' should be at least 2")
+    samples = low.shape[-1]
+    if low is high and samples <= max_points:
+        return low, 1
+    if low is not high and samples * 2 <= max_points:
+        return _interleave(low, high), 0.5
+
+    bucket_size = math.ceil(samples / (max_points // 2))
+    bucket_count = math.ceil(samples / bucket_size)
+    low = _to_buckets(low, bucket_size, bucket_count)
+    high = _to_buckets(high, bucket_size, bucket_count)
+
+    min_index = np.argmin(np.where(np.isnan(low), np.inf, low), axis=-1)[..., np.newaxis]
+    max_index = np.argmax(np.where(np.isnan(high), -np.inf, high), axis=-1)[..., np.newaxis]
+    min_value = np.take_along_axis(low, min_index, axis=-1)
+    max_value = np.take_along_axis(high, max_index, axis=-1)
+
+    min_first = min_index <= max_index
+    first = np.where(min_first, min_value, max_value)
+    second = np.where(min_first, max_value, min_value)
+    reduced = np.concatenate([first, second], axis=-1)
+    return reduced.reshape(low.shape[:-2] + (bucket_count * 2,)), bucket_size / 2
+
+
+def downsample_mean(data: np.ndarray, max_points: int):
+    '''
+    Reduces a signal to at most max_points samples by averaging buckets of
+    subsequent samples. NaN values are ignored, and buckets that only contain NaN
+    stay NaN.
+
+    @param numpy.array data: a one or two dimensional array. It is reduced along
+                             its last axis (time).
+    @param int max_points: maximum number of samples to return
+
+    @rtype: numpy.array, float
+    @return: the reduced signal and the number of original samples per returned
+             sample
+    '''
+    samples = data.shape[-1]
+    if samples <= max_points:
+        return data, 1
+    bucket_size = math.ceil(samples / max_points)
+    buckets = _to_buckets(data, bucket_size, math.ceil(samples / bucket_size))
+    counts = np.sum(~np.isnan(buckets), axis=-1)
+    sums = np.nansum(buckets, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan), bucket_size
+
+
+def _to_buckets(data: np.ndarray, bucket_size: int, bucket_count: int):
+    # Pads the last axis with NaN and splits it into buckets
+    data = np.asarray(data, dtype=np.result_type(data.dtype, np.float32))
+    padding = bucket_count * bucket_size - data.shape[-1]
+    if padding > 0:
+        pad_width = [(0, 0)] * (data.ndim - 1) + [(0, padding)]
+        data = np.pad(data, pad_width, constant_values=np.nan)
+    return data.reshape(data.shape[:-1] + (bucket_count, bucket_size))
+
+
+def _interleave(low: np.ndarray, high: np.ndarray):
+    # Short enough already: keep both the minimum and the maximum of each sample
+    reduced = np.stack([low, high], axis=-1)
+    return reduced.reshape(low.shape[:-1] + (low.shape[-1] * 2,))
@@ -0,0 +1,212 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import json
+import re
+import struct
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from octopus_sensing_visualizer.metrics import span
+
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/octet-stream"
+
+# Placeholder of a float32 array in the output of json.dumps. Its JSON text is
+# put in its place afterwards.
+_FLOAT32_MARKER = "\0float32:"
+_FLOAT32_PLACEHOLDER = re.compile(r'"\\u0000float32:(\d+)"')
+
+# Every buffer in a binary response starts on a multiple of this many bytes, so the
+# client can wrap it in a typed array without copying.
+_ALIGNMENT = 8
+
+
+def wants_binary(requested_format: str, accept_header: str) -> bool:
+    '''
+    Decides which response format the client asked for
+
+    @param str requested_format: value of the 'format' field of the request. It
+                                 wins over the Accept header when it is set.
+    @param str accept_header: value of the Accept header of the request
+
+    @rtype: bool
+    @return: True if the binary format should be used, False for JSON
+    '''
+    if requested_format:
+        if requested_format not in ("json", "binary"):
+            raise ValueError("'format' should be either 'json' or 'binary'")
+        return requested_format == "binary"
+    return BINARY_CONTENT_TYPE in (accept_header or "")
+
+
+def encode_json(output: Dict[str, Any]) -> str:
+    '''
+    Serializes the output of get_data as JSON. NaN values are sent as null.
+
+    float32 values are written with the shortest text that reads back as the
+    same float32, like '-23.7504', instead of the 17 digits of the double they
+    convert to ('-23.75040054321289').
+
+    @param dict output: a dictionary of numpy arrays or dictionaries of floats
+
+    @rtype: str
+    @return: JSON string
+    '''
+    float32_arrays = []
+
+    def to_json(value):
+        if isinstance(value, np.ndarray) and value.dtype == np.float32:
+            float32_arrays.append(value)
+            return f"{_FLOAT32_MARKER}{len(float32_arrays) - 1}"
+        return _to_json(value)
+
+    # json_dumps includes the conversion of arrays that aren't float32 to lists,
+    # which is also timed on its own as tolist. float32 arrays are only replaced
+    # by placeholders there, and written afterwards as float32_text.
+    with span("json_dumps"):
+        json_out = json.dumps(output, default=to_json)
+    with span("nan_replace"):
+        json_out = json_out.replace("NaN", "null")
+    if float32_arrays:
+        with span("float32_text"):
+            json_out = _FLOAT32_PLACEHOLDER.sub(
+                lambda match: _float32_json(float32_arrays[int(match.group(1))]), json_out)
+    return json_out
+
+
+def encode_binary(output: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    '''
+    Serializes the output of get_data in the binary columnar format.
+
+    Layout of the response:
+      - 4 bytes: little-endian uint32, length of the JSON header in bytes
+      - the JSON header, padded with spaces so buffers start aligned
+      - raw little-endian float32 buffers, one per entry of the header. uint8
+        arrays (like quantized spectrograms) are kept as uint8.
+
+    The header is {"entries": [{"key", "dtype", "shape", "offset", "labels"?}],
+    "metadata"?}. 'offset' is relative to the start of the buffers. Dictionary
+    values (like power_bands) are sent as a one-dimensional buffer with their keys
+    in 'labels'. NaN values are kept as NaN.
+
+    @param dict output: a dictionary of numpy arrays or dictionaries of floats
+    @param dict metadata: small JSON serializable values that are sent in the
+                          header as they are, instead of as a buffer
+
+    @rtype: bytes
+    @return: the encoded response
+    '''
+    entries = []
+    buffers = []
+    offset = 0
+    for key, value in output.items():
+        entry = {"key": key}
+        if isinstance(value, dict):
+            entry["labels"] = list(value.keys())
+            value = list(value.values())
+        dtype = _binary_dtype(value)
+        array = np.ascontiguousarray(value, dtype=dtype)
+        entry["dtype"] = dtype
+        entry["shape"] = list(array.shape)
+        entry["offset"] = offset
+        entries.append(entry)
+
+        buffer = array.tobytes()
+        padding = -len(buffer) % _ALIGNMENT
+        buffers.append(buffer)
+        buffers.append(b"\0" * padding)
+        offset += len(buffer) + padding
+
+    return b"".join([_binary_header(entries, metadata)] + buffers)
+
+
+def encode_binary_stream(arrays: Dict[str, np.ndarray], metadata: Optional[Dict[str, Any]] = None,
+                         chunk_values: int = 1 << 20):
+    '''
+    Serializes arrays in the binary columnar format of encode_binary, a part at
+    a time, so the whole output is never in memory.
+
+    @param dict arrays: one or two dimensional numpy arrays, like memory maps of
+                        whole recordings
+    @param dict metadata: small JSON serializable values that are sent in the
+                          header as they are
+
+    @keyword int chunk_values: maximum number of values converted at once
+
+    @rtype: generator of bytes
+    @return: parts of the encoded output
+    '''
+    entries = []
+    offset = 0
+    for key, array in arrays.items():
+        dtype = _binary_dtype(array)
+        size = array.size * np.dtype(dtype).itemsize
+        entries.append({"key": key, "dtype": dtype, "shape": list(array.shape),
+                        "offset": offset})
+        offset += size + (-size % _ALIGNMENT)
+    yield _binary_header(entries, metadata)
+
+    for entry, array in zip(entries, arrays.values()):
+        size = 0
+        # Rows of a two dimensional array are contiguous in the output
+        for row in (array if array.ndim == 2 else [array]):
+            for start in range(0, row.shape[0], chunk_values):
+                buffer = np.ascontiguousarray(row[start:start + chunk_values],
+                                              dtype=entry["dtype"]).tobytes()
+                size += len(buffer)
+                yield buffer
+        if size % _ALIGNMENT:
+            yield b"\0" * (-size % _ALIGNMENT)
+
+
+def _binary_dtype(value):
+    return "|u1" if getattr(value, "dtype", None) == np.uint8 else "<f4"
+
+
+def _binary_header(entries, metadata):
+    # Length of the header and the header, padded so the buffers start aligned
+    header = {"entries": entries}
+    if metadata:
+        header["metadata"] = metadata
+    header = json.dumps(header, default=_to_json).encode("utf-8")
+    header += b" " * (-(len(header) + 4) % _ALIGNMENT)
+    return struct.pack("<I", len(header)) + header
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        with span("tolist"):
+            return value.tolist()
+    if isinstance(value, np.float32):
+        return float(str(value))
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _float32_json(array):
+    # JSON text of a float32 array. numpy formats float32 with the shortest
+    # text that reads back as the same value.
+    text = array.astype(str)
+    text[~np.isfinite(array)] = "null"
+    return _json_list(text)
+
+
+def _json_list(text):
+    if text.ndim == 0:
+        return str(text)
+    if text.ndim == 1:
+        return "[" + ",".join(text.tolist()) + "]"
+    return "[" + ",".join(_json_list(row) for row in text) + "]"
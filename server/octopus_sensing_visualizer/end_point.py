@@ -11,13 +11,45 @@
 #
 # You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
 # If not, see <https://www.gnu.org/licenses/>.
-import json
 from typing import Optional
 import os
+import mmap
+import time
+import json
+import importlib
+import numpy as np
+import logging
+import threading
+from concurrent import futures
 import cherrypy
-from octopus_sensing_visualizer.prepare_data.eeg import prepare_eeg_data, prepare_power_bands, prepare_power_bands_on_the_fly
-from octopus_sensing_visualizer.prepare_data.gsr import prepare_gsr_data, prepare_phasic_tonic
-from octopus_sensing_visualizer.prepare_data.ppg import prepare_ppg_data, prepare_ppg_components
+from octopus_sensing_visualizer.modalities import modality_sections
+from octopus_sensing_visualizer.loaders import load_modalities, share_array
+from octopus_sensing_visualizer.live import LiveModality
+from octopus_sensing_visualizer.pyramid import SignalPyramid
+from octopus_sensing_visualizer.spectrogram import Spectrogram
+from octopus_sensing_visualizer.downsample import downsample
+from octopus_sensing_visualizer.lru_cache import LRUCache
+from octopus_sensing_visualizer.compute_pool import ComputePoolFull
+from octopus_sensing_visualizer.encoding import wants_binary, encode_json, encode_binary, \
+    JSON_CONTENT_TYPE, BINARY_CONTENT_TYPE
+from octopus_sensing_visualizer.http_cache import available_encodings, negotiate_encoding, \
+    compress, compress_stream, dataset_version, make_etag, etag_matches
+from octopus_sensing_visualizer.export import EXPORT_FORMATS, export_signals
+from octopus_sensing_visualizer.metrics import METRICS, PROMETHEUS_CONTENT_TYPE, Timings, span, \
+    family_lines
+
+logger = logging.getLogger(__name__)
+
+# JSON responses with fewer values are serialized in the request thread, since
+# passing them to the compute pool would take longer
+OFFLOAD_MIN_VALUES = 10000
+
+# Default maximum number of open playback streams. Each one holds a request
+# thread for as long as it's open.
+MAX_STREAMS = 4
+
+# Names and paths of the arrays that EndPoint.share saved
+SHARED_STATE_FILE = "shared_state.json"
 
 
 class RootHandler():
@@ -25,172 +57,844 @@ class RootHandler():
 
 
 class EndPoint():
-    def __init__(self, config):
+    def __init__(self, config, compute_pool=None, shared=None, precompute=True,
+                 stream_slots=None):
+        '''
+        @param configparser.RawConfigParser config: visualizer's configuration
 
+        @keyword compute_pool.ComputePool compute_pool: where CPU-heavy parts of
+                 requests run. If None, they run in the request threads.
+        @keyword str shared: directory where another process shared its arrays
+                 with share(). They are memory mapped instead of loading the
+                 recordings.
+        @keyword bool precompute: whether to precompute the power bands that
+                 the config asks for, in the background. Shared end points get
+                 the ones the sharing process precomputed instead.
+        @keyword threading.BoundedSemaphore stream_slots: limits the open
+                 playback streams. By default, [SERVER] max_streams of config.
+        '''
+        self.compute_pool = compute_pool
+        self.stream_slots = stream_slots or threading.BoundedSemaphore(
+            config.getint('SERVER', 'max_streams', fallback=MAX_STREAMS))
         self.data = {}
         self.sampling_rate = {}
         self.data_length = 0
         self.eeg_channels = []
+        # Bands of the power_bands bar chart. None means the default bands.
+        self.eeg_bands = None
         self.__power_bands = []
+        self.pyramids = {}
+        self.spectrogram = None
+        # Registry of other datasets, served at /api/<dataset>/. See datasets.py.
+        self.datasets = None
+        # Power bands that another process precomputed and shared, as
+        # (window size, start times, array of starts * channels * bands)
+        self.__shared_power_bands = []
+        # Seconds each modality took to load, by phase, like {"EEG": {"read": 0.1}}
+        self.load_timings = {}
+        # Phases of the startup, like loading all the modalities in parallel
+        self.startup_timings = Timings()
+
+        sections = [section for section in config.sections() if section in modality_sections()]
+        self.live = config.getboolean('SERVER', 'live', fallback=False)
+        if self.live:
+            # Follow recordings while they are being written
+            modalities = [LiveModality(section, config) for section in sections]
+            with self.startup_timings.span("load"):
+                for modality in modalities:
+                    with modality.timings.span("read"):
+                        modality.update()
+            self._apply_modalities(modalities)
+            threading.Thread(target=self._follow_live_modalities,
+                             args=(modalities,
+                                   config.getfloat('SERVER', 'live_poll_interval', fallback=1)),
+                             daemon=True).start()
+        elif shared is not None:
+            with self.startup_timings.span("attach"):
+                self._attach(shared)
+            modalities = []
+        else:
+            parallel = config.getboolean('SERVER', 'parallel_loading', fallback=True)
+            with self.startup_timings.span("load"):
+                modalities = load_modalities(config, sections, parallel)
+            self._apply_modalities(modalities)
+
+            # Level of detail pyramids, for serving reduced windows of long recordings.
+            # Building them would page in all of a memory mapped recording, so
+            # their levels are built by the first request that needs them.
+            with self.startup_timings.span("pyramids"):
+                for key, value in self.data.items():
+                    if key != "power_bands":
+                        self.pyramids[key] = SignalPyramid(value)
+                        if not _is_memory_mapped(value):
+                            self.pyramids[key].build()
+
+        for section, modality in zip(sections, modalities):
+            self.load_timings[section] = modality.timings.durations
+            logger.info("Loaded %s: %s", section, modality.timings.header())
+        logger.info("Startup: %s", self.startup_timings.header())
+        if self._eeg_key() is not None:
+            # Imported now, instead of by the first request that needs power bands
+            importlib.import_module("octopus_sensing_visualizer.prepare_data.eeg")
+
+        # Power bands of every channel of recently requested windows
+        self.power_bands_cache = \
+            LRUCache(config.getint('EEG', 'power_bands_cache_size', fallback=4096))
+        for window_size, start_times, power_bands in self.__shared_power_bands:
+            for start_time, value in zip(start_times, power_bands):
+                self.power_bands_cache.put((start_time, window_size), value)
+        # Window sizes of the power bands to compute before they are requested
+        self.precompute_window_sizes = []
+        if "power_bands" in self.data and not self.live and \
+           config.has_option('EEG', 'precompute_power_bands'):
+            self.precompute_window_sizes = \
+                [int(window_size) for window_size in
+                 config.get('EEG', 'precompute_power_bands').split(",")]
+
+        # Content codings of responses, by preference, and their levels
+        self.encodings = available_encodings()
+        if config.has_option('SERVER', 'compression'):
+            enabled = [name.strip() for name in config.get('SERVER', 'compression').split(",")]
+            self.encodings = [name for name in self.encodings if name in enabled]
+        self.compression_levels = {
+            "gzip": config.getint('SERVER', 'gzip_level', fallback=None),
+            "br": config.getint('SERVER', 'brotli_level', fallback=None),
+            "zstd": config.getint('SERVER', 'zstd_level', fallback=None),
+        }
+        # Responses are the same as long as the recordings don't change, so they
+        # have ETags, and the recently sent ones are kept compressed
+        self.version = dataset_version(config)
+        self.cache_max_age = config.getint('SERVER', 'cache_max_age', fallback=60)
+        self.responses_cache = \
+            LRUCache(config.getint('SERVER', 'response_cache_size', fallback=256))
+        if precompute and shared is None and self.precompute_window_sizes:
+            threading.Thread(target=self.precompute_power_bands,
+                             args=(self.precompute_window_sizes,),
+                             daemon=True).start()
+
+    def _apply_modalities(self, modalities):
+        for modality in modalities:
+            self.data.update(modality.data)
+            self.sampling_rate.update(modality.sampling_rate)
+            if modality.data_length is not None:
+                self.data_length = modality.data_length
+            if modality.eeg_channels is not None:
+                self.eeg_channels = modality.eeg_channels
+            if modality.eeg_bands is not None:
+                self.eeg_bands = modality.eeg_bands
+            if modality.spectrogram is not None:
+                self.spectrogram = Spectrogram(modality.spectrogram,
+                                               **modality.spectrogram_parameters)
+
+    def share(self, directory):
+        '''
+        Saves the signals, their pyramids and the spectrogram as .npy files, so
+        EndPoints of other processes can memory map them (see the shared keyword
+        of the constructor) and the operating system keeps one copy of them in
+        memory. Recordings that are memory maps of the cache aren't copied.
+        Power bands in the cache, like the precomputed ones, are saved too.
+
+        @param str directory: an empty directory, preferably in shared memory
+                              like /dev/shm
+        '''
+        if self.live:
+            raise Exception("Live recordings can't be shared")
+        # Arrays that appear more than once, like a signal under two keys, are saved once
+        paths = {}
+
+        def save(array, name):
+            if id(array) not in paths:
+                paths[id(array)] = share_array(array, os.path.join(directory, name + ".npy"))
+            return paths[id(array)]
+
+        state = {
+            "data": {key: save(value, key) for key, value in self.data.items()},
+            "pyramids": {key: [[save(value, f"{key}.pyramid.{idx}.{kind}")
+                                for kind, value in zip(("low", "high", "mean"), level)]
+                               for idx, level in enumerate(pyramid.levels)]
+                         for key, pyramid in self.pyramids.items()},
+            "sampling_rate": self.sampling_rate,
+            "data_length": self.data_length,
+            "eeg_channels": list(self.eeg_channels),
+            "eeg_bands": self.eeg_bands,
+            "spectrogram": None,
+            "power_bands": [],
+            "load_timings": self.load_timings,
+        }
+        window_sizes = {}
+        for (start_time, window_size), value in self.power_bands_cache.items():
+            window_sizes.setdefault(window_size, []).append((start_time, value))
+        for window_size, entries in sorted(window_sizes.items()):
+            state["power_bands"].append(
+                [window_size, [start_time for start_time, _ in entries],
+                 save(np.stack([value for _, value in entries]),
+                      f"power_bands.{window_size}")])
+        if self.spectrogram is not None:
+            levels = {f"level_{idx}": save(level, f"spectrogram.{idx}")
+                      for idx, level in enumerate(self.spectrogram.levels)}
+            levels["db_range"] = save(np.array(self.spectrogram.db_range), "spectrogram.db_range")
+            state["spectrogram"] = {"levels": levels,
+                                    "sampling_rate": self.spectrogram.sampling_rate,
+                                    "window_samples": self.spectrogram.window_samples,
+                                    "hop_samples": self.spectrogram.hop_samples}
+        with open(os.path.join(directory, SHARED_STATE_FILE), "w", encoding="utf-8") as state_file:
+            json.dump(state, state_file)
+
+    def _attach(self, directory):
+        # Memory maps the arrays that share() saved, read-only
+        with open(os.path.join(directory, SHARED_STATE_FILE), encoding="utf-8") as state_file:
+            state = json.load(state_file)
+
+        def attach(path):
+            return np.load(path, mmap_mode="r")
+
+        self.data = {key: attach(path) for key, path in state["data"].items()}
+        self.sampling_rate = state["sampling_rate"]
+        self.data_length = state["data_length"]
+        self.eeg_channels = state["eeg_channels"]
+        self.eeg_bands = state["eeg_bands"]
+        self.load_timings = state["load_timings"]
+        self.__shared_power_bands = [(window_size, start_times, attach(path))
+                                     for window_size, start_times, path in state["power_bands"]]
+        self.pyramids = {
+            key: SignalPyramid(self.data[key],
+                               levels=[tuple(attach(path) for path in level) for level in levels])
+            for key, levels in state["pyramids"].items()}
+        if state["spectrogram"] is not None:
+            spectrogram = state["spectrogram"]
+            self.spectrogram = Spectrogram(
+                {key: attach(path) for key, path in spectrogram["levels"].items()},
+                spectrogram["sampling_rate"], spectrogram["window_samples"],
+                spectrogram["hop_samples"])
+
+    def _follow_live_modalities(self, modalities, poll_interval):
+        while True:
+            time.sleep(poll_interval)
+            for modality in modalities:
+                try:
+                    modality.update()
+                except Exception:
+                    logger.exception("Could not follow %s recording", modality.section)
+            self._apply_modalities(modalities)
+
+    def _eeg_key(self):
+        # Key of the EEG recording that power bands are computed from, if any
+        if "power_bands" in self.data:
+            return "power_bands"
+        if "eeg" in self.data:
+            return "eeg"
+        return None
+
+    def _eeg_band_names(self):
+        # EEG libraries are imported only when EEG is used. See modalities.
+        from octopus_sensing_visualizer.prepare_data.eeg import DEFAULT_EEG_BANDS
+        return list((self.eeg_bands or DEFAULT_EEG_BANDS).keys())
+
+    def _power_bands(self, start_time, window_size):
+        # Power bands of the window averaged over channels, for the bar chart
+        powers = np.mean(self._channel_power_bands(start_time, window_size), axis=0)
+        return {band: float(powers[idx]) for idx, band in enumerate(self._eeg_band_names())}
+
+    def _channel_power_bands(self, start_time, window_size):
+        # Power bands of every channel of the window. The bar chart and the topomap
+        # share them.
+        key = self._eeg_key()
+        end = (start_time + window_size) * self.sampling_rate[key]
+        if end > self.data[key].shape[-1]:
+            # A live recording that doesn't cover the window yet. It's not cached,
+            # since its result will change.
+            return self._compute_power_bands(start_time, window_size)
+        return self.power_bands_cache.get_or_compute(
+            (start_time, window_size),
+            lambda: self._compute_power_bands(start_time, window_size))
+
+    def _compute_power_bands(self, start_time, window_size, offload=True):
+        from octopus_sensing_visualizer.prepare_data.eeg import prepare_channel_power_bands
+        key = self._eeg_key()
+        sampling_rate = self.sampling_rate[key]
+        if not offload:
+            return prepare_channel_power_bands(self.data[key], sampling_rate, start_time,
+                                               window_size, eeg_bands=self.eeg_bands)
+        # Only the window is sent to the worker
+        window = self.data[key][:, start_time*sampling_rate:(start_time+window_size)*sampling_rate]
+        return self._offload(prepare_channel_power_bands, window, sampling_rate, 0,
+                             window_size, self.eeg_bands)
+
+    def _encode_json(self, output):
+        # Big windows are serialized in the compute pool, since it holds the GIL
+        values = sum(value.size for value in output.values() if isinstance(value, np.ndarray))
+        if values >= OFFLOAD_MIN_VALUES:
+            return self._offload(encode_json, output).encode("utf-8")
+        return encode_json(output).encode("utf-8")
 
-        for section in config.sections():
-            if section == "EEG":
-                self._load_eeg_data(config)
-            if section == "PPG":
-                self._load_ppg_data(config)
-            if section == "GSR":
-                self._load_gsr_data(config)
-
-    def _load_eeg_data(self, config):
-        eeg_path = config.get('EEG', 'path')
-        eeg_sampling_rate = config.getint('EEG', 'sampling_rate')
-        if not os.path.isfile(eeg_path):
-            raise Exception("EEG file path is not valid")
-        eeg_data, eeg_channels = prepare_eeg_data(eeg_path)
-        self.eeg_channels = eeg_channels
-        channels, samples = eeg_data.shape
-        self.data_length = (samples/eeg_sampling_rate)
-        if config.getboolean('EEG', 'display_signal') is True:
-            self.data["eeg"] = eeg_data
-            self.sampling_rate["eeg"] = eeg_sampling_rate
-
-        if config.getboolean('EEG', 'display_alpha_signal') is True or \
-           config.getboolean('EEG', 'display_beta_signal') is True or \
-           config.getboolean('EEG', 'display_gamma_signal') is True or \
-           config.getboolean('EEG', 'display_theta_signal') is True or \
-           config.getboolean('EEG', 'display_delta_signal') is True:
-            config_window_size = config.getint('EEG', 'window_size')
-            overlap = config.getint('EEG', 'overlap')
-            if config_window_size < 1:
-                raise Exception("Window size should be equal or bigger than 1 seconds")
-            if overlap > config_window_size:
-                raise Exception("overlap should be smaller than window size")
-
-            power_bands = \
-                prepare_power_bands(eeg_data,
-                                    eeg_sampling_rate,
-                                    config_window_size,
-                                    overlap)
-            if config.getboolean('EEG', 'display_alpha_signal') is True:
-                self.data["alpha_band"] = power_bands["Alpha"]
-                self.sampling_rate["alpha_band"] = 1
-            if config.getboolean('EEG', 'display_beta_signal') is True:
-                self.data["beta_band"] = power_bands["Beta"]
-                self.sampling_rate["beta_band"] = 1
-            if config.getboolean('EEG', 'display_gamma_signal') is True:
-                self.data["gamma_band"] = power_bands["Gamma"]
-                self.sampling_rate["gamma_band"] = 1
-            if config.getboolean('EEG', 'display_theta_signal') is True:
-                self.data["theta_band"] = power_bands["Theta"]
-                self.sampling_rate["theta_band"] = 1
-            if config.getboolean('EEG', 'display_delta_signal') is True:
-                self.data["delta_band"] = power_bands["Delta"]
-                self.sampling_rate["delta_band"] = 1
-
-        if config.getboolean('EEG', 'display_power_band_bars') is True:
-            # Later we will measure power bands based on this data and sampling rate
-            self.data["power_bands"] = eeg_data
-            self.sampling_rate["power_bands"] = eeg_sampling_rate
-
-
-    def _load_gsr_data(self, config):
-        gsr_path = config.get('GSR', 'path')
-        gsr_sampling_rate = config.getint('GSR', 'sampling_rate')
-        if not os.path.isfile(gsr_path):
-            raise Exception("GSR file path is not valid")
-        gsr_data = prepare_gsr_data(gsr_path)
-        samples, = gsr_data.shape
-        self.data_length = (samples/gsr_sampling_rate)
-        if config.getboolean('GSR', 'display_signal') is True:
-            self.data["gsr"] = gsr_data
-            self.sampling_rate["gsr"] = gsr_sampling_rate
-
-        if config.getboolean('GSR', 'display_phasic') is True or \
-           config.getboolean('GSR', 'display_tonic') is True:
-            phasic, tonic = \
-                prepare_phasic_tonic(gsr_data, gsr_sampling_rate)
-            if config.getboolean('GSR', 'display_phasic') is True:
-                self.data["gsr_phasic"] = phasic
-                self.sampling_rate["gsr_phasic"] = gsr_sampling_rate
-            if config.getboolean('GSR', 'display_tonic') is True:
-                self.data["gsr_tonic"] = tonic
-                self.sampling_rate["gsr_tonic"] = gsr_sampling_rate
-
-    def _load_ppg_data(self, config):
-        ppg_path = config.get('PPG', 'path')
-        ppg_sampling_rate = config.getint('PPG', 'sampling_rate')
-        if not os.path.isfile(ppg_path):
-            raise Exception("PPG file path is not valid")
-        ppg_data = prepare_ppg_data(ppg_path)
-        samples, = ppg_data.shape
-        self.data_length = (samples/ppg_sampling_rate)
-        if config.getboolean('PPG', 'display_signal') is True:
-            self.data["ppg"] = ppg_data
-            self.sampling_rate["ppg"] = ppg_sampling_rate
-
-        if config.getboolean('PPG', 'display_hr') is True or \
-           config.getboolean('PPG', 'display_hrv') is True or \
-           config.getboolean('PPG', 'display_breathing_rate') is True:
-            window_size = config.getint('PPG', 'window_size')
-            overlap = config.getint('PPG', 'overlap')
-            hr_components = \
-                prepare_ppg_components(ppg_data, ppg_sampling_rate,
-                                       window_size=window_size,
-                                       overlap=overlap)
-            if config.getboolean('PPG', 'display_hr') is True:
-                self.data["hr"] = hr_components["hr"]
-                self.sampling_rate["hr"] = 1
-            if config.getboolean('PPG', 'display_hrv') is True:
-                self.data["hrv"] = hr_components["hrv"]
-                self.sampling_rate["hrv"] = 1
-            if config.getboolean('PPG', 'display_breathing_rate') is True:
-                self.data["breathing_rate"] = hr_components["breathing_rate"]
-                self.sampling_rate["breathing_rate"] = 1
+    def _offload(self, function, *args):
+        # Runs function(*args) in the compute pool, if there is one. Requests of
+        # the same client with the same X-Scrub-Id header supersede each other, so
+        # while the user drags the slider only the latest position is computed.
+        if self.compute_pool is None:
+            return function(*args)
+        request = cherrypy.request
+        scrub_id = request.headers.get('X-Scrub-Id')
+        group = (request.remote.ip, scrub_id) if scrub_id else None
+        try:
+            with span("offload"):
+                return self.compute_pool.run(function, *args, group=group)
+        except ComputePoolFull:
+            raise _ServerBusy()
+        except futures.TimeoutError:
+            raise cherrypy.HTTPError(504, "Computing the response took too long")
+        except futures.CancelledError:
+            raise cherrypy.HTTPError(409, "Superseded by a newer request")
+
+    def precompute_power_bands(self, window_sizes):
+        '''
+        Fills the power bands cache for every start time the UI's playback can
+        request. It stops when the cache is full, so it never evicts anything.
+
+        @param list(int) window_sizes: window sizes in seconds
+        '''
+        eeg_length = self.data["power_bands"].shape[-1] // self.sampling_rate["power_bands"]
+        for window_size in window_sizes:
+            for start_time in range(0, eeg_length - window_size + 1):
+                if len(self.power_bands_cache) >= self.power_bands_cache.max_size:
+                    return
+                if (start_time, window_size) not in self.power_bands_cache:
+                    # It runs in the background, so it doesn't take workers of the
+                    # compute pool from requests
+                    self.power_bands_cache.put(
+                        (start_time, window_size),
+                        self._compute_power_bands(start_time, window_size, offload=False))
+
+    def _window_output(self, start_time, window_size, max_points=None, aggregate="min_max",
+                       keys=None, held=None):
+        # Window of every signal in keys (default: all), as get_data returns it.
+        # If held is a list of ranges (in seconds) the client already has, only the
+        # missing parts of the window are returned.
+        output = {}
+        sampling_rates = {}
+        if held is not None:
+            missing = _missing_ranges(start_time, start_time + window_size, held)
+            output["ranges"] = {}
+        for key, value in self.data.items():
+            if keys is not None and key not in keys:
+                continue
+            sampling_rate = self.sampling_rate[key]
+            start = start_time*sampling_rate
+            end = (start_time+window_size)*sampling_rate
+            if key == "power_bands":
+                with span("power_bands"):
+                    output[key] = self._power_bands(start_time, window_size)
+            elif held is not None:
+                with span("slice"):
+                    output[key], output["ranges"][key] = \
+                        _missing_samples(value, missing, sampling_rate)
+            elif max_points is None:
+                with span("slice"):
+                    output[key] = value[..., start:end]
+            else:
+                with span("downsample"):
+                    if key in self.pyramids:
+                        output[key], step = \
+                            self.pyramids[key].window(start, end, max_points, aggregate)
+                    else:
+                        output[key], step = downsample(value[..., start:end], max_points,
+                                                       aggregate)
+                sampling_rates[key] = sampling_rate / step
+
+        if max_points is not None:
+            output["sampling_rates"] = sampling_rates
+        return output
+
+    def _cached_response(self, parameters, content_type, produce):
+        # Sends the body that produce() returns, compressed with a coding the client
+        # accepts. Unless in live mode, the response has an ETag: if the client
+        # already has it, 304 is sent, and if it was sent recently, it's taken from
+        # the cache, so neither computing nor compressing is repeated.
+        request = cherrypy.request
+        response = cherrypy.response
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), self.encodings)
+        level = self.compression_levels.get(encoding)
+
+        response.headers['Content-Type'] = content_type
+        response.headers['Vary'] = 'Accept, Accept-Encoding'
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+
+        def produce_compressed():
+            body = produce()
+            with span("compress"):
+                return compress(body, encoding, level)
+
+        if self.live:
+            response.headers['Cache-Control'] = 'no-cache'
+            return produce_compressed()
+
+        etag = make_etag(self.version, parameters, encoding)
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = f'public, max-age={self.cache_max_age}'
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response.status = 304
+            return b""
+        return self.responses_cache.get_or_compute(etag, produce_compressed)
 
     @cherrypy.expose
     @cherrypy.tools.json_in()
-    def get_data(self):
-        body = cherrypy.request.json
+    def get_data(self, **query):
+        '''
+        Window of the signals. Parameters are either the JSON body of a POST
+        request, or the query string of a GET request (where 'held' is JSON).
+        GET responses can be cached by browsers and proxies.
+        '''
+        if cherrypy.request.method == 'POST':
+            body = cherrypy.request.json
+        else:
+            body = _data_query(query)
         start_time: Optional[int] = body.get('start_time')
         window_size: Optional[int] = body.get('window_size')
+        # Maximum number of samples of each signal. Longer signals are reduced on the
+        # server. It's usually the width of the chart in pixels.
+        max_points: Optional[int] = body.get('max_points')
+        # How samples are reduced: 'min_max' (default) or 'mean'
+        aggregate: str = body.get('aggregate', "min_max")
+        # Ranges of seconds, [[start, end], ...], the client already has. Only the
+        # rest of the window is sent, with the sample offset of each part in 'ranges'.
+        held: Optional[list] = body.get('held')
+        # Shorthand for held=[[start_time, since]]: the client has the window up to
+        # this second.
+        since: Optional[int] = body.get('since')
         if start_time is None or window_size is None:
             raise ValueError("Both 'start_time' and 'window_size' params are mandatory")
+        if since is not None:
+            held = (held or []) + [[start_time, since]]
+        if held is not None and max_points is not None:
+            raise ValueError("'held' and 'since' can't be used with 'max_points'")
+
+        binary = wants_binary(body.get('format'), cherrypy.request.headers.get('Accept'))
+        parameters = {"handler": "get_data", "start_time": start_time,
+                      "window_size": window_size, "max_points": max_points,
+                      "aggregate": aggregate, "held": held, "binary": binary}
+
+        def produce():
+            output = self._window_output(start_time, window_size, max_points, aggregate,
+                                         held=held)
+            if binary:
+                ranges = output.pop("ranges", None)
+                with span("serialize"):
+                    return encode_binary(output,
+                                         {"ranges": ranges} if ranges is not None else None)
+            return self._encode_json(output)
+
+        return self._cached_response(parameters,
+                                     BINARY_CONTENT_TYPE if binary else JSON_CONTENT_TYPE,
+                                     produce)
+
+    @cherrypy.expose
+    @cherrypy.config(**{'response.stream': True})
+    def stream(self, start_time, window_size, signals=None, interval=1):
+        '''
+        Server-Sent Events stream for playback.
+
+        The first 'window' event has the whole window at start_time, like
+        get_data. Then every interval seconds, the window moves one second forward
+        and an 'append' event has only the newly visible second of each signal,
+        and the power bands of the new window. An 'end' event is sent when the
+        window reaches the end of the recording (in live mode, it waits for more
+        data instead, and sends a comment on every interval to notice when the
+        client is gone). At most [SERVER] max_streams streams are open at once,
+        others get 503.
+
+        Each event's data is JSON: {"start_time": int, "data": {key: values}}
+
+        @param int start_time: start of the first window in seconds
+        @param int window_size: length of the window in seconds
+
+        @keyword str signals: comma separated keys of the signals to stream.
+                              Default is all of them. 'topomap' adds the power
+                              bands of every channel of the window, like
+                              get_topomap.
+        @keyword float interval: seconds between two events
+        '''
+        start_time = int(start_time)
+        window_size = int(window_size)
+        interval = float(interval)
+        keys = signals.split(",") if signals else list(self.data.keys())
+
+        if not self.stream_slots.acquire(blocking=False):
+            raise _ServerBusy()
+        # The request ends when the stream ends, the client is gone or on errors
+        cherrypy.request.hooks.attach('on_end_request', self.stream_slots.release)
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
 
+        def events():
+            output = self._window_output(start_time, window_size, keys=keys)
+            if "topomap" in keys and self._eeg_key() is not None:
+                output["topomap"] = self._channel_power_bands(start_time, window_size)
+            yield _server_sent_event("window", {"start_time": start_time, "data": output})
+
+            current = start_time
+            next_tick = time.monotonic()
+            while True:
+                next_tick += interval
+                time.sleep(max(0, next_tick - time.monotonic()))
+                if current + 1 + window_size > self.data_length:
+                    if self.live:
+                        # Writing fails if the client is gone, which ends the stream
+                        yield b": keep-alive\n\n"
+                        continue
+                    yield _server_sent_event("end", {"start_time": current})
+                    return
+                current += 1
+                output = self._new_second_output(current, window_size, keys)
+                yield _server_sent_event("append", {"start_time": current, "data": output})
+
+        return events()
+
+    @cherrypy.expose
+    @cherrypy.config(**{'response.stream': True})
+    def export(self, start_time=0, end_time=None, signals=None, format="npz"):
+        '''
+        Signals between start_time and end_time, to download. The response is
+        streamed a chunk at a time, so the memory it takes doesn't depend on the
+        length of the range. It's compressed with a content coding the client
+        accepts, like get_data.
+
+        Formats:
+          - 'csv': a 'time' column and a column per signal (per channel of
+            EEG). The signals should have the same sampling rate.
+          - 'npy': one signal. EEG is channels * samples.
+          - 'npz': an array per signal, like numpy.savez
+          - 'binary': the binary format of get_data, with 'sampling_rates',
+            'start_times' and 'columns' of the signals in the header's metadata
+
+        @keyword float start_time: start of the range in seconds
+        @keyword float end_time: end of the range in seconds. Default is the end
+                                 of the recording.
+        @keyword str signals: comma separated keys of the signals to export, like
+                              'eeg,gsr_phasic'. Default is all of them.
+        @keyword str format: 'csv', 'npy', 'npz' or 'binary'
+        '''
+        start_time = float(start_time)
+        end_time = float(end_time) if end_time is not None else self.data_length
+        # power_bands is the EEG that the bar chart is computed from
+        keys = signals.split(",") if signals else \
+            [key for key in self.data if key != "power_bands"]
+        unknown_keys = [key for key in keys if key not in self.data or key == "power_bands"]
+        if unknown_keys:
+            raise cherrypy.HTTPError(400, f"Unknown signals: {', '.join(unknown_keys)}")
+        if not keys:
+            raise cherrypy.HTTPError(400, "There are no signals to export")
+        if format not in EXPORT_FORMATS:
+            raise cherrypy.HTTPError(400, f"'format' should be one of: "
+                                          f"{', '.join(EXPORT_FORMATS)}")
+        if start_time < 0 or end_time <= start_time:
+            raise cherrypy.HTTPError(400, "'end_time' should be after 'start_time'")
+
+        arrays = {}
+        columns = {}
+        first_samples = {}
+        for key in keys:
+            value = self.data[key]
+            sampling_rate = self.sampling_rate[key]
+            start = min(round(start_time * sampling_rate), value.shape[-1])
+            end = min(round(end_time * sampling_rate), value.shape[-1])
+            arrays[key] = value[..., start:end]
+            columns[key] = list(self.eeg_channels) if value.ndim == 2 else [key]
+            first_samples[key] = start
+        try:
+            chunks = export_signals(format, arrays, columns, self.sampling_rate, first_samples)
+        except ValueError as error:
+            raise cherrypy.HTTPError(400, str(error))
+
+        response = cherrypy.response
+        encoding = negotiate_encoding(cherrypy.request.headers.get('Accept-Encoding'),
+                                      self.encodings)
+        response.headers['Content-Type'] = EXPORT_FORMATS[format]
+        extension = "bin" if format == "binary" else format
+        response.headers['Content-Disposition'] = \
+            f'attachment; filename="octopus_sensing_export.{extension}"'
+        response.headers['Vary'] = 'Accept-Encoding'
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        return compress_stream(chunks, encoding, self.compression_levels.get(encoding))
+
+    def _new_second_output(self, start_time, window_size, keys):
+        # The last second of the window at start_time, and its power bands
         output = {}
-        for key, value in self.data.items():
+        if "topomap" in keys and self._eeg_key() is not None:
+            output["topomap"] = self._channel_power_bands(start_time, window_size)
+        for key in keys:
+            if key not in self.data:
+                continue
+            if key == "power_bands":
+                output[key] = self._power_bands(start_time, window_size)
+                continue
             sampling_rate = self.sampling_rate[key]
-            start = start_time*sampling_rate
-            end = (start_time+window_size)*sampling_rate
-            if key == "eeg":
-                output[key] = \
-                    value[:, start:end].tolist()
-            elif key == "power_bands":
-                power_bands = \
-                    prepare_power_bands_on_the_fly(value,
-                                                   self.sampling_rate[key],
-                                                   start_time,
-                                                   window_size)
-                output[key] = power_bands
+            end = (start_time + window_size) * sampling_rate
+            output[key] = self.data[key][..., end - sampling_rate:end]
+        return output
 
+    @cherrypy.expose
+    def get_spectrogram(self, start_time, window_size, max_frames=512, max_frequency=None,
+                        channel=None, format=None):
+        '''
+        Spectrogram of the EEG between start_time and start_time + window_size.
+
+        The response has 'spectrogram' (frames * frequencies, each value is 0-255
+        between the dB values of 'db_range'), 'frequencies', 'start_time' (center
+        of the first frame in seconds) and 'frame_rate' (frames per second). In the
+        binary format, the values that are not arrays are in the header's metadata.
+
+        @param float start_time: start of the range in seconds
+        @param float window_size: length of the range in seconds
+
+        @keyword int max_frames: maximum number of frames. Longer ranges are served
+                                 from coarser time resolutions.
+        @keyword float max_frequency: higher frequencies are not returned
+        @keyword str channel: name or index of an EEG channel. Default is the
+                              average of all channels.
+        @keyword str format: 'json' or 'binary', like get_data
+        '''
+        if self.spectrogram is None:
+            raise cherrypy.HTTPError(404, "Spectrogram is not enabled")
+        start_time = float(start_time)
+        window_size = float(window_size)
+        max_frames = int(max_frames)
+        max_frequency = float(max_frequency) if max_frequency is not None else None
+        if channel is not None:
+            if channel in self.eeg_channels:
+                channel = list(self.eeg_channels).index(channel)
             else:
-                output[key] = \
-                    value[start:end].tolist()
-        json_out = json.dumps(output)
-        json_out = json_out.replace("NaN", "null")
-        return json_out
+                channel = int(channel)
+
+        binary = wants_binary(format, cherrypy.request.headers.get('Accept'))
+        parameters = {"handler": "get_spectrogram", "start_time": start_time,
+                      "window_size": window_size, "max_frames": max_frames,
+                      "max_frequency": max_frequency, "channel": channel, "binary": binary}
+
+        def produce():
+            frames, metadata = self.spectrogram.window(start_time, start_time + window_size,
+                                                       max_frames, max_frequency, channel)
+            output = {"spectrogram": frames, "frequencies": metadata.pop("frequencies")}
+            if binary:
+                return encode_binary(output, metadata)
+            return encode_json({**output, **metadata}).encode("utf-8")
+
+        return self._cached_response(parameters,
+                                     BINARY_CONTENT_TYPE if binary else JSON_CONTENT_TYPE,
+                                     produce)
+
+    @cherrypy.expose
+    def get_topomap(self, start_time, window_size, format=None):
+        '''
+        Relative power of each EEG band of every channel in a window, for drawing
+        a scalp map.
+
+        The response has 'power' (channels * bands), 'channels' and 'bands'. In
+        the binary format, 'channels' and 'bands' are in the header's metadata.
+        Results are cached per window, with the power band bars.
+
+        @param int start_time: start of the window in seconds
+        @param int window_size: length of the window in seconds
+
+        @keyword str format: 'json' or 'binary', like get_data
+        '''
+        if self._eeg_key() is None:
+            raise cherrypy.HTTPError(404, "EEG is not enabled")
+        start_time = int(start_time)
+        window_size = int(window_size)
+
+        binary = wants_binary(format, cherrypy.request.headers.get('Accept'))
+        parameters = {"handler": "get_topomap", "start_time": start_time,
+                      "window_size": window_size, "binary": binary}
+
+        def produce():
+            output = {"power": self._channel_power_bands(start_time, window_size)}
+            metadata = {"channels": list(self.eeg_channels), "bands": self._eeg_band_names()}
+            if binary:
+                return encode_binary(output, metadata)
+            return encode_json({**output, **metadata}).encode("utf-8")
+
+        return self._cached_response(parameters,
+                                     BINARY_CONTENT_TYPE if binary else JSON_CONTENT_TYPE,
+                                     produce)
+
+    def _cp_dispatch(self, vpath):
+        # /api/<dataset>/<handler> is handled by the end point of the dataset
+        if self.datasets is not None and vpath[0] in self.datasets:
+            return self.datasets.get(vpath.pop(0))
+        return None
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
+    def get_datasets(self):
+        if self.datasets is None:
+            raise cherrypy.HTTPError(404, "No datasets are configured")
+        return self.datasets.stats()
+
+    def memory_size(self):
+        '''
+        Returns the bytes taken by the signals, their built pyramids, the
+        spectrogram, and the power bands and responses in the caches. Memory
+        mapped arrays, like cached recordings, are not counted: their pages are
+        in the page cache, which the OS frees when it needs memory.
+
+        @rtype: int
+        '''
+        values = list(self.data.values())
+        for pyramid in self.pyramids.values():
+            # Pyramids that no request needed yet are not built
+            if pyramid.built:
+                for level in pyramid.levels:
+                    values.extend(level)
+        if self.spectrogram is not None:
+            values.extend(self.spectrogram.levels)
+        values.extend(value for _, value in self.power_bands_cache.items())
+        arrays = {}
+        for value in values:
+            if not _is_memory_mapped(value):
+                arrays[(value.__array_interface__['data'][0], value.nbytes)] = value
+        responses = sum(len(body) for _, body in self.responses_cache.items())
+        return sum(value.nbytes for value in arrays.values()) + responses
+
+    @cherrypy.expose
+    def metrics(self):
+        '''
+        Metrics in the Prometheus text format: latencies of requests and of their
+        phases, sizes of responses, cache hit rates and load times of modalities
+        '''
+        cherrypy.response.headers['Content-Type'] = PROMETHEUS_CONTENT_TYPE
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        return (METRICS.render() + "\n".join(self._state_metrics()) + "\n").encode("utf-8")
+
+    def _state_metrics(self):
+        # Metrics that are read from the state of the server when they are requested
+        caches = {"responses": self.responses_cache.stats(),
+                  "power_bands": self.power_bands_cache.stats()}
+        lines = []
+        for field, kind, help_text in (
+                ("hits", "counter", "Lookups of a cache that found the value"),
+                ("misses", "counter", "Lookups of a cache that didn't find the value"),
+                ("evictions", "counter", "Entries evicted from a cache"),
+                ("size", "gauge", "Entries in a cache")):
+            name = f"octopus_cache_{field}" + ("_total" if kind == "counter" else "")
+            lines.extend(family_lines(name, kind, help_text,
+                                      [({"cache": cache}, stats[field])
+                                       for cache, stats in caches.items()]))
+        lines.extend(family_lines(
+            "octopus_load_seconds", "gauge", "Time each modality took to load, by phase",
+            [({"modality": section, "phase": phase}, seconds)
+             for section, durations in self.load_timings.items()
+             for phase, seconds in durations.items()]))
+        lines.extend(family_lines(
+            "octopus_startup_seconds", "gauge", "Time each phase of the startup took",
+            [({"phase": phase}, seconds)
+             for phase, seconds in self.startup_timings.durations.items()]))
+        lines.extend(family_lines("octopus_memory_bytes", "gauge",
+                                  "Bytes taken by the signals, their pyramids and the caches",
+                                  [({}, self.memory_size())]))
+        if self.compute_pool is not None:
+            stats = self.compute_pool.stats()
+            lines.extend(family_lines("octopus_compute_pending", "gauge",
+                                      "Computations queued or running in the compute pool",
+                                      [({}, stats["pending"])]))
+            for field, help_text in (
+                    ("completed", "Computations done by the compute pool"),
+                    ("rejected", "Computations rejected because the compute pool was full"),
+                    ("timeouts", "Computations whose requests stopped waiting for them"),
+                    ("superseded", "Computations cancelled by a newer request")):
+                lines.extend(family_lines(f"octopus_compute_{field}_total", "counter", help_text,
+                                          [({}, stats[field])]))
+        if self.datasets is not None:
+            stats = self.datasets.stats()
+            lines.extend(family_lines("octopus_dataset_loads_total", "counter",
+                                      "Datasets loaded on demand", [({}, stats["loads"])]))
+            lines.extend(family_lines("octopus_dataset_load_seconds_total", "counter",
+                                      "Time spent loading datasets on demand",
+                                      [({}, stats["load_seconds"])]))
+            lines.extend(family_lines("octopus_dataset_hits_total", "counter",
+                                      "Requests to datasets that were already loaded",
+                                      [({}, stats["hits"])]))
+            lines.extend(family_lines("octopus_dataset_evictions_total", "counter",
+                                      "Datasets unloaded to stay in the memory budget",
+                                      [({}, stats["evictions"])]))
+            lines.extend(family_lines("octopus_dataset_memory_bytes", "gauge",
+                                      "Bytes taken by the loaded datasets",
+                                      [({}, stats["memory_size"])]))
+        return lines
+
+    @cherrypy.expose
     def get_metadata(self):
-        metadata = {}
-        metadata["enabled_graphs"] = list(self.data.keys())
-        metadata["data_length"] = self.data_length
-        metadata["sampling_rates"] = self.sampling_rate
-        if "eeg" in list(self.data.keys()):
-            metadata["eeg_channels"] = list(self.eeg_channels)
-        return metadata
-
-
-if __name__ == "__main__":
-    end_point = EndPoint("server/octopus_sensing_visualizer/config.conf")
-    output = end_point.get_data(10, 3)
+        def produce():
+            metadata = {}
+            metadata["enabled_graphs"] = list(self.data.keys())
+            metadata["data_length"] = self.data_length
+            metadata["sampling_rates"] = self.sampling_rate
+            if "eeg" in list(self.data.keys()):
+                metadata["eeg_channels"] = list(self.eeg_channels)
+            return encode_json(metadata).encode("utf-8")
+
+        return self._cached_response({"handler": "get_metadata"}, JSON_CONTENT_TYPE, produce)
+
+
+class _ServerBusy(cherrypy.HTTPError):
+    # 503 with a Retry-After header, which HTTPError would remove
+    def __init__(self):
+        super().__init__(503, "The server is busy, try again later")
+
+    def set_response(self):
+        super().set_response()
+        cherrypy.serving.response.headers['Retry-After'] = '1'
+
+
+def _is_memory_mapped(array):
+    # Whether array is a memory map of a file, or a view of one
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+def _data_query(query):
+    # Parameters of get_data from a query string
+    body = {}
+    for key in ('start_time', 'window_size', 'max_points', 'since'):
+        if key in query:
+            body[key] = int(query[key])
+    for key in ('aggregate', 'format'):
+        if key in query:
+            body[key] = query[key]
+    if 'held' in query:
+        body['held'] = json.loads(query['held'])
+    return body
+
+
+def _missing_ranges(start, end, held):
+    # Parts of [start, end) that aren't covered by any of the held ranges
+    missing = []
+    for held_start, held_end in sorted(held):
+        if held_start > start:
+            missing.append((start, min(held_start, end)))
+        start = max(start, held_end)
+        if start >= end:
+            return missing
+    missing.append((start, end))
+    return missing
+
+
+def _missing_samples(value, missing, sampling_rate):
+    # Samples of the missing ranges concatenated, and [offset, length] of each part
+    parts = []
+    ranges = []
+    for start, end in missing:
+        part = value[..., start*sampling_rate:end*sampling_rate]
+        parts.append(part)
+        ranges.append([start*sampling_rate, part.shape[-1]])
+    if not parts:
+        return value[..., 0:0], ranges
+    return np.concatenate(parts, axis=-1), ranges
+
+
+def _server_sent_event(event, data):
+    return f"event: {event}\ndata: {encode_json(data)}\n\n".encode("utf-8")
@@ -0,0 +1,172 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from octopus_sensing_visualizer.encoding import BINARY_CONTENT_TYPE, encode_binary_stream
+
+# Formats of exported signals, and their content types
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "npy": BINARY_CONTENT_TYPE,
+    "npz": "application/zip",
+    "binary": BINARY_CONTENT_TYPE,
+}
+
+# Maximum number of values of the signals that are read and converted at once.
+# It bounds the memory an export takes, however long the exported range is.
+CHUNK_VALUES = 1 << 20
+
+
+def export_signals(export_format: str, arrays, columns, sampling_rates, first_samples,
+                   chunk_values: int = CHUNK_VALUES):
+    '''
+    Writes signals in an export format, a chunk at a time
+
+    @param str export_format: one of EXPORT_FORMATS. 'csv' needs signals of the
+                              same sampling rate, and 'npy' one signal.
+    @param dict arrays: exported part of each signal, one or two dimensional
+                        (channels * samples). They are read a chunk at a time,
+                        so they can be memory maps.
+    @param dict columns: names of the rows of each array, like channel names,
+                         or the key for a one dimensional array
+    @param dict sampling_rates: sampling rate of each signal
+    @param dict first_samples: index of the first exported sample of each
+                               signal in the whole recording
+
+    @keyword int chunk_values: maximum number of values converted at once
+
+    @rtype: generator of bytes
+    '''
+    if export_format == "csv":
+        rates = set(sampling_rates[key] for key in arrays)
+        if len(rates) != 1:
+            raise ValueError("Signals exported as CSV should have the same sampling rate")
+        key = next(iter(arrays))
+        return export_csv(arrays, columns, rates.pop(), first_samples[key], chunk_values)
+    if export_format == "npy":
+        if len(arrays) != 1:
+            raise ValueError("Only one signal can be exported as npy")
+        return export_npy(next(iter(arrays.values())), chunk_values)
+    if export_format == "npz":
+        return export_npz(arrays, chunk_values)
+    if export_format == "binary":
+        metadata = {"sampling_rates": {key: sampling_rates[key] for key in arrays},
+                    "start_times": {key: first_samples[key] / sampling_rates[key]
+                                    for key in arrays},
+                    "columns": {key: columns[key] for key in arrays}}
+        return encode_binary_stream(arrays, metadata, chunk_values)
+    raise ValueError(f"Unknown export format '{export_format}'. It should be one of: "
+                     f"{', '.join(EXPORT_FORMATS)}")
+
+
+def export_csv(arrays, columns, sampling_rate: int, first_sample: int,
+               chunk_values: int = CHUNK_VALUES):
+    '''
+    Writes signals as CSV: a 'time' column in seconds from the start of the
+    recording, then a column per row of each signal. Missing values are empty.
+
+    @param dict arrays: one or two dimensional arrays of the same length
+    @param dict columns: names of the rows of each array
+    @param int sampling_rate: sampling rate of all the signals
+    @param int first_sample: index of the first row in the whole recording
+
+    @keyword int chunk_values: maximum number of values converted at once
+
+    @rtype: generator of bytes
+    '''
+    names = ["time"] + [name for key in arrays for name in columns[key]]
+    samples = next(iter(arrays.values())).shape[-1]
+    step = max(1, chunk_values // len(names))
+    yield (",".join(names) + "\n").encode("utf-8")
+    for start in range(0, samples, step):
+        end = min(start + step, samples)
+        rows = [(first_sample + np.arange(start, end)) / sampling_rate]
+        for array in arrays.values():
+            chunk = array[..., start:end]
+            rows.extend(chunk if chunk.ndim == 2 else [chunk])
+        # Columns are numbered, since names like channel names may repeat
+        frame = pd.DataFrame(dict(enumerate(rows)))
+        yield frame.to_csv(index=False, header=False).encode("utf-8")
+
+
+def export_npy(array: np.ndarray, chunk_values: int = CHUNK_VALUES):
+    '''
+    Writes an array in the .npy format. Two dimensional arrays (channels *
+    samples) are written in Fortran order, where the channels of a sample are
+    next to each other, so samples are written a chunk at a time. numpy.load
+    reads them as usual.
+
+    @param numpy.array array: one or two dimensional array
+
+    @keyword int chunk_values: maximum number of values converted at once
+
+    @rtype: generator of bytes
+    '''
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {
+        "descr": np.lib.format.dtype_to_descr(array.dtype),
+        "fortran_order": array.ndim == 2,
+        "shape": array.shape})
+    yield header.getvalue()
+    channels = array.shape[0] if array.ndim == 2 else 1
+    step = max(1, chunk_values // channels)
+    for start in range(0, array.shape[-1], step):
+        yield np.ascontiguousarray(array[..., start:start + step].T).tobytes()
+
+
+def export_npz(arrays, chunk_values: int = CHUNK_VALUES):
+    '''
+    Writes arrays in the .npz format of numpy.savez: an uncompressed ZIP file
+    with an .npy file per array. See export_npy.
+
+    @param dict arrays: one or two dimensional arrays
+
+    @keyword int chunk_values: maximum number of values converted at once
+
+    @rtype: generator of bytes
+    '''
+    output = _ChunkWriter()
+    # The ZIP file can't be seeked, so sizes are written after each member
+    with zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for key, array in arrays.items():
+            with archive.open(key + ".npy", mode="w", force_zip64=True) as member:
+                for chunk in export_npy(array, chunk_values):
+                    member.write(chunk)
+                    data = output.take()
+                    if data:
+                        yield data
+    yield output.take()
+
+
+class _ChunkWriter():
+    # A file that keeps what is written to it until it's taken
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
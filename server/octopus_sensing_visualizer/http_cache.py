@@ -0,0 +1,207 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import gzip
+import hashlib
+import json
+import os
+import zlib
+from typing import Any, Dict, Optional
+
+from octopus_sensing_visualizer.cache import CACHE_VERSION, library_version
+
+# Brotli and Zstandard are used if they are installed. gzip is always available.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Default compression level of each content coding
+DEFAULT_LEVELS = {"br": 5, "zstd": 3, "gzip": 6}
+
+# When the client accepts many codings equally, the first one of these is used
+_PREFERENCE = ["br", "zstd", "gzip"]
+
+
+def available_encodings():
+    '''
+    Returns the content codings that can be used, by preference
+
+    @rtype: list(str)
+    '''
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: Optional[str], encodings: list) -> Optional[str]:
+    '''
+    Chooses the content coding of a response from the Accept-Encoding header
+
+    @param str accept_encoding: value of the Accept-Encoding header of the request
+    @param list(str) encodings: codings the server can use
+
+    @rtype: str
+    @return: the chosen coding, or None to send the response as it is
+    '''
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.strip().partition(";")
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith("q="):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in sorted(encodings, key=_PREFERENCE.index):
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: Optional[str], level: Optional[int] = None) -> bytes:
+    '''
+    Compresses a response body with a content coding
+
+    @param bytes body: the response body
+    @param str encoding: 'br', 'zstd', 'gzip' or None to keep body as it is
+
+    @keyword int level: compression level. Default is DEFAULT_LEVELS of the coding.
+
+    @rtype: bytes
+    '''
+    if encoding is None:
+        return body
+    if level is None:
+        level = DEFAULT_LEVELS.get(encoding)
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    if encoding == "gzip":
+        # mtime=0 so the same body is always compressed to the same bytes
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    raise ValueError(f"Unknown content coding '{encoding}'")
+
+
+def compress_stream(chunks, encoding: Optional[str], level: Optional[int] = None):
+    '''
+    Compresses a streamed response body with a content coding, chunk by chunk
+
+    @param chunks: iterable of the bytes of the response body
+    @param str encoding: 'br', 'zstd', 'gzip' or None to keep chunks as they are
+
+    @keyword int level: compression level. Default is DEFAULT_LEVELS of the coding.
+
+    @rtype: generator of bytes
+    '''
+    if encoding is None:
+        return iter(chunks)
+    if level is None:
+        level = DEFAULT_LEVELS.get(encoding)
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        process, finish = compressor.process, compressor.finish
+    elif encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        process, finish = compressor.compress, compressor.flush
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    else:
+        raise ValueError(f"Unknown content coding '{encoding}'")
+
+    def compressed_chunks():
+        for chunk in chunks:
+            compressed = process(chunk)
+            # Compressors keep small inputs until they have a block
+            if compressed:
+                yield compressed
+        yield finish()
+
+    return compressed_chunks()
+
+
+def dataset_version(config) -> str:
+    '''
+    Returns a version of the data a config serves. It changes when the
+    recordings, the config or the code that prepares the data change.
+
+    @param configparser.RawConfigParser config: visualizer's configuration
+
+    @rtype: str
+    '''
+    parts = [CACHE_VERSION, library_version("octopus-sensing-visualizer")]
+    for section in sorted(config.sections()):
+        items = sorted(config.items(section))
+        parts.append([section, items])
+        path = config.get(section, 'path', fallback=None)
+        if path is not None and os.path.isfile(path):
+            stat = os.stat(path)
+            parts.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    return hashlib.blake2b(json.dumps(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def make_etag(version: str, parameters: Dict[str, Any], encoding: Optional[str]) -> str:
+    '''
+    Returns a strong ETag for a response. It's the same for the same dataset
+    version, request parameters and content coding.
+
+    @param str version: version of the dataset, see dataset_version
+    @param dict parameters: everything that changes the content of the response
+    @param str encoding: content coding of the response, or None
+
+    @rtype: str
+    '''
+    key = json.dumps([version, parameters], sort_keys=True).encode("utf-8")
+    tag = hashlib.blake2b(key, digest_size=16).hexdigest()
+    if encoding is not None:
+        # Each coding is a different representation, so it needs its own tag
+        tag += "-" + encoding
+    return f'"{tag}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    '''
+    Whether the If-None-Match header of a request matches etag, so the client's
+    copy is still valid
+
+    @param str if_none_match: value of the If-None-Match header
+    @param str etag: ETag of the response
+
+    @rtype: bool
+    '''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in tags
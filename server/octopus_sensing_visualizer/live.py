@@ -0,0 +1,301 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import io
+import os
+import logging
+
+import pandas as pd
+import numpy as np
+
+from octopus_sensing_visualizer.metrics import Timings
+from octopus_sensing_visualizer.modalities import get_modality
+
+logger = logging.getLogger(__name__)
+
+
+class GrowableArray():
+    '''
+    An array that grows along its last axis (time), like a list.
+
+    Capacity doubles when it's full, so appending is amortized O(appended).
+    Views returned by view() stay valid after the array grows, they just don't
+    see the new samples.
+    '''
+
+    def __init__(self, channels=None, dtype=np.float32, capacity: int = 1024):
+        '''
+        @keyword int channels: number of rows. None for a one dimensional array.
+        '''
+        shape = (capacity,) if channels is None else (channels, capacity)
+        self.__array = np.empty(shape, dtype=dtype)
+        self.length = 0
+
+    def view(self):
+        '''
+        @rtype: numpy.array
+        @return: the filled part of the array. It's not a copy.
+        '''
+        return self.__array[..., :self.length]
+
+    def append(self, values: np.ndarray):
+        self.write(self.length, values)
+
+    def write(self, offset: int, values: np.ndarray):
+        '''
+        Writes values from offset on, and drops everything after them.
+
+        @param int offset: index of the first written sample. It can't be bigger
+                           than the current length.
+        @param numpy.array values: samples to write
+        '''
+        if offset > self.length:
+            raise ValueError("Can't leave a gap in a GrowableArray")
+        end = offset + values.shape[-1]
+        capacity = self.__array.shape[-1]
+        if end > capacity:
+            while end > capacity:
+                capacity *= 2
+            grown = np.empty(self.__array.shape[:-1] + (capacity,), dtype=self.__array.dtype)
+            grown[..., :offset] = self.__array[..., :offset]
+            self.__array = grown
+        self.__array[..., offset:end] = values
+        self.length = end
+
+
+class CsvTail():
+    '''
+    Follows a CSV file that is being written, and parses only the new rows.
+    '''
+
+    def __init__(self, path: str, header: bool, usecols=None, dtype=np.float32,
+                 max_read_bytes: int = 64 * 1024 * 1024):
+        '''
+        @param str path: path to the CSV file
+        @param bool header: whether the first line has the column names
+
+        @keyword list(int) usecols: indices of the columns to read. Default is all.
+        @keyword dtype: type of the parsed rows
+        @keyword int max_read_bytes: maximum number of bytes parsed by each read
+        '''
+        self.path = path
+        self.header = header
+        self.usecols = usecols
+        self.dtype = dtype
+        self.max_read_bytes = max_read_bytes
+        self.columns = None
+        self.offset = 0
+
+    def read(self):
+        '''
+        Parses the complete rows that were appended since the last call
+
+        @rtype: numpy.array
+        @return: new rows (shape: columns * rows), or None if nothing was appended
+        '''
+        size = os.path.getsize(self.path)
+        if size < self.offset:
+            raise Exception(f"{self.path} was truncated while following it")
+        with open(self.path, "rb") as csv_file:
+            csv_file.seek(self.offset)
+            block = csv_file.read(min(size - self.offset, self.max_read_bytes))
+
+        # A partially written last row is left for the next read
+        end = block.rfind(b"\n")
+        if end < 0:
+            return None
+        block = block[:end + 1]
+        self.offset += end + 1
+
+        if self.header and self.columns is None:
+            header_end = block.index(b"\n")
+            header_line = block[:header_end + 1]
+            self.columns = list(pd.read_csv(io.BytesIO(header_line), usecols=self.usecols).columns)
+            block = block[header_end + 1:]
+        if not block.strip():
+            return None
+
+        rows = pd.read_csv(io.BytesIO(block), header=None, usecols=self.usecols)
+        return rows.to_numpy(dtype=self.dtype).T
+
+
+class WindowedFeatures():
+    '''
+    Keeps one-value-per-second features up to date while their signal grows.
+
+    compute takes a part of the signal and returns series in the layout of
+    prepare_power_bands and prepare_ppg_components: NaN for the first
+    window_size-1 seconds, one value per second, and a zero at the end. Only
+    the seconds that were not computed yet, plus margin seconds before them to
+    hide the edge effects of filters, are passed to compute.
+    '''
+
+    def __init__(self, compute, keys: dict, window_size: int, margin: int = 0):
+        '''
+        @param compute: function that takes a signal and returns a dict of series
+        @param dict keys: maps the keys of compute's output to the output keys
+        @param int window_size: window size of compute in seconds
+
+        @keyword int margin: extra seconds passed to compute
+        '''
+        self.compute = compute
+        self.keys = keys
+        self.window_size = window_size
+        self.margin = margin
+        self.series = {key: GrowableArray(dtype=np.float64) for key in keys.values()}
+        self.next_index = 0
+
+    def update(self, signal: np.ndarray, sampling_rate: int):
+        seconds = signal.shape[-1] // sampling_rate
+        start_second = max(0, self.next_index - self.window_size + 1 - self.margin)
+        # The last second of compute's output is never filled
+        last_index = seconds - 2
+        if last_index < self.next_index or seconds - start_second < self.window_size + 1:
+            return
+
+        try:
+            features = self.compute(signal[..., start_second*sampling_rate:seconds*sampling_rate])
+            for feature_key, key in self.keys.items():
+                values = features[feature_key][self.next_index - start_second:
+                                               last_index - start_second + 1]
+                self.series[key].append(np.asarray(values, dtype=np.float64))
+        except Exception as error:
+            # Like when no heart beats are found in a window
+            logger.warning("Could not compute %s: %s", list(self.keys.values()), error)
+            for key in self.keys.values():
+                self.series[key].append(np.full(last_index - self.next_index + 1, np.nan))
+        self.next_index = last_index + 1
+
+
+class SampleFeatures():
+    '''
+    Keeps features with the same sampling rate as their signal up to date while
+    the signal grows.
+
+    Filters look at samples on both sides, so the last margin seconds are
+    recomputed on every update until enough samples arrive after them.
+    '''
+
+    def __init__(self, compute, keys: dict, margin: int = 30):
+        '''
+        @param compute: function that takes a signal and returns a dict of signals
+        @param dict keys: maps the keys of compute's output to the output keys
+
+        @keyword int margin: seconds that are recomputed on each update
+        '''
+        self.compute = compute
+        self.keys = keys
+        self.margin = margin
+        self.series = {key: GrowableArray(dtype=np.float64) for key in keys.values()}
+        self.settled = 0
+
+    def update(self, signal: np.ndarray, sampling_rate: int):
+        margin = self.margin * sampling_rate
+        length = signal.shape[-1]
+        if length <= self.settled:
+            return
+        start = max(0, self.settled - margin)
+        try:
+            features = self.compute(signal[start:length])
+        except Exception as error:
+            # Usually the signal is still too short
+            logger.warning("Could not compute %s: %s", list(self.keys.values()), error)
+            return
+        for feature_key, key in self.keys.items():
+            values = np.asarray(features[feature_key], dtype=np.float64)
+            self.series[key].write(self.settled, values[self.settled - start:])
+        self.settled = max(self.settled, length - margin)
+
+
+class LiveModality():
+    '''
+    Follows the recording of one modality while Octopus Sensing is writing it.
+
+    Each update parses only the appended rows, appends them to a GrowableArray,
+    and updates derived signals over the new tail only.
+    '''
+
+    def __init__(self, section, config):
+        '''
+        @param str section: section of a registered modality, see modalities
+        @param configparser.RawConfigParser config: visualizer's configuration
+        '''
+        self.section = section
+        self.path = config.get(section, 'path')
+        self.signal_rate = config.getint(section, 'sampling_rate')
+        dtype = np.dtype(config.get(section, 'dtype', fallback='float32'))
+        is_eeg = section == "EEG"
+        self.reader = CsvTail(self.path, header=is_eeg, usecols=None if is_eeg else [0],
+                              dtype=dtype)
+        self.signal = None
+        self.dtype = dtype
+        self.features = []
+        self.sampling_rate = {}
+        self.eeg_bands = None
+        # Spectrograms are precomputed, so they're not available while recording
+        self.spectrogram = None
+        self.spectrogram_parameters = None
+        # How long reading the recording took at startup
+        self.timings = Timings()
+
+        get_modality(section).plugin().setup_live(self, config)
+
+    @property
+    def eeg_channels(self):
+        return self.reader.columns
+
+    @property
+    def data_length(self):
+        if self.signal is None:
+            return 0
+        return self.signal.length / self.signal_rate
+
+    def update(self):
+        '''
+        Parses the appended rows and updates derived signals
+
+        @rtype: bool
+        @return: True if there were new rows
+        '''
+        rows = self.reader.read()
+        if rows is None:
+            return False
+        while rows is not None:
+            if self.signal is None:
+                channels = rows.shape[0] if self.section == "EEG" else None
+                self.signal = GrowableArray(channels, dtype=self.dtype,
+                                            capacity=max(1024, rows.shape[-1]))
+            self.signal.append(rows if self.section == "EEG" else rows[0])
+            rows = self.reader.read()
+
+        signal = self.signal.view()
+        for features in self.features:
+            features.update(signal, self.signal_rate)
+        return True
+
+    @property
+    def data(self):
+        '''
+        @rtype: dict(str, numpy.array)
+        @return: current views of the enabled signals, keyed like get_data's output
+        '''
+        arrays = {}
+        signal = self.signal.view() if self.signal is not None else \
+            np.empty((len(self.eeg_channels or []), 0) if self.section == "EEG" else 0)
+        for key in self.sampling_rate:
+            arrays[key] = signal
+        for features in self.features:
+            for key, series in features.series.items():
+                if key in self.sampling_rate:
+                    arrays[key] = series.view()
+        return arrays
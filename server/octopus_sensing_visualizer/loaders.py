@@ -0,0 +1,191 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import os
+import shutil
+import tempfile
+import configparser
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from octopus_sensing_visualizer.metrics import Timings
+from octopus_sensing_visualizer.modalities import get_modality
+
+
+class ModalityLoader():
+    '''
+    Loads the recording of one modality and its derived signals.
+
+    After load, data and sampling_rate hold the signals to display, keyed like
+    the output of EndPoint.get_data. spectrogram holds the levels of the EEG
+    spectrogram, if it's enabled, and spectrogram_parameters how they were made.
+    timings holds how long reading the recording and each of its features took.
+    '''
+
+    def __init__(self):
+        self.data = {}
+        self.sampling_rate = {}
+        self.data_length = None
+        self.eeg_channels = None
+        self.eeg_bands = None
+        self.spectrogram = None
+        self.spectrogram_parameters = None
+        self.timings = Timings()
+
+    def load(self, section, config):
+        '''
+        @param str section: section of a registered modality, see modalities
+        @param configparser.RawConfigParser config: visualizer's configuration
+        '''
+        modality = get_modality(section)
+        with self.timings.span("total"):
+            modality.plugin().load(self, config)
+        unknown_keys = set(self.data) - modality.keys
+        if unknown_keys:
+            raise Exception(f"{section} loaded signals it didn't register: "
+                            f"{', '.join(sorted(unknown_keys))}")
+
+
+def use_cache(config):
+    '''
+    Whether recordings are converted to memory mapped .npy files, and derived
+    features are saved next to them. It's enabled unless the config disables it.
+
+    @rtype: bool
+    '''
+    return config.getboolean('SERVER', 'cache', fallback=True)
+
+
+def recording_dtype(config, section):
+    '''
+    Type of a loaded recording. float32 halves the memory of float64.
+
+    @rtype: str
+    '''
+    return np.dtype(config.get(section, 'dtype', fallback='float32')).name
+
+
+def load_modalities(config, sections, parallel=True):
+    '''
+    Loads the given modalities, each one in a separate process if parallel is True.
+
+    Arrays are passed back from the worker processes through .npy files that are
+    memory mapped here, instead of pickling them. Arrays that are already memory
+    maps of the cache are passed by their file name.
+
+    @param configparser.RawConfigParser config: visualizer's configuration
+    @param list(str) sections: modalities to load
+    @keyword bool parallel: whether to load modalities in parallel
+
+    @rtype: list(ModalityLoader)
+    @return: loaded modalities, in the same order as sections
+    '''
+    if not parallel or len(sections) < 2:
+        modalities = []
+        for section in sections:
+            modality = ModalityLoader()
+            modality.load(section, config)
+            modalities.append(modality)
+        return modalities
+
+    config_dict = {section: dict(config.items(section)) for section in config.sections()}
+    temp_dir = tempfile.mkdtemp(prefix="octopus_sensing_visualizer_")
+    try:
+        with ProcessPoolExecutor(max_workers=len(sections)) as executor:
+            futures = [executor.submit(_load_in_worker, section, config_dict, temp_dir)
+                       for section in sections]
+            results = []
+            errors = []
+            for section, future in zip(sections, futures):
+                try:
+                    results.append(future.result())
+                except Exception as error:
+                    errors.append(f"{section}: {error}")
+        if errors:
+            raise Exception("Could not load some of the modalities:\n" + "\n".join(errors))
+
+        modalities = []
+        for result in results:
+            modality = ModalityLoader()
+            modality.data = {key: np.load(path, mmap_mode="r")
+                             for key, path in result["data"].items()}
+            modality.sampling_rate = result["sampling_rate"]
+            modality.data_length = result["data_length"]
+            modality.eeg_channels = result["eeg_channels"]
+            modality.eeg_bands = result["eeg_bands"]
+            if result["spectrogram"] is not None:
+                modality.spectrogram = {key: np.load(path, mmap_mode="r")
+                                        for key, path in result["spectrogram"].items()}
+            modality.spectrogram_parameters = result["spectrogram_parameters"]
+            modality.timings.durations = result["timings"]
+            modalities.append(modality)
+        return modalities
+    finally:
+        # Memory maps stay valid after their files are removed (except on Windows,
+        # where the files are left for the OS to clean up)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _load_in_worker(section, config_dict, temp_dir):
+    config = configparser.RawConfigParser(allow_no_value=True)
+    config.read_dict(config_dict)
+    modality = ModalityLoader()
+    modality.load(section, config)
+
+    paths = {key: share_array(value, os.path.join(temp_dir, f"{section}.{key}.npy"))
+             for key, value in modality.data.items()}
+    spectrogram_paths = None
+    if modality.spectrogram is not None:
+        spectrogram_paths = {
+            key: share_array(value, os.path.join(temp_dir, f"{section}.spectrogram.{key}.npy"))
+            for key, value in modality.spectrogram.items()}
+    return {"data": paths,
+            "sampling_rate": modality.sampling_rate,
+            "data_length": modality.data_length,
+            "eeg_channels": modality.eeg_channels,
+            "eeg_bands": modality.eeg_bands,
+            "spectrogram": spectrogram_paths,
+            "spectrogram_parameters": modality.spectrogram_parameters,
+            "timings": modality.timings.durations}
+
+
+def share_array(array, path):
+    '''
+    Returns a .npy file that other processes can memory map to get array
+
+    @param numpy.array array: the array to share
+    @param str path: where array is saved, unless it's a whole memory map of a
+                     cache file, which is returned instead
+
+    @rtype: str
+    '''
+    cached_file = _cached_file_of(array)
+    if cached_file is not None:
+        return cached_file
+    np.save(path, array)
+    return path
+
+
+def _cached_file_of(array):
+    # The .npy file that array is a whole memory map of, if any
+    if not isinstance(array, np.memmap) or array.filename is None:
+        return None
+    # Like the files of load_modalities' workers, which are removed after loading
+    if not os.path.isfile(array.filename):
+        return None
+    whole = np.load(array.filename, mmap_mode="r")
+    if whole.shape != array.shape or whole.dtype != array.dtype or \
+       whole.offset != array.offset or whole.strides != array.strides:
+        return None
+    return array.filename
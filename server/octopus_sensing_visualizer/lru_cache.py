@@ -0,0 +1,105 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache():
+    '''
+    A thread-safe, bounded cache that evicts the least recently used entries.
+
+    It counts hits and misses, so its efficiency can be reported.
+    '''
+
+    def __init__(self, max_size: int):
+        '''
+        @param int max_size: maximum number of entries. Zero disables the cache.
+        '''
+        if max_size < 0:
+            raise ValueError("'max_size' should not be negative")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self.__entries
+
+    def get(self, key: Hashable, default: Any = None):
+        '''
+        Returns the cached value of key, or default if it's not cached
+        '''
+        with self.__lock:
+            if key in self.__entries:
+                self.hits += 1
+                self.__entries.move_to_end(key)
+                return self.__entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        '''
+        Caches value, evicting the least recently used entries if it's full
+        '''
+        if self.max_size == 0:
+            return
+        with self.__lock:
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]):
+        '''
+        Returns the cached value of key. If it's not cached, computes and caches it.
+        Computation happens outside of the lock, so other threads are not blocked.
+        '''
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def items(self):
+        '''
+        Returns the cached keys and values, the least recently used first. It
+        doesn't count as an access.
+
+        @rtype: list(tuple)
+        '''
+        with self.__lock:
+            return list(self.__entries.items())
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self):
+        '''
+        @rtype: dict
+        @return: size, max_size, hits, misses and evictions of the cache
+        '''
+        return {"size": len(self.__entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
@@ -14,15 +14,36 @@
 
 import os
 import sys
+import shutil
+import signal
+import socket
+import argparse
+import logging
+import tempfile
+import threading
+import multiprocessing
 import cherrypy
 import configparser
+from cheroot import wsgi
 from octopus_sensing_visualizer.end_point import *
+from octopus_sensing_visualizer.cache import clear_cache
+from octopus_sensing_visualizer.modalities import modality_sections
+from octopus_sensing_visualizer.datasets import DatasetRegistry, find_datasets
+from octopus_sensing_visualizer.compute_pool import ComputePool
+from octopus_sensing_visualizer.metrics import CONSTANT_LABELS
 
 CONFIG_FILE_PATH="./octopus_sensing_visualizer_config.conf"
 
+
 def main():
-    ui_build_path = os.path.join(os.path.dirname(
-        os.path.abspath(sys.modules[__name__].__file__)), 'ui_build')
+    parser = argparse.ArgumentParser(prog="octopus-sensing-visualizer")
+    subparsers = parser.add_subparsers(dest="command")
+    cache_parser = subparsers.add_parser(
+        "cache", help="manage the cache of converted recordings and derived features")
+    cache_parser.add_argument("action", choices=["prewarm", "clear"])
+    args = parser.parse_args()
+
+    _configure_logging()
 
     if not os.path.isfile(CONFIG_FILE_PATH):
         raise Exception("I need a config file called octopus_sensing_visualizer_config.conf")
@@ -31,10 +52,127 @@ def main():
     config = configparser.RawConfigParser(allow_no_value=True)
     config.read(CONFIG_FILE_PATH)
 
+    if args.command == "cache":
+        manage_cache(config, args.action)
+    elif config.getint('SERVER', 'processes', fallback=1) > 1:
+        serve_processes(config, config.getint('SERVER', 'processes'))
+    else:
+        serve(config)
+
+
+def manage_cache(config, action):
+    if action == "prewarm":
+        # Loading everything once fills the cache
+        EndPoint(config)
+    elif action == "clear":
+        for section in modality_sections():
+            if config.has_option(section, 'path'):
+                clear_cache(config.get(section, 'path'))
+
+
+def serve_processes(config, processes):
+    '''
+    Serves from several processes, to use more than one core for requests.
+
+    The recordings are loaded once, and their arrays, pyramids and spectrogram
+    are shared with the worker processes as memory mapped files in shared
+    memory, so adding workers barely adds memory. Workers listen on the same
+    port with SO_REUSEPORT, and the kernel balances connections between them.
+    The power bands of [EEG] precompute_power_bands are computed once, before
+    the workers start, and shared with them too.
+
+    Everything else is per worker: each one has its own response and power
+    bands caches, its own metrics, labelled with worker="<index>", and its own
+    DatasetRegistry, which loads the datasets of [DATASETS] separately in each
+    worker and applies memory_budget to each worker on its own.
+
+    @param configparser.RawConfigParser config: visualizer's configuration
+    @param int processes: number of worker processes
+    '''
+    if config.getboolean('SERVER', 'live', fallback=False):
+        raise Exception("Live recordings can't be served by more than one process")
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise Exception("Serving from more than one process needs SO_REUSEPORT, "
+                        "which this platform doesn't have")
+
+    # /dev/shm is in memory, so nothing is written to disk
+    shared_memory_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    directory = tempfile.mkdtemp(prefix="octopus_sensing_visualizer_", dir=shared_memory_dir)
+    workers = []
+    # Stopping the server stops the workers and removes the shared files
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        end_point = EndPoint(config, precompute=False)
+        end_point.precompute_power_bands(end_point.precompute_window_sizes)
+        end_point.share(directory)
+        # Workers map the shared files. Copies held here aren't needed anymore.
+        del end_point
+
+        config_dict = {section: dict(config.items(section)) for section in config.sections()}
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=_serve_worker, args=(config_dict, directory, index))
+                   for index in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _configure_logging():
+    # Only the logs of this package. CherryPy already writes its own logs to the
+    # screen, so a handler on the root logger would print them twice.
+    logger = logging.getLogger("octopus_sensing_visualizer")
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+
+
+def _serve_worker(config_dict, directory, index):
+    _configure_logging()
+    config = configparser.RawConfigParser(allow_no_value=True)
+    config.read_dict(config_dict)
+    # Each worker has its own metrics, so their samples are told apart
+    CONSTANT_LABELS["worker"] = str(index)
+    try:
+        serve(config, shared=directory)
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(config, shared=None):
+    '''
+    Serves the UI and the API until the server is stopped
+
+    @param configparser.RawConfigParser config: visualizer's configuration
+
+    @keyword str shared: directory of the arrays that serve_processes shared. If
+             it's given, this is one of its workers.
+    '''
+    ui_build_path = os.path.join(os.path.dirname(
+        os.path.abspath(sys.modules[__name__].__file__)), 'ui_build')
+
     port = 8080
     if config.has_option('SERVER', 'port'):
         port = int(config.get('SERVER', 'port'))
 
+    # Each playback stream holds a request thread for as long as it's open, so
+    # there are threads for them on top of the ones of other requests
+    max_streams = config.getint('SERVER', 'max_streams', fallback=MAX_STREAMS)
+    stream_slots = threading.BoundedSemaphore(max_streams)
+    cherrypy.server.thread_pool = \
+        config.getint('SERVER', 'thread_pool', fallback=10) + max_streams
+
     cherrypy.tree.mount(RootHandler(), '/', config={
         '/': {
             'tools.staticdir.on': True,
@@ -42,11 +180,53 @@ def main():
             'tools.staticdir.index': 'index.html',
         },
     })
-    end_point = EndPoint(config)
-    cherrypy.tree.mount(end_point, '/api')
+    # Worker processes for power bands and big JSON responses. Zero disables them.
+    # When there are many serving processes, by default they compute themselves.
+    compute_pool = None
+    workers = config.getint('SERVER', 'compute_workers',
+                            fallback=min(4, os.cpu_count() or 1) if shared is None else 0)
+    if workers > 0:
+        compute_pool = ComputePool(
+            workers,
+            config.getint('SERVER', 'compute_queue_size', fallback=None),
+            config.getfloat('SERVER', 'request_timeout', fallback=30),
+            preload=["octopus_sensing_visualizer.prepare_data.eeg",
+                     "octopus_sensing_visualizer.encoding"])
+        cherrypy.engine.subscribe('start', compute_pool.start)
+        cherrypy.engine.subscribe('stop', compute_pool.shutdown)
+
+    end_point = EndPoint(config, compute_pool, shared=shared, stream_slots=stream_slots)
+    if config.has_section('DATASETS'):
+        # Memory budget of the loaded datasets, in megabytes
+        memory_budget = config.getint('DATASETS', 'memory_budget', fallback=None)
+        end_point.datasets = DatasetRegistry(
+            find_datasets(config),
+            # Precomputing would keep evicted datasets referenced by its thread
+            lambda dataset_config: EndPoint(dataset_config, compute_pool, precompute=False,
+                                            stream_slots=stream_slots),
+            memory_budget * 2**20 if memory_budget is not None else None)
+    cherrypy.tree.mount(end_point, '/api', config={
+        '/': {
+            # Server-Timing headers and the metrics of /api/metrics
+            'tools.metrics.on': config.getboolean('SERVER', 'metrics', fallback=True),
+        },
+    })
 
     cherrypy.server.socket_host = '0.0.0.0'
     cherrypy.server.socket_port = port
     cherrypy.engine.autoreload.on = False
+    if shared is not None:
+        _listen_on_shared_port(port)
     cherrypy.engine.start()
     cherrypy.engine.block()
+
+
+def _listen_on_shared_port(port):
+    # Replaces CherryPy's HTTP server with one that shares its port with the other
+    # workers. CherryPy's waits for the port to be free, so it can't.
+    server = wsgi.Server(('0.0.0.0', port), cherrypy.tree,
+                         numthreads=cherrypy.server.thread_pool, reuse_port=True)
+    cherrypy.server.unsubscribe()
+    cherrypy.engine.subscribe(
+        'start', lambda: threading.Thread(target=server.safe_start, daemon=True).start())
+    cherrypy.engine.subscribe('stop', server.stop)
@@ -0,0 +1,272 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence
+
+import cherrypy
+
+# Upper bounds of the buckets of durations, in seconds, and of sizes, in bytes
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = tuple(1024 * 4**power for power in range(10))
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Labels of every sample, like the worker process that serves the metrics when
+# the server has many processes (see main.serve_processes)
+CONSTANT_LABELS: Dict[str, str] = {}
+
+
+class Timings():
+    '''
+    Durations of the phases of a request, or of loading a modality. Durations of
+    spans with the same name are added up.
+    '''
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float):
+        self.durations[name] = self.durations.get(name, 0) + seconds
+
+    def header(self):
+        '''
+        @rtype: str
+        @return: value of the Server-Timing header, with durations in milliseconds
+        '''
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}"
+                         for name, seconds in self.durations.items())
+
+
+class Histogram():
+    '''
+    Counts of observed values in cumulative buckets, like Prometheus histograms
+    '''
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        # The last count is of values bigger than every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics():
+    '''
+    Thread-safe counters and histograms of the server, rendered in the Prometheus
+    text format. Observing a value is a dictionary lookup and a few additions
+    under a lock, so they can be always on.
+    '''
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # name: (type, help, buckets, {labels: value or Histogram})
+        self.__families = {}
+
+    def describe(self, name: str, kind: str, help_text: str,
+                 buckets: Optional[Sequence[float]] = None):
+        '''
+        Declares a metric
+
+        @param str name: name of the metric
+        @param str kind: 'counter', 'gauge' or 'histogram'
+        @param str help_text: description of the metric
+        @keyword buckets: upper bounds of the buckets of a histogram
+        '''
+        if kind == "histogram" and buckets is None:
+            raise ValueError("Histograms need buckets")
+        with self.__lock:
+            self.__families[name] = (kind, help_text, buckets, {})
+
+    def observe(self, name: str, value: float, **labels):
+        '''Adds value to a histogram'''
+        _, _, buckets, series = self.__families[name]
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        '''Adds value to a counter'''
+        _, _, _, series = self.__families[name]
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            series[key] = series.get(key, 0) + value
+
+    def render(self):
+        '''
+        @rtype: str
+        @return: every metric in the Prometheus text format
+        '''
+        lines = []
+        with self.__lock:
+            for name, (kind, help_text, _, series) in self.__families.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in series.items():
+                    labels = dict(key)
+                    if kind == "histogram":
+                        lines.extend(_histogram_lines(name, labels, value))
+                    else:
+                        lines.append(sample_line(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+def family_lines(name: str, kind: str, help_text: str, samples):
+    '''
+    A metric in the Prometheus text format, for values that are read when metrics
+    are requested instead of being collected in METRICS
+
+    @param str name: name of the metric
+    @param str kind: 'counter' or 'gauge'
+    @param str help_text: description of the metric
+    @param samples: (labels, value) pairs, where labels is a dictionary
+
+    @rtype: list(str)
+    '''
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + \
+        [sample_line(name, labels, value) for labels, value in samples]
+
+
+def sample_line(name: str, labels: Dict[str, str], value: float):
+    '''
+    One sample in the Prometheus text format, like 'name{label="value"} 1.0'
+    '''
+    labels = {**CONSTANT_LABELS, **labels}
+    if labels:
+        label_text = ",".join(f'{label}="{_escape(str(label_value))}"'
+                              for label, label_value in labels.items())
+        return f"{name}{{{label_text}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+def _histogram_lines(name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield sample_line(f"{name}_bucket", {**labels, "le": _number(bound)}, cumulative)
+    yield sample_line(f"{name}_bucket", {**labels, "le": "+Inf"}, histogram.count)
+    yield sample_line(f"{name}_sum", labels, histogram.sum)
+    yield sample_line(f"{name}_count", labels, histogram.count)
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+# Metrics of the whole process, shared by every dataset
+METRICS = Metrics()
+METRICS.describe("octopus_requests_total", "counter",
+                 "Requests to the API, by handler and status code")
+METRICS.describe("octopus_request_duration_seconds", "histogram",
+                 "Time to produce the response of a request, by handler", DURATION_BUCKETS)
+METRICS.describe("octopus_response_size_bytes", "histogram",
+                 "Size of the response bodies, after compression, by handler", SIZE_BUCKETS)
+METRICS.describe("octopus_phase_duration_seconds", "histogram",
+                 "Time spent in each phase of a request, like slicing or serializing",
+                 DURATION_BUCKETS)
+
+# Timings of the request being handled by this thread, if any
+_request = threading.local()
+
+
+@contextmanager
+def span(name: str):
+    '''
+    Measures a phase of the current request, for its Server-Timing header and the
+    octopus_phase_duration_seconds histogram. Outside of requests, it does nothing.
+
+    @param str name: name of the phase, like 'slice'
+    '''
+    timings = getattr(_request, "timings", None)
+    if timings is None:
+        yield
+        return
+    with timings.span(name):
+        yield
+
+
+class MetricsTool(cherrypy.Tool):
+    '''
+    CherryPy tool that times requests. It adds the Server-Timing header to the
+    responses and updates METRICS. Enabled with 'tools.metrics.on'.
+    '''
+
+    def __init__(self):
+        super().__init__('on_start_resource', self._start, priority=10)
+
+    def _setup(self):
+        super()._setup()
+        hooks = cherrypy.serving.request.hooks
+        hooks.attach('before_finalize', self._finish, priority=90)
+        hooks.attach('after_error_response', self._finish, priority=90)
+
+    def _start(self):
+        _request.timings = Timings()
+        _request.started = time.perf_counter()
+        # Later, other tools may have wrapped the handler
+        handler = cherrypy.serving.request.handler
+        _request.handler = getattr(getattr(handler, "callable", None), "__name__", "unknown")
+
+    def _finish(self):
+        timings = getattr(_request, "timings", None)
+        if timings is None:
+            return
+        _request.timings = None
+        total = time.perf_counter() - _request.started
+
+        response = cherrypy.serving.response
+        handler = _request.handler
+        # The status is set by the handler only if it's not 200
+        status = str(response.status or 200).split(" ", 1)[0]
+
+        for phase, seconds in timings.durations.items():
+            METRICS.observe("octopus_phase_duration_seconds", seconds, phase=phase)
+        timings.add("total", total)
+        response.headers['Server-Timing'] = timings.header()
+
+        METRICS.increment("octopus_requests_total", handler=handler, code=status)
+        METRICS.observe("octopus_request_duration_seconds", total, handler=handler)
+        # Streamed bodies aren't produced yet, so their size isn't known
+        if isinstance(response.body, list):
+            METRICS.observe("octopus_response_size_bytes",
+                            sum(len(chunk) for chunk in response.body), handler=handler)
+
+
+cherrypy.tools.metrics = MetricsTool()
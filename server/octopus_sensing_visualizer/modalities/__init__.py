@@ -0,0 +1,99 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+'''
+Registry of the modalities (kinds of sensors) the visualizer can show.
+
+Each modality is a plugin module that is imported only when a config has its
+section, so the libraries it needs (like neurokit2 for GSR) are never imported
+for configs without it. A plugin module defines:
+
+  - load(loader, config): reads the recording of the modality and its derived
+    signals into a loaders.ModalityLoader
+  - setup_live(modality, config): prepares a live.LiveModality to follow the
+    recording while it's being written
+
+Adding a sensor is writing its module and registering it with register_modality.
+'''
+import importlib
+from typing import Iterable
+
+
+class Modality():
+    '''
+    A registered modality: its config section, its plugin module, and the keys
+    of the signals it can add to the output of get_data.
+    '''
+
+    def __init__(self, section: str, module: str, keys: Iterable[str]):
+        self.section = section
+        self.module = module
+        self.keys = frozenset(keys)
+
+    def plugin(self):
+        '''
+        Imports the plugin module. It's imported once, later calls are cheap.
+        '''
+        return importlib.import_module(self.module)
+
+
+# Modalities by their config section, in the order they were registered
+_MODALITIES = {}
+
+
+def register_modality(section: str, module: str, keys: Iterable[str]):
+    '''
+    Registers a modality
+
+    @param str section: its section in the config, like 'EEG'
+    @param str module: full name of its plugin module. It's not imported until a
+                       config has the section.
+    @param keys: keys of the signals it adds to the output of get_data
+
+    @rtype: Modality
+    '''
+    modality = Modality(section, module, keys)
+    for other in _MODALITIES.values():
+        if other.section != section and modality.keys & other.keys:
+            raise ValueError(f"'{section}' and '{other.section}' both produce "
+                             f"{', '.join(sorted(modality.keys & other.keys))}")
+    _MODALITIES[section] = modality
+    return modality
+
+
+def modality_sections():
+    '''
+    @rtype: list(str)
+    @return: config sections of the registered modalities
+    '''
+    return list(_MODALITIES)
+
+
+def get_modality(section: str):
+    '''
+    @rtype: Modality
+    @return: the modality of a config section
+    '''
+    if section not in _MODALITIES:
+        raise Exception(f"'{section}' is not a known modality. "
+                        f"Known ones are {', '.join(_MODALITIES)}")
+    return _MODALITIES[section]
+
+
+register_modality("EEG", "octopus_sensing_visualizer.modalities.eeg",
+                  ["eeg", "power_bands", "delta_band", "theta_band", "alpha_band",
+                   "beta_band", "gamma_band"])
+register_modality("PPG", "octopus_sensing_visualizer.modalities.ppg",
+                  ["ppg", "hr", "hrv", "breathing_rate"])
+register_modality("GSR", "octopus_sensing_visualizer.modalities.gsr",
+                  ["gsr", "gsr_phasic", "gsr_tonic"])
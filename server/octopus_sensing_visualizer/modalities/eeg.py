@@ -0,0 +1,149 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import os
+
+from octopus_sensing_visualizer.prepare_data.eeg import prepare_eeg_data, prepare_power_bands, \
+    parse_eeg_bands, prepare_spectrogram
+from octopus_sensing_visualizer.cache import load_recording, load_features, library_version
+from octopus_sensing_visualizer.loaders import use_cache, recording_dtype
+from octopus_sensing_visualizer.live import WindowedFeatures
+
+# Keys of the signals of the power of each band in the output of get_data
+EEG_BAND_KEYS = {"Delta": "delta_band",
+                 "Theta": "theta_band",
+                 "Alpha": "alpha_band",
+                 "Beta": "beta_band",
+                 "Gamma": "gamma_band"}
+
+
+def load(loader, config):
+    '''
+    Loads the EEG recording and its derived signals
+
+    @param loaders.ModalityLoader loader: where the signals are loaded
+    @param configparser.RawConfigParser config: visualizer's configuration
+    '''
+    eeg_path = config.get('EEG', 'path')
+    eeg_sampling_rate = config.getint('EEG', 'sampling_rate')
+    if not os.path.isfile(eeg_path):
+        raise Exception("EEG file path is not valid")
+    with loader.timings.span("read"):
+        eeg_data, eeg_channels = \
+            load_recording(eeg_path, prepare_eeg_data, use_cache(config),
+                           dtype=recording_dtype(config, 'EEG'))
+    loader.eeg_channels = eeg_channels
+    channels, samples = eeg_data.shape
+    loader.data_length = (samples/eeg_sampling_rate)
+    if config.getboolean('EEG', 'display_signal') is True:
+        loader.data["eeg"] = eeg_data
+        loader.sampling_rate["eeg"] = eeg_sampling_rate
+
+    if config.getboolean('EEG', 'display_alpha_signal') is True or \
+       config.getboolean('EEG', 'display_beta_signal') is True or \
+       config.getboolean('EEG', 'display_gamma_signal') is True or \
+       config.getboolean('EEG', 'display_theta_signal') is True or \
+       config.getboolean('EEG', 'display_delta_signal') is True:
+        config_window_size = config.getint('EEG', 'window_size')
+        overlap = config.getint('EEG', 'overlap')
+        if config_window_size < 1:
+            raise Exception("Window size should be equal or bigger than 1 seconds")
+        if overlap > config_window_size:
+            raise Exception("overlap should be smaller than window size")
+
+        with loader.timings.span("power_bands"):
+            power_bands = load_features(
+                eeg_path, "power_bands", eeg_data,
+                {"sampling_rate": eeg_sampling_rate,
+                 "window_size": config_window_size,
+                 "overlap": overlap,
+                 "numpy": library_version("numpy"),
+                 "scipy": library_version("scipy")},
+                lambda: prepare_power_bands(eeg_data,
+                                            eeg_sampling_rate,
+                                            config_window_size,
+                                            overlap),
+                use_cache(config))
+        if config.getboolean('EEG', 'display_alpha_signal') is True:
+            loader.data["alpha_band"] = power_bands["Alpha"]
+            loader.sampling_rate["alpha_band"] = 1
+        if config.getboolean('EEG', 'display_beta_signal') is True:
+            loader.data["beta_band"] = power_bands["Beta"]
+            loader.sampling_rate["beta_band"] = 1
+        if config.getboolean('EEG', 'display_gamma_signal') is True:
+            loader.data["gamma_band"] = power_bands["Gamma"]
+            loader.sampling_rate["gamma_band"] = 1
+        if config.getboolean('EEG', 'display_theta_signal') is True:
+            loader.data["theta_band"] = power_bands["Theta"]
+            loader.sampling_rate["theta_band"] = 1
+        if config.getboolean('EEG', 'display_delta_signal') is True:
+            loader.data["delta_band"] = power_bands["Delta"]
+            loader.sampling_rate["delta_band"] = 1
+
+    if config.getboolean('EEG', 'display_power_band_bars') is True:
+        # Later we will measure power bands based on this data and sampling rate
+        loader.data["power_bands"] = eeg_data
+        loader.sampling_rate["power_bands"] = eeg_sampling_rate
+        if config.has_option('EEG', 'bands'):
+            loader.eeg_bands = parse_eeg_bands(config.get('EEG', 'bands'))
+
+    if config.getboolean('EEG', 'display_spectrogram', fallback=False) is True:
+        # Window and hop of the frames are in seconds
+        window_samples = \
+            int(round(config.getfloat('EEG', 'spectrogram_window', fallback=1) *
+                      eeg_sampling_rate))
+        hop_samples = max(1, int(round(
+            config.getfloat('EEG', 'spectrogram_hop', fallback=0.125) * eeg_sampling_rate)))
+        levels = config.getint('EEG', 'spectrogram_levels', fallback=8)
+        loader.spectrogram_parameters = {"sampling_rate": eeg_sampling_rate,
+                                         "window_samples": window_samples,
+                                         "hop_samples": hop_samples}
+        with loader.timings.span("spectrogram"):
+            loader.spectrogram = load_features(
+                eeg_path, "spectrogram", eeg_data,
+                {**loader.spectrogram_parameters,
+                 "levels": levels,
+                 "numpy": library_version("numpy"),
+                 "scipy": library_version("scipy")},
+                lambda: prepare_spectrogram(eeg_data,
+                                            eeg_sampling_rate,
+                                            window_samples,
+                                            hop_samples,
+                                            levels),
+                use_cache(config))
+
+
+def setup_live(modality, config):
+    '''
+    Sets up the signals of an EEG recording that is being written
+
+    @param live.LiveModality modality: the modality that follows the recording
+    @param configparser.RawConfigParser config: visualizer's configuration
+    '''
+    if config.getboolean('EEG', 'display_signal') is True:
+        modality.sampling_rate["eeg"] = modality.signal_rate
+    if config.getboolean('EEG', 'display_power_band_bars') is True:
+        modality.sampling_rate["power_bands"] = modality.signal_rate
+        if config.has_option('EEG', 'bands'):
+            modality.eeg_bands = parse_eeg_bands(config.get('EEG', 'bands'))
+
+    keys = {band: key for band, key in EEG_BAND_KEYS.items()
+            if config.getboolean('EEG', f'display_{band.lower()}_signal') is True}
+    if keys:
+        window_size = config.getint('EEG', 'window_size')
+        overlap = config.getint('EEG', 'overlap')
+        for key in keys.values():
+            modality.sampling_rate[key] = 1
+        modality.features.append(WindowedFeatures(
+            lambda signal: prepare_power_bands(signal, modality.signal_rate, window_size, overlap),
+            keys, window_size))
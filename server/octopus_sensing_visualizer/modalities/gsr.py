@@ -0,0 +1,102 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import os
+
+from octopus_sensing_visualizer.prepare_data.gsr import prepare_gsr_data, prepare_phasic_tonic, \
+    GSR_ENGINES
+from octopus_sensing_visualizer.cache import load_recording, load_features, library_version
+from octopus_sensing_visualizer.loaders import use_cache, recording_dtype
+from octopus_sensing_visualizer.live import SampleFeatures
+
+
+def load(loader, config):
+    '''
+    Loads the GSR recording and its derived signals
+
+    @param loaders.ModalityLoader loader: where the signals are loaded
+    @param configparser.RawConfigParser config: visualizer's configuration
+    '''
+    gsr_path = config.get('GSR', 'path')
+    gsr_sampling_rate = config.getint('GSR', 'sampling_rate')
+    if not os.path.isfile(gsr_path):
+        raise Exception("GSR file path is not valid")
+    with loader.timings.span("read"):
+        gsr_data = load_recording(gsr_path, prepare_gsr_data, use_cache(config),
+                                  dtype=recording_dtype(config, 'GSR'))
+    samples, = gsr_data.shape
+    loader.data_length = (samples/gsr_sampling_rate)
+    if config.getboolean('GSR', 'display_signal') is True:
+        loader.data["gsr"] = gsr_data
+        loader.sampling_rate["gsr"] = gsr_sampling_rate
+
+    if config.getboolean('GSR', 'display_phasic') is True or \
+       config.getboolean('GSR', 'display_tonic') is True:
+        engine = gsr_engine(config)
+        with loader.timings.span("phasic_tonic"):
+            components = load_features(
+                gsr_path, "phasic_tonic", gsr_data,
+                {"sampling_rate": gsr_sampling_rate,
+                 "engine": engine,
+                 "neurokit2": library_version("neurokit2") if engine == "neurokit" else None,
+                 "scipy": library_version("scipy")},
+                lambda: dict(zip(("phasic", "tonic"),
+                                 prepare_phasic_tonic(gsr_data, gsr_sampling_rate,
+                                                      engine=engine))),
+                use_cache(config))
+        phasic, tonic = components["phasic"], components["tonic"]
+        if config.getboolean('GSR', 'display_phasic') is True:
+            loader.data["gsr_phasic"] = phasic
+            loader.sampling_rate["gsr_phasic"] = gsr_sampling_rate
+        if config.getboolean('GSR', 'display_tonic') is True:
+            loader.data["gsr_tonic"] = tonic
+            loader.sampling_rate["gsr_tonic"] = gsr_sampling_rate
+
+
+def setup_live(modality, config):
+    '''
+    Sets up the signals of a GSR recording that is being written
+
+    @param live.LiveModality modality: the modality that follows the recording
+    @param configparser.RawConfigParser config: visualizer's configuration
+    '''
+    if config.getboolean('GSR', 'display_signal') is True:
+        modality.sampling_rate["gsr"] = modality.signal_rate
+    keys = {}
+    if config.getboolean('GSR', 'display_phasic') is True:
+        keys["phasic"] = "gsr_phasic"
+    if config.getboolean('GSR', 'display_tonic') is True:
+        keys["tonic"] = "gsr_tonic"
+    if keys:
+        engine = gsr_engine(config)
+        for key in keys.values():
+            modality.sampling_rate[key] = modality.signal_rate
+        modality.features.append(SampleFeatures(
+            lambda signal: dict(zip(("phasic", "tonic"),
+                                    prepare_phasic_tonic(signal, modality.signal_rate,
+                                                         engine=engine))),
+            keys))
+
+
+def gsr_engine(config):
+    '''
+    How phasic and tonic components are computed: 'chunked' (the default) or
+    'neurokit'. See prepare_phasic_tonic.
+
+    @rtype: str
+    '''
+    engine = config.get('GSR', 'engine', fallback='chunked')
+    if engine not in GSR_ENGINES:
+        raise Exception(f"Unknown GSR engine '{engine}'. It should be one of: "
+                        f"{', '.join(GSR_ENGINES)}")
+    return engine
@@ -0,0 +1,111 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import os
+
+from octopus_sensing_visualizer.prepare_data.ppg import prepare_ppg_data, prepare_ppg_components, \
+    PPG_ENGINES
+from octopus_sensing_visualizer.cache import load_recording, load_features, library_version
+from octopus_sensing_visualizer.loaders import use_cache, recording_dtype
+from octopus_sensing_visualizer.live import WindowedFeatures
+
+
+def load(loader, config):
+    '''
+    Loads the PPG recording and its derived signals
+
+    @param loaders.ModalityLoader loader: where the signals are loaded
+    @param configparser.RawConfigParser config: visualizer's configuration
+    '''
+    ppg_path = config.get('PPG', 'path')
+    ppg_sampling_rate = config.getint('PPG', 'sampling_rate')
+    if not os.path.isfile(ppg_path):
+        raise Exception("PPG file path is not valid")
+    with loader.timings.span("read"):
+        ppg_data = load_recording(ppg_path, prepare_ppg_data, use_cache(config),
+                                  dtype=recording_dtype(config, 'PPG'))
+    samples, = ppg_data.shape
+    loader.data_length = (samples/ppg_sampling_rate)
+    if config.getboolean('PPG', 'display_signal') is True:
+        loader.data["ppg"] = ppg_data
+        loader.sampling_rate["ppg"] = ppg_sampling_rate
+
+    if config.getboolean('PPG', 'display_hr') is True or \
+       config.getboolean('PPG', 'display_hrv') is True or \
+       config.getboolean('PPG', 'display_breathing_rate') is True:
+        window_size = config.getint('PPG', 'window_size')
+        overlap = config.getint('PPG', 'overlap')
+        engine = ppg_engine(config)
+        with loader.timings.span("ppg_components"):
+            hr_components = load_features(
+                ppg_path, "ppg_components", ppg_data,
+                {"sampling_rate": ppg_sampling_rate,
+                 "window_size": window_size,
+                 "overlap": overlap,
+                 "engine": engine,
+                 "heartpy": library_version("heartpy") if engine == "heartpy" else None,
+                 "scipy": library_version("scipy")},
+                lambda: prepare_ppg_components(ppg_data, ppg_sampling_rate,
+                                               window_size=window_size,
+                                               overlap=overlap,
+                                               engine=engine),
+                use_cache(config))
+        if config.getboolean('PPG', 'display_hr') is True:
+            loader.data["hr"] = hr_components["hr"]
+            loader.sampling_rate["hr"] = 1
+        if config.getboolean('PPG', 'display_hrv') is True:
+            loader.data["hrv"] = hr_components["hrv"]
+            loader.sampling_rate["hrv"] = 1
+        if config.getboolean('PPG', 'display_breathing_rate') is True:
+            loader.data["breathing_rate"] = hr_components["breathing_rate"]
+            loader.sampling_rate["breathing_rate"] = 1
+
+
+def setup_live(modality, config):
+    '''
+    Sets up the signals of a PPG recording that is being written
+
+    @param live.LiveModality modality: the modality that follows the recording
+    @param configparser.RawConfigParser config: visualizer's configuration
+    '''
+    if config.getboolean('PPG', 'display_signal') is True:
+        modality.sampling_rate["ppg"] = modality.signal_rate
+    keys = {key: key for key in ("hr", "hrv", "breathing_rate")
+            if config.getboolean('PPG', f'display_{key}') is True}
+    if keys:
+        window_size = config.getint('PPG', 'window_size')
+        overlap = config.getint('PPG', 'overlap')
+        engine = ppg_engine(config)
+        for key in keys.values():
+            modality.sampling_rate[key] = 1
+        # Margin hides the edge effects of the band-pass filter
+        modality.features.append(WindowedFeatures(
+            lambda signal: prepare_ppg_components(signal, modality.signal_rate,
+                                                  window_size=window_size,
+                                                  overlap=overlap,
+                                                  engine=engine),
+            keys, window_size, margin=10))
+
+
+def ppg_engine(config):
+    '''
+    How HR, HRV and breathing rate are computed: 'single_pass' (the default)
+    or 'heartpy'. See prepare_ppg_components.
+
+    @rtype: str
+    '''
+    engine = config.get('PPG', 'engine', fallback='single_pass')
+    if engine not in PPG_ENGINES:
+        raise Exception(f"Unknown PPG engine '{engine}'. It should be one of: "
+                        f"{', '.join(PPG_ENGINES)}")
+    return engine
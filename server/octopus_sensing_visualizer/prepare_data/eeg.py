@@ -11,48 +11,57 @@
 #
 # You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
 # If not, see <https://www.gnu.org/licenses/>.
-import datetime
-import pandas as pd
 import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
 
 from scipy.signal import welch
+from scipy.signal.windows import hann
 from scipy.integrate import simpson
 
-# TODO Acelerometer, topomap, fft plot, time-frequency
+from octopus_sensing_visualizer.prepare_data.reader import read_csv_channels
 
+# TODO Acelerometer, fft plot
 
-def prepare_eeg_data(path: str):
+
+def prepare_eeg_data(path: str, dtype=np.float32):
     '''
     Reads EEG csv file and return its data
 
     @param str path: EEG file path
 
-    @rtype: numpy.array, numpy.array
+    @keyword dtype: type of the returned data
+
+    @rtype: numpy.array, list(str)
 
-    @return: EEG data, channel names
+    @return: EEG data (shape: channels * samples), channel names
     '''
-    df = pd.read_csv(path, index_col=False)
-    data = df.to_numpy()
-    channels = df.head()
-    return np.transpose(data), channels
+    return read_csv_channels(path, header=True, dtype=dtype)
 
 
-def prepare_power_bands(eeg_data: np.array, sampling_rate: int, window_size: int, overlap: int):
+def prepare_power_bands(eeg_data: np.array, sampling_rate: int, window_size: int, overlap: int,
+                        max_chunk_bytes: int = 64 * 1024 * 1024):
     '''
     Split data to some windows and calculates EEG bandpowers for each window
 
-    @param numpy.array eeg_data: A 2D array of EEG signal (samples * channels)
+    All windows are processed at once: they are strided views of the signal, one
+    FFT is computed for every window and channel, and the FFT bins of each band
+    are averaged with a precomputed weight matrix. Windows are processed in
+    chunks, so memory usage stays bounded on long recordings.
+
+    @param numpy.array eeg_data: A 2D array of EEG signal (channels * samples)
     @param int sampling_rate: EEG sampling rate
     @param int window_size : The size of desired window for extracting power bands
     @param int overlap: The amount of overlap between two subsequent window
 
+    @keyword int max_chunk_bytes: maximum size of the FFT of a chunk of windows
+
     @rtype: dict{band_power_label: band_power}
     @note: output keys: ['Delta', 'Theta', 'Alpha', 'Beta', 'Gamma']
     @type: band_power: numpy.array
     @return: a dictionary of power bands
     '''
-    eeg_data = np.transpose(eeg_data)
-    samples, channels = eeg_data.shape
+    channels, samples = eeg_data.shape
 
     eeg_bands = {'Delta': (0, 4),
                  'Theta': (4, 8),
@@ -60,61 +69,187 @@ def prepare_power_bands(eeg_data: np.array, sampling_rate: int, window_size: int
                  'Beta': (12, 30),
                  'Gamma': (30, 45)}
 
-    delta = []
-    theta = []
-    alpha = []
-    beta = []
-    gamma = []
-    start_time = 0
     signal_length = int(samples/sampling_rate)  # Length of signal in seconds
-    if (start_time + window_size) > (samples / sampling_rate):
+    if window_size > (samples / sampling_rate):
         raise Exception(f"Desired window are out of data range. Number of samples: {samples} Sampleing Rate: {sampling_rate}")
-    while (start_time + window_size) < (samples/sampling_rate):
-        extracted_data = \
-            eeg_data[start_time*sampling_rate:(start_time+window_size)*sampling_rate, :]
-        power_bands = \
-            _get_total_power_bands(extracted_data, sampling_rate, eeg_bands)
-        delta.append(power_bands["Delta"])
-        theta.append(power_bands["Theta"])
-        alpha.append(power_bands["Alpha"])
-        beta.append(power_bands["Beta"])
-        gamma.append(power_bands["Gamma"])
-        start_time += (window_size - overlap)
-
-    delta_band = np.zeros(signal_length)
-    delta_band[0:window_size-1] = np.nan
-    delta_band[window_size-1:signal_length-1] = np.array(delta)
-
-    theta_band = np.zeros(signal_length)
-    theta_band[0:window_size-1] = np.nan
-    theta_band[window_size-1:signal_length-1] = np.array(theta)
-
-    alpha_band = np.zeros(signal_length)
-    alpha_band[0:window_size-1] = np.nan
-    alpha_band[window_size-1:signal_length-1] = np.array(alpha)
-
-    beta_band = np.zeros(signal_length)
-    beta_band[0:window_size-1] = np.nan
-    beta_band[window_size-1:signal_length-1] = np.array(beta)
-
-    gamma_band = np.zeros(signal_length)
-    gamma_band[0:window_size-1] = np.nan
-    gamma_band[window_size-1:signal_length-1] = np.array(gamma)
-
-    power_bands = {'Delta': delta_band,
-                   'Theta': theta_band,
-                   'Alpha': alpha_band,
-                   'Beta': beta_band,
-                   'Gamma': gamma_band}
+
+    window_samples = window_size * sampling_rate
+    step_samples = (window_size - overlap) * sampling_rate
+    # Windows start every step seconds, and end before the end of the signal
+    window_count = len(range(0, samples - window_samples, step_samples))
+    windows = sliding_window_view(eeg_data, window_samples, axis=-1)[:, ::step_samples]
+    windows = windows[:, :window_count]
+
+    # Mean of FFT amplitudes inside [low, high) of each band, as a matrix product.
+    # Bands without any bins get zero.
+    fft_freq = np.fft.rfftfreq(window_samples, 1.0/sampling_rate)
+    band_weights = np.zeros((fft_freq.shape[0], len(eeg_bands)))
+    for idx, (low, high) in enumerate(eeg_bands.values()):
+        band_mask = (fft_freq >= low) & (fft_freq < high)
+        if np.any(band_mask):
+            band_weights[band_mask, idx] = 1 / np.count_nonzero(band_mask)
+
+    bands = np.zeros((window_count, len(eeg_bands)))
+    bytes_per_window = channels * fft_freq.shape[0] * 16
+    chunk_size = max(1, max_chunk_bytes // bytes_per_window)
+    for chunk_start in range(0, window_count, chunk_size):
+        chunk = windows[:, chunk_start:chunk_start + chunk_size, :]
+        fft_values = np.absolute(scipy.fft.rfft(chunk, axis=-1, workers=-1))
+        # (channels, windows, bins) @ (bins, bands), then averaged over channels
+        bands[chunk_start:chunk_start + chunk.shape[1]] = \
+            np.mean(fft_values @ band_weights, axis=0)
+
+    power_bands = {}
+    for idx, band in enumerate(eeg_bands):
+        band_power = np.zeros(signal_length)
+        band_power[0:window_size-1] = np.nan
+        band_power[window_size-1:signal_length-1] = bands[:, idx]
+        power_bands[band] = band_power
     return power_bands
 
 
+def prepare_spectrogram(eeg_data: np.array, sampling_rate: int, window_samples: int,
+                        hop_samples: int, levels: int = 6, min_frames: int = 64,
+                        max_chunk_bytes: int = 16 * 1024 * 1024):
+    '''
+    Calculates the spectrogram (short-time Fourier transform) of every channel
+    and of their average, at several time resolutions, quantized to 8 bits.
+
+    Like prepare_power_bands, frames are strided views of the signal and their
+    FFTs are computed in chunks. Each level averages the power of every two
+    frames of the previous level. Power is converted to dB, and dB values
+    between the 1st and 99.9th percentiles of the first level are mapped to
+    0-255 (values outside are clipped). The percentiles are estimated on at
+    most about 4096 frames.
+
+    Each chunk is quantized into every level before the next one is computed,
+    so only the uint8 levels are kept for the whole recording.
+
+    @param numpy.array eeg_data: A 2D array of EEG signal (channels * samples)
+    @param int sampling_rate: EEG sampling rate
+    @param int window_samples: length of the Hann window of each frame, in samples
+    @param int hop_samples: distance between the starts of two frames, in samples
+
+    @keyword int levels: maximum number of time resolutions
+    @keyword int min_frames: levels shorter than this are not built
+    @keyword int max_chunk_bytes: maximum size of the FFT of a chunk of frames
+
+    @rtype: dict{str: numpy.array}
+    @note: output keys: 'level_0', 'level_1', ... (uint8, shape:
+           (channels + 1) * frames * frequencies, the last row is the average of
+           the channels) and 'db_range' (the dB values of 0 and 255)
+    @return: a dictionary of spectrogram levels
+    '''
+    channels, samples = eeg_data.shape
+    if window_samples > samples:
+        raise Exception("Spectrogram window is longer than the data. "
+                        f"Number of samples: {samples}")
+
+    frame_count = (samples - window_samples) // hop_samples + 1
+    frames = sliding_window_view(eeg_data, window_samples, axis=-1)[:, ::hop_samples]
+    frames = frames[:, :frame_count]
+
+    # Power spectral density, scaled like scipy's spectrogram(scaling='density')
+    taper = hann(window_samples, sym=False).astype(np.float32)
+    scale = 1 / (sampling_rate * np.sum(taper ** 2))
+    bins = window_samples // 2 + 1
+    bytes_per_frame = channels * (window_samples * 4 + bins * 8)
+    chunk_size = max(1, max_chunk_bytes // bytes_per_frame)
+
+    sample_frames = frames[:, ::max(1, frame_count // 4096)]
+    sample = np.empty((channels + 1, sample_frames.shape[1], bins), dtype=np.float32)
+    for chunk_start in range(0, sample_frames.shape[1], chunk_size):
+        chunk = sample_frames[:, chunk_start:chunk_start + chunk_size]
+        sample[:, chunk_start:chunk_start + chunk.shape[1]] = \
+            _decibels(_frames_power(chunk, taper, scale))
+    low, high = np.nanpercentile(sample, [1, 99.9])
+    if not high > low:
+        high = low + 1
+    del sample
+
+    # Frames of each level, which halve until a level would be too short
+    level_frames = [frame_count]
+    while len(level_frames) < levels and level_frames[-1] // 2 >= min_frames:
+        level_frames.append(level_frames[-1] // 2)
+    spectrogram = {"db_range": np.array([low, high], dtype=np.float32)}
+    for level, count in enumerate(level_frames):
+        spectrogram[f"level_{level}"] = np.empty((channels + 1, count, bins), dtype=np.uint8)
+
+    # Chunks start on a multiple of the frames that the coarsest level averages,
+    # so no pair of averaged frames is split between two chunks
+    alignment = 2 ** (len(level_frames) - 1)
+    chunk_size = -(-chunk_size // alignment) * alignment
+    for chunk_start in range(0, frame_count, chunk_size):
+        power = _frames_power(frames[:, chunk_start:chunk_start + chunk_size], taper, scale)
+        for level, count in enumerate(level_frames):
+            start = chunk_start // 2 ** level
+            power = power[:, :count - start]
+            spectrogram[f"level_{level}"][:, start:start + power.shape[1]] = \
+                _quantize(_decibels(power), low, high)
+            even = power.shape[1] // 2 * 2
+            power = (power[:, 0:even:2] + power[:, 1:even:2]) / 2
+    return spectrogram
+
+
+def _frames_power(frames, taper, scale):
+    # Power of frames (channels * frames * window), and their average over the
+    # channels in an extra last row
+    channels, frame_count, window_samples = frames.shape
+    bins = window_samples // 2 + 1
+    power = np.empty((channels + 1, frame_count, bins), dtype=np.float32)
+    spectrum = scipy.fft.rfft(frames * taper, axis=-1, workers=-1)
+    power[:channels] = (spectrum.real ** 2 + spectrum.imag ** 2) * scale
+    # One-sided spectrum: the negative frequencies are added to the positive ones
+    power[:channels, :, 1:bins - 1 + window_samples % 2] *= 2
+    power[channels] = np.mean(power[:channels], axis=0)
+    return power
+
+
+def _decibels(power):
+    return 10 * np.log10(power + np.finfo(np.float32).tiny)
+
+
+def _quantize(decibels, low, high):
+    scaled = np.round((decibels - low) * (255 / (high - low)))
+    # Missing samples (NaN) become the lowest value
+    return np.clip(np.nan_to_num(scaled, nan=0), 0, 255).astype(np.uint8)
+
+
+DEFAULT_EEG_BANDS = {'Delta': (0.5, 4),
+                     'Theta': (4, 8),
+                     'Alpha': (8, 12),
+                     'Beta': (12, 30),
+                     'Gamma': (30, 45)}
+
+
+def parse_eeg_bands(text: str):
+    '''
+    Parses EEG band definitions of the config file
+
+    @param str text: comma separated list of bands, like 'Alpha: 8-12, Beta: 12-30'
+
+    @rtype: dict{str: tuple(float, float)}
+    @return: a dictionary of bands
+    '''
+    eeg_bands = {}
+    for band in text.split(","):
+        try:
+            name, edges = band.split(":")
+            low, high = (float(edge) for edge in edges.split("-"))
+        except ValueError:
+            raise Exception(f"EEG band '{band.strip()}' should be like 'Alpha: 8-12'")
+        if not 0 <= low < high:
+            raise Exception(f"EEG band '{band.strip()}' should have 0 <= low < high")
+        eeg_bands[name.strip()] = (low, high)
+    return eeg_bands
+
+
 def prepare_power_bands_on_the_fly(data, sampling_rate, start_time, length, eeg_bands=None):
     '''
     Calculates power bands for a specified window of data
 
     @param numpy.array data: a two dimentional array.
-    @note data: Each column is a channels. Shape should be time_points*channels
+    @note data: Each row is a channels. Shape should be channels*time_points
 
     @param int sampling_rate: EEG sampling rate
     @param int start_time: start time in second of the window for measuring
@@ -122,35 +257,84 @@ def prepare_power_bands_on_the_fly(data, sampling_rate, start_time, length, eeg_
     @param int length: Length of window in second
 
     @keyword dict eeg_bands: a dictionary of desired power bands
-    @type eeg_bands: dict{str: tuple(int, int)}
-    @note: default value is None. When it is None, extracted power band will be:
-           {'Delta': (0, 4),
+    @type eeg_bands: dict{str: tuple(float, float)}
+    @note: default value is None. When it is None, DEFAULT_EEG_BANDS is used:
+           {'Delta': (0.5, 4),
             'Theta': (4, 8),
             'Alpha': (8, 12),
             'Beta': (12, 30),
             'Gamma': (30, 45)}
 
+    @rtype dict{str: float}
+    @return: relative power of each band, averaged over channels
+    '''
+    if eeg_bands is None:
+        eeg_bands = DEFAULT_EEG_BANDS
+    powers = prepare_channel_power_bands(data, sampling_rate, start_time, length, eeg_bands)
+    mean_powers = np.mean(powers, axis=0)
+    return {band: float(mean_powers[idx]) for idx, band in enumerate(eeg_bands)}
+
+
+def prepare_channel_power_bands(data, sampling_rate, start_time, length, eeg_bands=None):
+    '''
+    Calculates power bands of every channel for a specified window of data, for
+    drawing a topomap. All channels and bands are computed in one pass.
+
+    @param numpy.array data: a two dimentional array.
+    @note data: Each row is a channels. Shape should be channels*time_points
+
+    @param int sampling_rate: EEG sampling rate
+    @param int start_time: start time in second of the window for measuring
+                           power bands
+    @param int length: Length of window in second
+
+    @keyword dict eeg_bands: a dictionary of desired power bands. Default is
+                             DEFAULT_EEG_BANDS.
+    @type eeg_bands: dict{str: tuple(float, float)}
+
     @rtype numpy.array
-    @return: an array of power bands
-    @note: Default is [Delta, Theta, Alpha, Beta, Gamma]
+    @return: relative power of each band of each channel, shape is channels * bands
     '''
     if eeg_bands is None:
-        # Define EEG bands
-        eeg_bands = {'Delta': [0.5, 4],
-                     'Theta': [4, 8],
-                     'Alpha': [8, 12],
-                     'Beta': [12, 30],
-                     'Gamma': [30, 45]}
-    power_bands = {}
-    for key, value in eeg_bands.items():
-        extracted_data = data[:, start_time*sampling_rate:(start_time+length)*sampling_rate]
-        sum_band_power = 0
-        for ch in range(extracted_data.shape[0]):
-            band_power = \
-                bandpower(extracted_data[ch, :], sampling_rate, value, relative=True)
-            sum_band_power += band_power
-        power_bands[key] = sum_band_power/extracted_data.shape[0]
-    return power_bands
+        eeg_bands = DEFAULT_EEG_BANDS
+    extracted_data = data[:, start_time*sampling_rate:(start_time+length)*sampling_rate]
+    return band_powers(extracted_data, sampling_rate, eeg_bands, relative=True)
+
+
+def band_powers(data: np.ndarray, sampling_rate: int, eeg_bands: dict, relative: bool = False):
+    '''
+    Computes the power of all bands for all channels from a single PSD.
+
+    One Welch PSD is computed over all channels at once. Its segment length is
+    chosen like bandpower does for the lowest band edge, (2 / low) seconds, so it
+    resolves every band. Each band is integrated with Simpson's rule.
+
+    @param numpy.array data: a two dimentional array (channels * samples)
+    @param int sampling_rate: EEG sampling rate
+    @param dict eeg_bands: a dictionary of bands
+    @type eeg_bands: dict{str: tuple(float, float)}
+
+    @keyword bool relative: If True, return the relative power (divided by the
+                            total power of the signal)
+
+    @rtype: numpy.array
+    @return: power of each band, shape is channels * bands
+    '''
+    samples = data.shape[-1]
+    lowest = min((low for low, high in eeg_bands.values() if low > 0), default=0.5)
+    nperseg = min(samples, int((2 / lowest) * sampling_rate))
+    freqs, psd = welch(data, sampling_rate, nperseg=nperseg, axis=-1)
+    freq_res = freqs[1] - freqs[0]
+
+    powers = np.zeros(data.shape[:-1] + (len(eeg_bands),))
+    for idx, (low, high) in enumerate(eeg_bands.values()):
+        idx_band = np.logical_and(freqs >= low, freqs <= high)
+        powers[..., idx] = simpson(psd[..., idx_band], dx=freq_res, axis=-1)
+
+    if relative:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            powers /= simpson(psd, dx=freq_res, axis=-1)[..., np.newaxis]
+    return powers
 
 
 def prepare_power_bands_on_the_fly0(data, sampling_rate, start_time, length, eeg_bands=None):
@@ -286,11 +470,3 @@ def bandpower(data: np.ndarray, sampling_rate:int, band: list, window_sec: int=N
     if relative:
         bp /= simpson(psd, dx=freq_res)
     return bp
-
-
-
-if __name__ == "__main__":
-    path = "/tmp/preprocess/new/OpenBCI-20-00-01.csv"
-    a = datetime.datetime.now()
-    bands = prepare_power_bands_on_the_fly(path, 128, 5, 5)
-    b = datetime.datetime.now()
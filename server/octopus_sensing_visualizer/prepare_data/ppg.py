@@ -12,50 +12,109 @@
 # You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
 # If not, see <https://www.gnu.org/licenses/>.
 
-import pandas as pd
 import numpy as np
-import heartpy as hp
-import matplotlib.pyplot as plt
+from scipy.signal import butter, sosfiltfilt
+from scipy.signal.windows import hann
+
+from octopus_sensing_visualizer.prepare_data.reader import read_csv_channels
+
+# Engines of prepare_ppg_components
+PPG_ENGINES = ("single_pass", "heartpy")
+
+# Thresholds tried for peak detection, in percents of the moving average, like heartpy's
+PEAK_THRESHOLDS = [5, 10, 15, 20, 25, 30, 40, 50, 60, 70, 80, 90, 100, 110, 120, 150, 200, 300]
 
 
 def display_signal(signal):
+    # Only for debugging, so matplotlib isn't needed otherwise
+    import matplotlib.pyplot as plt
+
     plt.plot(signal)
     plt.xlabel('Time')
     plt.ylabel('Amplitude')
     plt.show()
 
 
-def prepare_ppg_data(path: str):
+def prepare_ppg_data(path: str, dtype=np.float32):
     '''
     Return PPG data saved in the specified path
 
     @param str path: path to PPG file
 
+    @keyword dtype: type of the returned data
+
     @rtype: np.array (shape: samples)
 
     @return an array of PPG signal
     '''
-    df = pd.read_csv(path, index_col=False, header=None)
-    data = df.to_numpy()
-    return data[:, 0]
+    data, columns = read_csv_channels(path, header=False, usecols=[0], dtype=dtype)
+    return data[0]
 
 
 def prepare_ppg_components(ppg_data: np.ndarray, sampling_rate: int,
-                           window_size: int = 20, overlap: int = 19):
+                           window_size: int = 20, overlap: int = 19,
+                           engine: str = "single_pass"):
     '''
     Extracts HR, HRV and breathing rate from PPG
 
+    The 'heartpy' engine runs heartpy's whole analysis on each window, so every
+    second of the signal is filtered and analysed about window_size times. The
+    'single_pass' engine filters the signal and detects beats once, then
+    computes the measures of all windows from the one series of beats, the
+    way heartpy computes them:
+        - hr: 60000 / mean of the accepted intervals between beats (ms)
+        - hrv: standard deviation of the differences of successive accepted
+          intervals (heartpy's sdsd)
+        - breathing_rate: frequency (Hz) of the peak of the spectrum of the
+          accepted intervals
+
+    The two engines give close but not identical results. Beats are detected
+    with one threshold for the whole signal instead of one per window, and the
+    breathing spectrum is computed from the intervals directly, instead of from
+    their spline resampled to 1000 Hz.
+
     @param np.array ppg_data: PPG data
     @param int sampling_rate: PPG sampling rate
 
     @keyword int window_length: Length of sliding window for measurment in seconds
-    @keyword float overlap: Amount of overlap between two windows in seconds
+    @keyword float overlap: Amount of overlap between two windows in seconds.
+                            single_pass always moves windows by one second.
+    @keyword str engine: 'single_pass' or 'heartpy'
 
     @rtype: dict(str, numpy.array)
     @note: dict.keys = ["hr", "hrv", "breathing_rate"]
 
     @return a dictionary of PPG components
     '''
+    if engine == "heartpy":
+        return _heartpy_components(ppg_data, sampling_rate, window_size, overlap)
+    if engine != "single_pass":
+        raise ValueError(f"Unknown PPG engine '{engine}'. It should be one of: "
+                         f"{', '.join(PPG_ENGINES)}")
+
+    sos = butter(3, [0.7, 2.5], btype='bandpass', fs=sampling_rate, output='sos')
+    data = sosfiltfilt(sos, np.asarray(ppg_data, dtype=np.float64))
+    peaks = _detect_beats(data, sampling_rate)
+
+    signal_length = int(data.shape[0] / sampling_rate)
+    window_count = max(signal_length - window_size, 0)
+    intervals, accepted = _window_intervals(peaks, sampling_rate, window_size, window_count)
+    measures = {"hr": _mean_heart_rate(intervals, accepted),
+                "hrv": _successive_differences_sd(intervals, accepted),
+                "breathing_rate": _breathing_rate(intervals, accepted)}
+
+    hr_components = {}
+    for key, values in measures.items():
+        series = np.zeros(signal_length)
+        series[0:window_size-1] = np.nan
+        series[window_size-1:window_size-1+window_count] = values
+        hr_components[key] = series
+    return hr_components
+
+
+def _heartpy_components(ppg_data, sampling_rate, window_size, overlap):
+    # heartpy is imported only when this engine is used and features aren't in the cache
+    import heartpy as hp
 
     data = hp.filter_signal(ppg_data,
                             [0.7, 2.5],
@@ -86,3 +145,123 @@ def prepare_ppg_components(ppg_data: np.ndarray, sampling_rate: int,
                      "breathing_rate": breathing_rate}
 
     return hr_components
+
+
+def _detect_beats(data, sampling_rate, min_bpm=40, max_bpm=180):
+    # Indices of the beats of the filtered signal, found like heartpy's fit_peaks
+    # does, but once for the whole signal: the highest sample of every run above
+    # the moving average raised by a threshold. The threshold with the most
+    # regular intervals and a plausible heart rate is chosen.
+    baseline = np.percentile(data, 0.1)
+    if baseline < 0:
+        data = data - baseline
+    moving_average = _moving_average(data, int(0.75 * sampling_rate))
+
+    best_peaks = None
+    best_deviation = np.inf
+    minutes = data.shape[0] / sampling_rate / 60
+    for threshold in PEAK_THRESHOLDS:
+        peaks = _run_maxima(data, moving_average + np.mean(moving_average) / 100 * threshold)
+        if peaks.shape[0] < 2 or not min_bpm <= peaks.shape[0] / minutes <= max_bpm:
+            continue
+        deviation = np.std(np.diff(peaks) / sampling_rate * 1000)
+        if 0.1 < deviation < best_deviation:
+            best_peaks, best_deviation = peaks, deviation
+    if best_peaks is None:
+        raise Exception("Could not find heart beats in the PPG signal")
+    return best_peaks
+
+
+def _moving_average(data, width):
+    # Centered moving average. The edges repeat the first and last full averages.
+    width = max(1, min(width, data.shape[0]))
+    sums = np.cumsum(np.concatenate(([0.0], data)))
+    averages = (sums[width:] - sums[:-width]) / width
+    before = (data.shape[0] - averages.shape[0]) // 2
+    after = data.shape[0] - averages.shape[0] - before
+    return np.concatenate((np.full(before, averages[0]), averages, np.full(after, averages[-1])))
+
+
+def _run_maxima(data, threshold):
+    # Index of the (first) highest sample of every run of samples above threshold
+    above = np.flatnonzero(data > threshold)
+    if above.shape[0] == 0:
+        return above
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(above) > 1) + 1))
+    runs = np.repeat(np.arange(run_starts.shape[0]),
+                     np.diff(np.append(run_starts, above.shape[0])))
+    # Sorted by run, then by descending value. Ties keep their order.
+    order = np.lexsort((-data[above], runs))
+    first_of_run = np.concatenate(([True], runs[order][1:] != runs[order][:-1]))
+    return above[order[first_of_run]]
+
+
+def _window_intervals(peaks, sampling_rate, window_size, window_count):
+    # Intervals between the beats of each window (windows * intervals, in ms,
+    # padded with NaN), and which ones heartpy's check_peaks would accept. Window
+    # k covers seconds [k, k + window_size).
+    starts = np.arange(window_count) * sampling_rate
+    first = np.searchsorted(peaks, starts)
+    end = np.searchsorted(peaks, starts + window_size * sampling_rate)
+    # A beat in the first 150 ms of a window is dropped, it may be cut
+    first_peaks = peaks[np.minimum(first, peaks.shape[0] - 1)]
+    first += (first < end) & (first_peaks - starts <= sampling_rate * 0.15)
+    counts = np.maximum(end - first - 1, 0)
+
+    all_intervals = np.diff(peaks) / sampling_rate * 1000
+    width = max(int(counts.max(initial=0)), 1)
+    columns = np.arange(width)
+    valid = columns < counts[:, None]
+    indices = np.minimum(first[:, None] + columns, all_intervals.shape[0] - 1)
+    intervals = np.where(valid, all_intervals[indices], np.nan)
+
+    # Intervals further than 30% (at least 300 ms) from the mean of their window
+    # reject the beat they end with. Only intervals between two kept beats count.
+    mean = _row_mean(intervals, valid)
+    margin = np.maximum(0.3 * mean, 300)
+    in_range = valid & (intervals > (mean - margin)[:, None]) & \
+        (intervals < (mean + margin)[:, None])
+    accepted = in_range.copy()
+    accepted[:, 1:] &= in_range[:, :-1]
+    return intervals, accepted
+
+
+def _row_mean(values, mask):
+    # Mean of the masked values of each row, NaN for rows without any
+    counts = np.count_nonzero(mask, axis=1)
+    sums = np.sum(np.where(mask, values, 0), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _mean_heart_rate(intervals, accepted):
+    with np.errstate(divide="ignore"):
+        return 60000 / _row_mean(intervals, accepted)
+
+
+def _successive_differences_sd(intervals, accepted):
+    # Standard deviation of the differences of successive accepted intervals
+    differences = np.abs(np.diff(intervals, axis=1))
+    both = accepted[:, 1:] & accepted[:, :-1]
+    mean = _row_mean(differences, both)
+    return np.sqrt(_row_mean((differences - mean[:, None]) ** 2, both))
+
+
+def _breathing_rate(intervals, accepted, min_intervals=4):
+    # The accepted intervals of a window are taken as evenly spaced samples of
+    # its duration, and the frequency of the highest bin of their Hann windowed
+    # spectrum is the breathing rate, like heartpy's calc_breathing. Rows with
+    # the same number of intervals are transformed together.
+    rates = np.full(intervals.shape[0], np.nan)
+    counts = np.count_nonzero(accepted, axis=1)
+    # Accepted intervals first, in their order
+    order = np.argsort(~accepted, axis=1, kind="stable")
+    packed = np.take_along_axis(np.where(accepted, intervals, 0), order, axis=1)
+    for count in np.unique(counts[counts >= min_intervals]):
+        rows = np.flatnonzero(counts == count)
+        values = packed[rows, :count]
+        values = values - np.mean(values, axis=1, keepdims=True)
+        power = np.abs(np.fft.rfft(values * hann(count, sym=False), axis=1)) ** 2
+        duration = np.sum(packed[rows, :count], axis=1) / 1000
+        rates[rows] = np.argmax(power, axis=1) / duration
+    return rates
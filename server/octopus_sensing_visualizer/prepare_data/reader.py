@@ -0,0 +1,86 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import logging
+import os
+import time
+
+import pandas as pd
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def read_csv_channels(path: str, header: bool, usecols=None, dtype=np.float32,
+                      chunk_rows: int = 100000):
+    '''
+    Reads a numeric CSV file in chunks, straight into a channel-major array.
+
+    The number of rows is counted first, so the output is allocated once and
+    each chunk is copied into it. Peak memory is the output plus one chunk,
+    instead of the DataFrame, its array and a transposed copy.
+
+    @param str path: path to the CSV file
+    @param bool header: whether the first line has the column names
+
+    @keyword list(int) usecols: indices of the columns to read. Default is all.
+    @keyword dtype: type of the output array
+    @keyword int chunk_rows: number of rows parsed at a time
+
+    @rtype: numpy.array, list(str)
+    @return: data (shape: columns * rows), column names
+    '''
+    started = time.perf_counter()
+    rows = _count_lines(path) - (1 if header else 0)
+
+    chunks = pd.read_csv(path, index_col=False, header=0 if header else None,
+                         usecols=usecols, chunksize=chunk_rows)
+    data = None
+    columns = []
+    row = 0
+    for chunk in chunks:
+        if data is None:
+            columns = [str(column) for column in chunk.columns]
+            data = np.empty((len(columns), max(rows, 0)), dtype=dtype)
+        values = chunk.to_numpy(dtype=dtype)
+        if row + values.shape[0] > data.shape[1]:
+            raise Exception(f"{path} has more rows than lines")
+        data[:, row:row + values.shape[0]] = values.T
+        row += values.shape[0]
+
+    if data is None:
+        raise Exception(f"{path} is empty")
+    if row < data.shape[1]:
+        # Blank lines are skipped by the parser
+        data = data[:, :row]
+
+    elapsed = time.perf_counter() - started
+    megabytes = os.path.getsize(path) / (1024 * 1024)
+    logger.info("Loaded %s: %d rows, %d columns, %.1f MB in %.2f s (%.1f MB/s)",
+                path, row, data.shape[0], megabytes, elapsed,
+                megabytes / elapsed if elapsed > 0 else float("inf"))
+    return data, columns
+
+
+def _count_lines(path: str):
+    lines = 0
+    last_byte = b"\n"
+    with open(path, "rb") as csv_file:
+        while True:
+            block = csv_file.read(1 << 24)
+            if not block:
+                break
+            lines += block.count(b"\n")
+            last_byte = block[-1:]
+    # The last line may not end with a new line
+    return lines + (0 if last_byte == b"\n" else 1)
@@ -0,0 +1,154 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import math
+import threading
+
+import numpy as np
+
+from octopus_sensing_visualizer.downsample import downsample, downsample_mean, reduce_min_max
+
+
+class SignalPyramid():
+    '''
+    Level of detail pyramid of a signal, for zooming through long recordings.
+
+    Level k keeps the minimum, maximum and mean of every 2**k samples of the
+    signal. Levels are built once, halving the length each time. Each level has
+    three float32 arrays, so the levels take about 3 times the memory of a
+    float32 signal (1.5 times of a float64 one).
+
+    Building the levels reads the whole signal, which pages in all of a memory
+    mapped recording, so they are built the first time a window needs them,
+    unless build() is called before.
+
+    To get a window at a resolution, the coarsest level that still has enough
+    samples is sliced, so the cost depends on the number of returned samples and
+    not on the length of the window.
+    '''
+
+    def __init__(self, data: np.ndarray, min_length: int = 64, levels=None):
+        '''
+        @param numpy.array data: a one or two dimensional array. Levels are built
+                                 along its last axis (time).
+
+        @keyword int min_length: levels shorter than this are not built
+        @keyword list levels: levels that are already built, like the ones
+                              another process shared. They are used as they are.
+        '''
+        self.data = data
+        self.min_length = min_length
+        self.__levels = None if levels is None else list(levels)
+        self.__lock = threading.Lock()
+        length = data.shape[-1]
+        self.level_count = 0
+        while length // 2 >= min_length:
+            length -= length // 2
+            self.level_count += 1
+        if self.__levels is not None:
+            self.level_count = len(self.__levels)
+
+    @property
+    def built(self):
+        '''
+        Whether the levels are built
+        '''
+        return self.__levels is not None
+
+    @property
+    def levels(self):
+        '''
+        The levels of the pyramid, as (minimum, maximum, mean) tuples. They are
+        built on the first access.
+        '''
+        if self.__levels is None:
+            self.build()
+        return self.__levels
+
+    def build(self):
+        '''
+        Builds the levels, if they are not built
+        '''
+        with self.__lock:
+            # Another thread may have built them while waiting for the lock
+            if self.__levels is None:
+                self.__levels = self.__build()
+
+    def __build(self):
+        levels = []
+        low = high = mean = self.data
+        while low.shape[-1] // 2 >= self.min_length:
+            low = _pairwise(low, np.fmin)
+            high = _pairwise(high, np.fmax)
+            mean = _pairwise(mean, _mean)
+            levels.append((low, high, mean))
+        return levels
+
+    def window(self, start: int, end: int, max_points: int, aggregate: str = "min_max"):
+        '''
+        Returns the samples between start and end, reduced to at most max_points.
+
+        @param int start: index of the first sample
+        @param int end: index after the last sample
+        @param int max_points: maximum number of samples to return
+
+        @keyword str aggregate: 'min_max' keeps the minimum and the maximum of each
+                                bucket of samples, 'mean' keeps their average.
+
+        @rtype: numpy.array, float
+        @return: the reduced signal and the number of original samples per
+                 returned sample
+        '''
+        if aggregate not in ("min_max", "mean"):
+            raise ValueError("'aggregate' should be either 'min_max' or 'mean'")
+        if max_points < 2:
+            raise ValueError("'max_points' should be at least 2")
+        start = max(start, 0)
+        end = min(end, self.data.shape[-1])
+        samples = max(end - start, 0)
+
+        if samples <= max_points:
+            return self.data[..., start:end], 1
+
+        # Coarsest level that still has at least max_points samples in the window
+        level = min(int(math.log2(samples / max_points)), self.level_count)
+        if level == 0:
+            return downsample(self.data[..., start:end], max_points, aggregate)
+
+        low, high, mean = self.levels[level - 1]
+        scale = 2 ** level
+        level_start = start // scale
+        level_end = -(-end // scale)
+        if aggregate == "mean":
+            reduced, step = downsample_mean(mean[..., level_start:level_end], max_points)
+        else:
+            reduced, step = reduce_min_max(low[..., level_start:level_end],
+                                           high[..., level_start:level_end],
+                                           max_points)
+        return reduced, step * scale
+
+
+def _pairwise(data: np.ndarray, function):
+    # Combines every two subsequent samples. An odd last sample is kept as is.
+    even = data.shape[-1] // 2 * 2
+    combined = function(data[..., 0:even:2], data[..., 1:even:2])
+    if even < data.shape[-1]:
+        combined = np.concatenate([combined, data[..., even:]], axis=-1)
+    return combined.astype(np.float32, copy=False)
+
+
+def _mean(first: np.ndarray, second: np.ndarray):
+    # Average that ignores NaN values, like np.fmin and np.fmax do
+    mean = (first + second) / 2
+    return np.where(np.isnan(first), second, np.where(np.isnan(second), first, mean))
+
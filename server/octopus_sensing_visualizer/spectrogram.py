@@ -0,0 +1,97 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class Spectrogram():
+    '''
+    Spectrogram of an EEG recording, for panning and zooming through it.
+
+    It serves windows of the quantized levels that prepare_spectrogram builds:
+    the coarsest level that still has enough frames is sliced, so like
+    SignalPyramid, the cost depends on the number of returned frames and not on
+    the length of the window.
+    '''
+
+    def __init__(self, levels: Dict[str, np.ndarray], sampling_rate: int, window_samples: int,
+                 hop_samples: int):
+        '''
+        @param dict levels: output of prepare_spectrogram
+        @param int sampling_rate: EEG sampling rate
+        @param int window_samples: length of the window of each frame, in samples
+        @param int hop_samples: distance between the starts of two frames, in samples
+        '''
+        self.levels = [levels[f"level_{level}"] for level in range(len(levels) - 1)]
+        self.db_range = [float(value) for value in levels["db_range"]]
+        self.sampling_rate = sampling_rate
+        self.window_samples = window_samples
+        self.hop_samples = hop_samples
+        self.frequencies = np.fft.rfftfreq(window_samples, 1.0/sampling_rate)
+
+    def window(self, start_time: float, end_time: float, max_frames: int,
+               max_frequency: Optional[float] = None, channel: Optional[int] = None):
+        '''
+        Returns the frames whose windows start between start_time and end_time
+
+        @param float start_time: start of the range in seconds
+        @param float end_time: end of the range in seconds
+        @param int max_frames: maximum number of frames to return
+
+        @keyword float max_frequency: higher frequencies are not returned
+        @keyword int channel: index of the channel. None means the average of all
+                              channels.
+
+        @rtype: numpy.array, dict
+        @return: uint8 matrix (frames * frequencies), and a dictionary of
+                 'frequencies', 'start_time' (time of the center of the first
+                 frame), 'frame_rate' (frames per second) and 'db_range' (dB
+                 values of 0 and 255)
+        '''
+        if max_frames < 1:
+            raise ValueError("'max_frames' should be at least 1")
+        # The last row of each level is the average of the channels
+        if channel is not None and not 0 <= channel < len(self.levels[0]) - 1:
+            raise ValueError(f"There is no channel {channel}")
+        row = -1 if channel is None else channel
+
+        frames_per_second = self.sampling_rate / self.hop_samples
+        range_first = max(0, math.ceil(start_time * frames_per_second))
+        range_last = max(range_first, math.ceil(end_time * frames_per_second))
+
+        # Finest level that has at most max_frames frames in the range, or the
+        # coarsest one. Frames after the end of the recording don't count.
+        for level, level_frames in enumerate(self.levels):
+            scale = 2 ** level
+            first = min(range_first // scale, level_frames.shape[1])
+            last = min(math.ceil(range_last / scale), level_frames.shape[1])
+            if last - first <= max_frames:
+                break
+        step = max(1, math.ceil((last - first) / max_frames))
+
+        bins = len(self.frequencies)
+        if max_frequency is not None:
+            bins = int(np.searchsorted(self.frequencies, max_frequency, side="right"))
+        frames = self.levels[level][row, first:last:step, :bins]
+
+        hop_seconds = self.hop_samples * scale / self.sampling_rate
+        # A frame of this level spans the windows of scale frames of the first level
+        window_seconds = \
+            (self.window_samples + self.hop_samples * (scale - 1)) / self.sampling_rate
+        return frames, {"frequencies": self.frequencies[:bins],
+                        "start_time": first * hop_seconds + window_seconds / 2,
+                        "frame_rate": 1 / (hop_seconds * step),
+                        "db_range": self.db_range}
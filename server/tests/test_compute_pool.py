@@ -0,0 +1,150 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import configparser
+import threading
+import time
+from concurrent import futures
+
+import cherrypy
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer.compute_pool import ComputePool, ComputePoolFull
+from octopus_sensing_visualizer.end_point import EndPoint
+
+# Workers are spawned, so they only run functions of the standard library: the
+# test module is never imported by them.
+
+
+@pytest.fixture
+def pool():
+    pool = ComputePool(1, max_pending=4, timeout=10)
+    # Waits for the worker to start
+    assert pool.run(abs, -1) == 1
+    yield pool
+    pool.shutdown()
+
+
+def _run_in_thread(pool, function, *args, group=None):
+    result = {}
+
+    def run():
+        try:
+            result["value"] = pool.run(function, *args, group=group)
+        except Exception as error:
+            result["error"] = error
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def _wait_for_pending(pool, pending):
+    deadline = time.monotonic() + 5
+    while pool.stats()["pending"] != pending:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_queue_full_is_rejected(pool):
+    threads = []
+    for pending in range(1, 5):
+        threads.append(_run_in_thread(pool, time.sleep, 0.5))
+        _wait_for_pending(pool, pending)
+    with pytest.raises(ComputePoolFull):
+        pool.run(abs, -2)
+    for thread, result in threads:
+        thread.join()
+        assert result == {"value": None}
+    stats = pool.stats()
+    assert stats["rejected"] == 1
+    assert stats["pending"] == 0
+    assert stats["completed"] == 5
+    # There's room again
+    assert pool.run(abs, -3) == 3
+
+
+def test_newer_computation_of_a_group_supersedes(pool):
+    # The worker runs one and the executor queues another, which can't be
+    # cancelled anymore
+    busy = [_run_in_thread(pool, time.sleep, 0.5) for _ in range(2)]
+    _wait_for_pending(pool, 2)
+    older, older_result = _run_in_thread(pool, abs, -4, group="scrub")
+    _wait_for_pending(pool, 3)
+    assert pool.run(abs, -5, group="scrub") == 5
+    older.join()
+    assert isinstance(older_result["error"], futures.CancelledError)
+    # Other groups are not superseded
+    other, other_result = _run_in_thread(pool, abs, -6, group="other")
+    assert pool.run(abs, -7, group="scrub") == 7
+    other.join()
+    assert other_result == {"value": 6}
+    for thread, _ in busy:
+        thread.join()
+    stats = pool.stats()
+    assert stats["superseded"] == 1
+    assert stats["pending"] == 0
+
+
+def test_timeout():
+    pool = ComputePool(1, timeout=0.2)
+    try:
+        pool.start()
+        with pytest.raises(futures.TimeoutError):
+            pool.run(time.sleep, 2)
+        assert pool.stats()["timeouts"] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_invalid_workers():
+    with pytest.raises(ValueError):
+        ComputePool(0)
+
+
+class _FailingPool():
+    # Raises error instead of computing
+    def __init__(self, error):
+        self.error = error
+        self.groups = []
+
+    def run(self, function, *args, group=None):
+        self.groups.append(group)
+        raise self.error
+
+
+@pytest.mark.parametrize("error,status", [
+    (ComputePoolFull(), 503),
+    (futures.TimeoutError(), 504),
+    (futures.CancelledError(), 409),
+])
+def test_offload_errors_are_http_errors(tmp_path, error, status):
+    np.savetxt(tmp_path / "gsr.csv", np.zeros(128 * 10), fmt="%.1f")
+    config = configparser.RawConfigParser()
+    config.read_dict({"SERVER": {"cache": "false"},
+                      "GSR": {"path": str(tmp_path / "gsr.csv"), "sampling_rate": "128",
+                              "display_signal": "true", "display_phasic": "false",
+                              "display_tonic": "false"}})
+    compute_pool = _FailingPool(error)
+    end_point = EndPoint(config, compute_pool, precompute=False)
+    cherrypy.request.headers = cherrypy.lib.httputil.HeaderMap({"X-Scrub-Id": "slider"})
+    cherrypy.request.remote.ip = "10.0.0.1"
+    with pytest.raises(cherrypy.HTTPError) as raised:
+        end_point._offload(abs, -1)
+    assert raised.value.status == status
+    assert compute_pool.groups == [("10.0.0.1", "slider")]
+    if status == 503:
+        cherrypy.serving.response.headers = cherrypy.lib.httputil.HeaderMap()
+        raised.value.set_response()
+        assert cherrypy.serving.response.headers["Retry-After"] == "1"
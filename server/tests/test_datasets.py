@@ -0,0 +1,153 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import threading
+
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer.datasets import DATASET_CONFIG_NAME, DatasetRegistry, \
+    find_datasets, read_dataset_config
+from octopus_sensing_visualizer.end_point import EndPoint, _is_memory_mapped
+
+
+class _Dataset():
+    def __init__(self, config, size):
+        self.config = config
+        self.size = size
+
+    def memory_size(self):
+        return self.size
+
+
+def _write_datasets(directory, sizes):
+    paths = {}
+    for name, size in sizes.items():
+        (directory / name).mkdir()
+        path = directory / name / DATASET_CONFIG_NAME
+        path.write_text(f"[GSR]\npath = gsr.csv\nsize = {size}\n")
+        paths[name] = str(path)
+    return paths
+
+
+def _loader(loaded):
+    def load(config):
+        loaded.append(config)
+        return _Dataset(config, config.getint('GSR', 'size'))
+    return load
+
+
+def test_evicts_least_recently_used(tmp_path):
+    loaded = []
+    registry = DatasetRegistry(_write_datasets(tmp_path, {"a": 40, "b": 40, "c": 40}),
+                               _loader(loaded), memory_budget=100)
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")
+    stats = registry.stats()
+    assert [dataset["loaded"] for dataset in stats["datasets"]] == [True, False, True]
+    assert stats["memory_size"] == 80
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 1
+    # An evicted dataset is loaded again
+    registry.get("b")
+    assert registry.stats()["loads"] == 4
+    assert len(loaded) == 4
+
+
+def _write_recordings(directory, names, samples):
+    paths = {}
+    for name in names:
+        (directory / name).mkdir()
+        np.savetxt(directory / name / "gsr.csv", np.linspace(0, 1, samples), fmt="%.4f")
+        path = directory / name / DATASET_CONFIG_NAME
+        path.write_text("[GSR]\npath = gsr.csv\nsampling_rate = 128\ndisplay_signal = true\n"
+                        "display_phasic = false\ndisplay_tonic = false\n")
+        paths[name] = str(path)
+    return paths
+
+
+def test_pyramids_built_after_loading_are_counted(tmp_path):
+    # Recordings are memory maps of the cache, so a dataset takes almost nothing
+    # until a request builds its pyramid
+    samples = 128 * 600
+    registry = DatasetRegistry(_write_recordings(tmp_path, ["a", "b"], samples),
+                               lambda config: EndPoint(config, precompute=False),
+                               memory_budget=samples * 4)
+    registry.get("a")
+    registry.get("b")
+    assert registry.stats()["memory_size"] < samples
+    assert registry.stats()["evictions"] == 0
+
+    for name in ("a", "b"):
+        pyramid = registry.get(name).pyramids["gsr"]
+        pyramid.window(0, samples, 100)
+        assert pyramid.built
+    # Each pyramid takes about 3 times its float32 signal, so both don't fit
+    registry.get("b")
+    stats = registry.stats()
+    assert stats["evictions"] == 1
+    assert [dataset["loaded"] for dataset in stats["datasets"]] == [False, True]
+    assert stats["memory_size"] == stats["datasets"][1]["memory_size"] > samples * 2
+
+
+def test_last_dataset_is_kept_over_budget(tmp_path):
+    registry = DatasetRegistry(_write_datasets(tmp_path, {"a": 40, "big": 500}),
+                               _loader([]), memory_budget=100)
+    registry.get("a")
+    registry.get("big")
+    stats = registry.stats()
+    assert [dataset["loaded"] for dataset in stats["datasets"]] == [False, True]
+
+
+def test_concurrent_requests_load_once(tmp_path):
+    loaded = []
+    registry = DatasetRegistry(_write_datasets(tmp_path, {"a": 40}), _loader(loaded))
+    threads = [threading.Thread(target=registry.get, args=("a",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loaded) == 1
+
+
+def test_dataset_config(tmp_path):
+    paths = _write_datasets(tmp_path, {"a": 40})
+    config = read_dataset_config(paths["a"])
+    assert config.get('GSR', 'path') == str(tmp_path / "a" / "gsr.csv")
+    # Datasets are loaded by request threads, so they are never live or forked
+    assert not config.getboolean('SERVER', 'live')
+    assert not config.getboolean('SERVER', 'parallel_loading')
+
+
+def test_find_datasets(tmp_path):
+    paths = _write_datasets(tmp_path, {"a": 40, "b": 40})
+    (tmp_path / "empty").mkdir()
+    config = read_dataset_config(paths["a"])
+    config.add_section('DATASETS')
+    config.set('DATASETS', 'directory', str(tmp_path))
+    assert find_datasets(config) == paths
+    config.set('DATASETS', 'configs', paths["a"])
+    with pytest.raises(Exception):
+        find_datasets(config)
+
+
+def test_memory_maps_are_not_counted(tmp_path):
+    path = tmp_path / "eeg.npy"
+    np.save(path, np.zeros((2, 100), dtype=np.float32))
+    memory_map = np.load(path, mmap_mode="r")
+    assert _is_memory_mapped(memory_map)
+    assert _is_memory_mapped(memory_map[:, 10:20])
+    assert not _is_memory_mapped(np.array(memory_map[:, 10:20]))
+    assert not _is_memory_mapped(np.zeros(10))
@@ -0,0 +1,84 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer.downsample import downsample, downsample_mean, reduce_min_max
+
+
+def test_short_signal_is_returned_untouched():
+    data = np.arange(10, dtype=np.float32)
+    reduced, step = downsample(data, 10)
+    assert reduced is data
+    assert step == 1
+
+
+def test_min_max_keeps_peaks_in_order():
+    data = np.zeros(1000, dtype=np.float32)
+    data[123] = 5
+    data[124] = -7
+    data[900] = -3
+    reduced, step = downsample(data, 20)
+    assert reduced.shape == (20,)
+    assert step == 50
+    # The bucket of samples 100-199 keeps its maximum, then its minimum
+    np.testing.assert_array_equal(reduced[2:4], [5, -7])
+    assert reduced.min() == -7
+    assert reduced.max() == 5
+    assert -3 in reduced
+
+
+def test_min_max_two_dimensional():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((3, 1001))
+    reduced, step = downsample(data, 100)
+    assert reduced.shape[0] == 3
+    assert reduced.shape[1] <= 100
+    np.testing.assert_array_equal(reduced.max(axis=-1), data.max(axis=-1))
+    np.testing.assert_array_equal(reduced.min(axis=-1), data.min(axis=-1))
+
+
+def test_min_max_nan_buckets():
+    data = np.arange(100, dtype=np.float64)
+    data[:10] = np.nan
+    data[15] = np.nan
+    reduced, _ = downsample(data, 20)
+    assert np.isnan(reduced[:2]).all()
+    np.testing.assert_array_equal(reduced[2:4], [10, 19])
+
+
+def test_reduce_min_max_of_aggregates():
+    low = np.array([0, -1, 2, 3, 4, -5, 6, 7], dtype=np.float32)
+    high = low + 10
+    reduced, step = reduce_min_max(low, high, 4)
+    np.testing.assert_array_equal(reduced, [-1, 13, -5, 17])
+    assert step == 2
+    # Few enough samples: both the minimum and the maximum of each are kept
+    reduced, step = reduce_min_max(low[:2], high[:2], 4)
+    np.testing.assert_array_equal(reduced, [0, 10, -1, 9])
+    assert step == 0.5
+
+
+def test_mean_ignores_nan():
+    data = np.array([1, 3, np.nan, 5, np.nan, np.nan, 7, 9], dtype=np.float32)
+    reduced, step = downsample_mean(data, 4)
+    np.testing.assert_array_equal(reduced, [2, 5, np.nan, 8])
+    assert step == 2
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        downsample(np.zeros(10), 4, aggregate="median")
+    with pytest.raises(ValueError):
+        downsample(np.zeros(10), 1)
@@ -0,0 +1,116 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer import metrics
+from octopus_sensing_visualizer.encoding import encode_json, encode_binary, \
+    encode_binary_stream, wants_binary
+
+
+def _decode(values):
+    return np.array([np.nan if value is None else value for value in values])
+
+
+def _decode_binary(body):
+    # Reads the binary format the way the UI does
+    header_length, = struct.unpack("<I", body[:4])
+    header = json.loads(body[4:4 + header_length])
+    buffers = body[4 + header_length:]
+    arrays = {}
+    for entry in header["entries"]:
+        assert (4 + header_length + entry["offset"]) % 8 == 0
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"]))
+        array = np.frombuffer(buffers, dtype=dtype, count=count,
+                              offset=entry["offset"]).reshape(entry["shape"])
+        if "labels" in entry:
+            array = dict(zip(entry["labels"], array.tolist()))
+        arrays[entry["key"]] = array
+    return arrays, header.get("metadata")
+
+
+def test_json_float32_is_shortest_repr():
+    values = np.array([-23.7504, 0.1, 3, np.nan, 1e-5], dtype=np.float32)
+    text = encode_json({"gsr": values})
+    assert text == '{"gsr": [-23.7504,0.1,3.0,null,1e-05]}'
+    decoded = _decode(json.loads(text)["gsr"]).astype(np.float32)
+    np.testing.assert_array_equal(decoded, values)
+
+
+def test_json_float32_two_dimensional():
+    values = np.arange(6, dtype=np.float32).reshape(2, 3) / 3
+    decoded = json.loads(encode_json({"eeg": values, "power_bands": {"Alpha": 0.5}}))
+    np.testing.assert_array_equal(np.array(decoded["eeg"], dtype=np.float32), values)
+    assert decoded["power_bands"] == {"Alpha": 0.5}
+
+
+def test_json_float32_payload_is_not_bigger_than_float64():
+    # Recordings are parsed from CSV files with a few decimals. Loaded as float32,
+    # their JSON should not be bigger than when they were loaded as float64.
+    rng = np.random.default_rng(0)
+    recording = np.round(rng.standard_normal((8, 2560)) * 30, 4)
+    float64_size = len(encode_json({"eeg": recording}))
+    float32_size = len(encode_json({"eeg": recording.astype(np.float32)}))
+    assert float32_size <= float64_size
+
+
+def _binary_output():
+    rng = np.random.default_rng(0)
+    return {"eeg": rng.standard_normal((3, 101)).astype(np.float32),
+            "gsr": np.array([1.5, np.nan, 2.25]),
+            "spectrogram": np.arange(15, dtype=np.uint8).reshape(3, 5),
+            "power_bands": {"Alpha": 0.25, "Beta": 0.75}}
+
+
+def test_binary_round_trip():
+    output = _binary_output()
+    arrays, metadata = _decode_binary(encode_binary(output, {"step": {"eeg": 2}}))
+    assert metadata == {"step": {"eeg": 2}}
+    np.testing.assert_array_equal(arrays["eeg"], output["eeg"])
+    # Float64 signals are sent as float32, and NaN is kept
+    assert arrays["gsr"].dtype == np.float32
+    np.testing.assert_array_equal(arrays["gsr"], output["gsr"].astype(np.float32))
+    assert arrays["spectrogram"].dtype == np.uint8
+    np.testing.assert_array_equal(arrays["spectrogram"], output["spectrogram"])
+    assert arrays["power_bands"] == output["power_bands"]
+
+
+def test_binary_stream_matches_binary():
+    output = _binary_output()
+    del output["power_bands"]
+    body = b"".join(encode_binary_stream(output, {"start": 0}, chunk_values=7))
+    assert body == encode_binary(output, {"start": 0})
+
+
+def test_wants_binary():
+    assert wants_binary("binary", "")
+    assert not wants_binary("json", "application/octet-stream")
+    assert wants_binary(None, "application/octet-stream, */*")
+    assert not wants_binary(None, "application/json")
+    with pytest.raises(ValueError):
+        wants_binary("csv", "")
+
+
+def test_json_spans():
+    timings = metrics.Timings()
+    metrics._request.timings = timings
+    try:
+        encode_json({"float64": np.array([1.5, np.nan]), "float32": np.array([1.5], np.float32)})
+    finally:
+        del metrics._request.timings
+    assert set(timings.durations) == {"json_dumps", "nan_replace", "tolist", "float32_text"}
@@ -0,0 +1,91 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import io
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from octopus_sensing_visualizer.export import export_csv, export_npy, export_npz, \
+    export_signals
+
+
+def _arrays():
+    rng = np.random.default_rng(0)
+    return {"eeg": rng.standard_normal((3, 1000)).astype(np.float32),
+            "gsr": rng.standard_normal(1000)}
+
+
+@pytest.mark.parametrize("key", ["eeg", "gsr"])
+@pytest.mark.parametrize("chunk_values", [7, 1 << 20])
+def test_npy_round_trip(key, chunk_values):
+    array = _arrays()[key]
+    body = b"".join(export_npy(array, chunk_values))
+    loaded = np.load(io.BytesIO(body))
+    assert loaded.dtype == array.dtype
+    np.testing.assert_array_equal(loaded, array)
+
+
+@pytest.mark.parametrize("chunk_values", [7, 1 << 20])
+def test_npz_round_trip(chunk_values):
+    arrays = _arrays()
+    body = b"".join(export_npz(arrays, chunk_values))
+    with np.load(io.BytesIO(body)) as loaded:
+        assert sorted(loaded.files) == ["eeg", "gsr"]
+        for key, array in arrays.items():
+            np.testing.assert_array_equal(loaded[key], array)
+
+
+def test_npy_of_memory_map(tmp_path):
+    path = tmp_path / "eeg.npy"
+    np.save(path, _arrays()["eeg"])
+    array = np.load(path, mmap_mode="r")[:, 100:900]
+    loaded = np.load(io.BytesIO(b"".join(export_npy(array, 100))))
+    np.testing.assert_array_equal(loaded, array)
+
+
+def test_csv():
+    arrays = {"eeg": np.array([[1, 2, np.nan], [4, 5, 6]], dtype=np.float32),
+              "gsr": np.array([0.5, 0.25, 0.125])}
+    body = b"".join(export_csv(arrays, {"eeg": ["Fp1", "Fp2"], "gsr": ["gsr"]}, 2, 10,
+                               chunk_values=8))
+    frame = pd.read_csv(io.BytesIO(body))
+    assert list(frame.columns) == ["time", "Fp1", "Fp2", "gsr"]
+    np.testing.assert_array_equal(frame["time"], [5, 5.5, 6])
+    np.testing.assert_array_equal(frame["Fp1"], [1, 2, np.nan])
+    np.testing.assert_array_equal(frame["gsr"], arrays["gsr"])
+
+
+def test_binary_metadata():
+    arrays = _arrays()
+    body = b"".join(export_signals("binary", arrays, {"eeg": ["a", "b", "c"], "gsr": ["gsr"]},
+                                   {"eeg": 128, "gsr": 64}, {"eeg": 256, "gsr": 64}))
+    header_length, = struct.unpack("<I", body[:4])
+    metadata = json.loads(body[4:4 + header_length])["metadata"]
+    assert metadata["start_times"] == {"eeg": 2, "gsr": 1}
+    assert metadata["columns"]["eeg"] == ["a", "b", "c"]
+
+
+def test_invalid_exports():
+    arrays = _arrays()
+    columns = {"eeg": ["a", "b", "c"], "gsr": ["gsr"]}
+    first_samples = {"eeg": 0, "gsr": 0}
+    with pytest.raises(ValueError):
+        export_signals("csv", arrays, columns, {"eeg": 128, "gsr": 64}, first_samples)
+    with pytest.raises(ValueError):
+        export_signals("npy", arrays, columns, {"eeg": 128, "gsr": 128}, first_samples)
+    with pytest.raises(ValueError):
+        export_signals("parquet", arrays, columns, {"eeg": 128, "gsr": 128}, first_samples)
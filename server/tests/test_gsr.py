@@ -0,0 +1,76 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import numpy as np
+import pandas as pd
+import pytest
+
+from octopus_sensing_visualizer.prepare_data.gsr import prepare_phasic_tonic, _fill_missing
+
+SAMPLING_RATE = 64
+
+
+def _gsr(seconds=900):
+    # A slowly drifting tonic level with skin conductance responses, plus noise
+    rng = np.random.default_rng(0)
+    samples = seconds * SAMPLING_RATE
+    times = np.arange(samples) / SAMPLING_RATE
+    impulses = np.zeros(samples)
+    impulses[rng.integers(0, samples, seconds // 10)] = rng.uniform(0.2, 1, seconds // 10)
+    kernel_times = np.arange(10 * SAMPLING_RATE) / SAMPLING_RATE
+    response = (1 - np.exp(-kernel_times / 0.75)) * np.exp(-kernel_times / 2)
+    return 5 + 0.5 * np.sin(2 * np.pi * times / seconds) + \
+        np.convolve(impulses, response)[:samples] + 0.01 * rng.standard_normal(samples)
+
+
+def test_chunked_matches_neurokit():
+    gsr = _gsr()
+    # Several chunks, each with margins on both sides
+    phasic, tonic = prepare_phasic_tonic(gsr, SAMPLING_RATE, chunk_seconds=120,
+                                         margin_seconds=120, workers=2)
+    expected_phasic, expected_tonic = prepare_phasic_tonic(gsr, SAMPLING_RATE,
+                                                           engine="neurokit")
+    signal_range = gsr.max() - gsr.min()
+    np.testing.assert_allclose(phasic, expected_phasic, rtol=0, atol=1e-9 * signal_range)
+    np.testing.assert_allclose(tonic, expected_tonic, rtol=0, atol=1e-9 * signal_range)
+
+
+def test_chunks_do_not_change_the_result():
+    gsr = _gsr(300).astype(np.float32)
+    whole = prepare_phasic_tonic(gsr, SAMPLING_RATE, chunk_seconds=300)
+    chunked = prepare_phasic_tonic(gsr, SAMPLING_RATE, chunk_seconds=37, workers=3)
+    signal_range = gsr.max() - gsr.min()
+    for expected, actual in zip(whole, chunked):
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9 * signal_range)
+
+
+def test_fill_missing_like_pandas():
+    signal = np.array([np.nan, np.nan, 1, 2, np.nan, np.nan, 3, np.nan])
+    expected = pd.Series(signal).ffill().bfill().to_numpy()
+    np.testing.assert_array_equal(_fill_missing(signal), expected)
+    with pytest.raises(ValueError):
+        _fill_missing(np.full(4, np.nan))
+
+
+def test_missing_samples_are_filled():
+    gsr = _gsr(300)
+    missing = gsr.copy()
+    missing[1000:1010] = np.nan
+    phasic, tonic = prepare_phasic_tonic(missing, SAMPLING_RATE)
+    assert np.isfinite(phasic).all()
+    assert np.isfinite(tonic).all()
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        prepare_phasic_tonic(_gsr(60), SAMPLING_RATE, engine="cvxeda")
@@ -0,0 +1,124 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import configparser
+import json
+
+import cherrypy
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer.end_point import EndPoint, _missing_ranges, _missing_samples
+
+
+@pytest.mark.parametrize("start,end,held,expected", [
+    (0, 10, [], [(0, 10)]),
+    (0, 10, [[0, 10]], []),
+    (0, 10, [[2, 4]], [(0, 2), (4, 10)]),
+    # Unsorted and overlapping ranges
+    (0, 10, [[6, 8], [1, 3], [2, 5]], [(0, 1), (5, 6), (8, 10)]),
+    (0, 10, [[3, 7], [4, 5]], [(0, 3), (7, 10)]),
+    # Ranges outside of the window
+    (5, 10, [[0, 2], [12, 20]], [(5, 10)]),
+    (5, 10, [[0, 6], [9, 20]], [(6, 9)]),
+    (5, 10, [[3, 12]], []),
+    # Like since at or past the end of the window
+    (5, 10, [[5, 10]], []),
+    (5, 10, [[5, 15]], []),
+])
+def test_missing_ranges(start, end, held, expected):
+    assert _missing_ranges(start, end, held) == expected
+
+
+def _covered(missing):
+    seconds = set()
+    for part_start, part_end in missing:
+        seconds.update(range(part_start, part_end))
+    return seconds
+
+
+@pytest.mark.parametrize("held", [[[6, 8], [1, 3], [2, 5]], [[0, 30]], [[-5, 2], [9, 100]]])
+def test_missing_and_held_cover_the_window(held):
+    start, end = 0, 12
+    missing = _missing_ranges(start, end, held)
+    held_seconds = {second for held_start, held_end in held
+                    for second in range(held_start, held_end)}
+    missing_seconds = _covered(missing)
+    assert not missing_seconds & held_seconds
+    assert missing_seconds | (held_seconds & set(range(start, end))) == set(range(start, end))
+
+
+@pytest.mark.parametrize("sampling_rate", [1, 64, 128])
+def test_missing_samples_are_slices_of_the_window(sampling_rate):
+    value = np.arange(2 * 20 * sampling_rate, dtype=np.float32).reshape(2, -1)
+    missing = _missing_ranges(3, 13, [[6, 8], [4, 5], [7, 9]])
+    samples, ranges = _missing_samples(value, missing, sampling_rate)
+    assert [[offset // sampling_rate, length // sampling_rate] for offset, length in ranges] == \
+        [[3, 1], [5, 1], [9, 4]]
+    position = 0
+    for offset, length in ranges:
+        np.testing.assert_array_equal(samples[:, position:position + length],
+                                      value[:, offset:offset + length])
+        position += length
+    assert position == samples.shape[-1]
+
+
+def test_nothing_missing():
+    samples, ranges = _missing_samples(np.zeros((2, 100)), [], 10)
+    assert samples.shape == (2, 0)
+    assert ranges == []
+
+
+def test_window_past_the_end_of_the_recording():
+    # The last part is cut at the end of the recording, and its length says so
+    value = np.arange(50)
+    samples, ranges = _missing_samples(value, _missing_ranges(3, 8, [[3, 4]]), 10)
+    assert ranges == [[40, 10]]
+    np.testing.assert_array_equal(samples, value[40:50])
+
+
+@pytest.fixture(scope="module")
+def end_point(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("recording")
+    rng = np.random.default_rng(0)
+    np.savetxt(directory / "gsr.csv", rng.standard_normal(64 * 30), fmt="%.4f")
+    config = configparser.RawConfigParser()
+    config.read_dict({"SERVER": {"cache": "false"},
+                      "GSR": {"path": str(directory / "gsr.csv"), "sampling_rate": "64",
+                              "display_signal": "true", "display_phasic": "false",
+                              "display_tonic": "false"}})
+    return EndPoint(config, precompute=False)
+
+
+@pytest.mark.parametrize("held", [[[12, 14], [10, 11], [13, 16]], [[10, 20]], [[20, 30]], []])
+def test_window_output_with_held_ranges(end_point, held):
+    full = end_point._window_output(10, 10)["gsr"]
+    output = end_point._window_output(10, 10, held=held)
+    for offset, length in output["ranges"]["gsr"]:
+        assert 640 <= offset and offset + length <= 1280
+    position = 0
+    for offset, length in output["ranges"]["gsr"]:
+        np.testing.assert_array_equal(output["gsr"][position:position + length],
+                                      full[offset - 640:offset - 640 + length])
+        position += length
+    assert position == output["gsr"].shape[-1]
+
+
+@pytest.mark.parametrize("since,expected", [(12, [[768, 512]]), (20, []), (25, [])])
+def test_get_data_since(end_point, since, expected):
+    cherrypy.request.method = "POST"
+    cherrypy.request.json = {"start_time": 10, "window_size": 10, "since": since}
+    cherrypy.request.headers = cherrypy.lib.httputil.HeaderMap({})
+    output = json.loads(end_point.get_data())
+    assert output["ranges"]["gsr"] == expected
+    assert len(output["gsr"]) == sum(length for _, length in expected)
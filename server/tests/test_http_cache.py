@@ -0,0 +1,110 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import configparser
+import gzip
+
+import pytest
+
+from octopus_sensing_visualizer.http_cache import available_encodings, compress, \
+    compress_stream, dataset_version, etag_matches, make_etag, negotiate_encoding
+
+
+@pytest.mark.parametrize("accept_encoding,expected", [
+    (None, None),
+    ("", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate", "gzip"),
+    ("identity", None),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    ("*, gzip;q=0", None),
+    ("GZIP;q=0.5", "gzip"),
+    ("gzip;q=oops", None),
+])
+def test_negotiate_gzip(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding, ["gzip"]) == expected
+
+
+def test_negotiate_prefers_quality_then_server_preference():
+    encodings = ["gzip", "br", "zstd"]
+    assert negotiate_encoding("gzip, br, zstd", encodings) == "br"
+    assert negotiate_encoding("gzip;q=1, br;q=0.5", encodings) == "gzip"
+    assert negotiate_encoding("zstd, gzip", encodings) == "zstd"
+    assert negotiate_encoding("br", ["gzip"]) is None
+
+
+def test_available_encodings_have_gzip():
+    assert available_encodings()[-1] == "gzip"
+
+
+@pytest.mark.parametrize("encoding", available_encodings())
+def test_compress_stream_matches_content(encoding):
+    body = b"".join(str(value).encode() for value in range(20000))
+    chunks = [body[start:start + 1000] for start in range(0, len(body), 1000)]
+    compressed = b"".join(compress_stream(chunks, encoding))
+    assert _decompress(compressed, encoding) == body
+    assert _decompress(compress(body, encoding), encoding) == body
+
+
+def test_gzip_is_deterministic():
+    assert compress(b"same body", "gzip") == compress(b"same body", "gzip")
+    assert compress(b"same body", None) == b"same body"
+    with pytest.raises(ValueError):
+        compress(b"body", "deflate")
+    with pytest.raises(ValueError):
+        compress_stream([b"body"], "deflate")
+
+
+def test_etag():
+    etag = make_etag("v1", {"start_time": 0, "window_size": 3}, None)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag("v1", {"window_size": 3, "start_time": 0}, None)
+    assert etag != make_etag("v2", {"start_time": 0, "window_size": 3}, None)
+    assert etag != make_etag("v1", {"start_time": 1, "window_size": 3}, None)
+    assert etag != make_etag("v1", {"start_time": 0, "window_size": 3}, "gzip")
+
+
+def test_etag_matches():
+    etag = make_etag("v1", {}, "gzip")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
+
+
+def test_dataset_version_follows_config_and_recordings(tmp_path):
+    recording = tmp_path / "gsr.csv"
+    recording.write_text("1\n2\n")
+    config = configparser.RawConfigParser()
+    config.read_dict({"GSR": {"path": str(recording), "sampling_rate": "128"}})
+    version = dataset_version(config)
+    assert version == dataset_version(config)
+
+    config.set("GSR", "sampling_rate", "64")
+    changed_config = dataset_version(config)
+    assert changed_config != version
+
+    recording.write_text("1\n2\n3\n")
+    assert dataset_version(config) != changed_config
+
+
+def _decompress(body, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "br":
+        import brotli
+        return brotli.decompress(body)
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj().decompress(body)
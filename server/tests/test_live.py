@@ -0,0 +1,74 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer.live import CsvTail, GrowableArray
+
+
+def test_growable_array_grows():
+    array = GrowableArray(channels=2, capacity=4)
+    first = np.arange(6, dtype=np.float32).reshape(2, 3)
+    array.append(first)
+    old_view = array.view()
+    second = np.arange(10, dtype=np.float32).reshape(2, 5)
+    array.append(second)
+    assert array.length == 8
+    np.testing.assert_array_equal(array.view(), np.concatenate([first, second], axis=-1))
+    # Views taken before growing still have their samples
+    np.testing.assert_array_equal(old_view, first)
+
+
+def test_growable_array_write_replaces_the_tail():
+    array = GrowableArray(capacity=2)
+    array.append(np.array([1, 2, 3], dtype=np.float32))
+    array.write(1, np.array([5], dtype=np.float32))
+    np.testing.assert_array_equal(array.view(), [1, 5])
+    with pytest.raises(ValueError):
+        array.write(3, np.array([1], dtype=np.float32))
+
+
+def test_csv_tail_reads_appended_rows(tmp_path):
+    path = tmp_path / "eeg.csv"
+    path.write_text("a,b,c\n1,2,3\n4,5")
+    tail = CsvTail(str(path), header=True, usecols=[0, 2])
+    np.testing.assert_array_equal(tail.read(), [[1], [3]])
+    assert tail.columns == ["a", "c"]
+    # The partial row is read once it's complete
+    assert tail.read() is None
+    with open(path, "a") as csv_file:
+        csv_file.write(",6\n7,8,9\n")
+    np.testing.assert_array_equal(tail.read(), [[4, 7], [6, 9]])
+    assert tail.read() is None
+
+
+def test_csv_tail_reads_at_most_max_read_bytes(tmp_path):
+    path = tmp_path / "gsr.csv"
+    path.write_text("".join(f"{value}\n" for value in range(100)))
+    tail = CsvTail(str(path), header=False, max_read_bytes=50)
+    chunks = []
+    while (rows := tail.read()) is not None:
+        chunks.append(rows[0])
+    assert len(chunks) > 1
+    np.testing.assert_array_equal(np.concatenate(chunks), np.arange(100))
+
+
+def test_csv_tail_truncated_file(tmp_path):
+    path = tmp_path / "gsr.csv"
+    path.write_text("1\n2\n")
+    tail = CsvTail(str(path), header=False)
+    tail.read()
+    path.write_text("1\n")
+    with pytest.raises(Exception):
+        tail.read()
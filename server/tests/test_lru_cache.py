@@ -0,0 +1,95 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import threading
+
+import pytest
+
+from octopus_sensing_visualizer.lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.items() == [("a", 1), ("c", 3)]
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 3, "misses": 0,
+                             "evictions": 1}
+
+
+def test_counts_misses():
+    cache = LRUCache(2)
+    assert cache.get("missing") is None
+    assert cache.get("missing", 0) == 0
+    assert cache.stats()["misses"] == 2
+
+
+def test_zero_size_disables_the_cache():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert len(cache) == 0
+    assert cache.get_or_compute("a", lambda: 2) == 2
+    with pytest.raises(ValueError):
+        LRUCache(-1)
+
+
+def test_get_or_compute_computes_once():
+    cache = LRUCache(4)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "value"
+
+    assert cache.get_or_compute("key", compute) == "value"
+    assert cache.get_or_compute("key", compute) == "value"
+    assert len(calls) == 1
+
+
+def test_items_is_not_an_access():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.items()
+    cache.put("c", 3)
+    assert "a" not in cache
+    assert cache.stats()["hits"] == 0
+
+
+def test_clear():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_threads_never_exceed_max_size():
+    cache = LRUCache(50)
+
+    def fill(offset):
+        for key in range(offset, offset + 1000):
+            cache.put(key, key)
+            cache.get(key - 1)
+
+    threads = [threading.Thread(target=fill, args=(offset * 1000,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 50
+    assert cache.stats()["evictions"] == 4000 - 50
@@ -0,0 +1,94 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer.prepare_data.eeg import DEFAULT_EEG_BANDS, bandpower, \
+    parse_eeg_bands, prepare_channel_power_bands, prepare_power_bands, \
+    prepare_power_bands_on_the_fly, _get_total_power_bands
+
+BANDS = {'Delta': (0, 4),
+         'Theta': (4, 8),
+         'Alpha': (8, 12),
+         'Beta': (12, 30),
+         'Gamma': (30, 45)}
+
+
+def _eeg(channels=4, seconds=30, sampling_rate=128):
+    rng = np.random.default_rng(0)
+    time = np.arange(seconds * sampling_rate) / sampling_rate
+    alpha = np.sin(2 * np.pi * 10 * time)
+    return (rng.standard_normal((channels, time.shape[0])) + alpha).astype(np.float32)
+
+
+def _windowed_power_bands(eeg_data, sampling_rate, window_size, overlap):
+    # One window at a time, like prepare_power_bands did before it was vectorized
+    samples = eeg_data.shape[-1]
+    signal_length = samples // sampling_rate
+    rows = []
+    start_time = 0
+    while (start_time + window_size) < (samples / sampling_rate):
+        window = eeg_data[:, start_time*sampling_rate:(start_time+window_size)*sampling_rate]
+        rows.append(_get_total_power_bands(window, sampling_rate, BANDS))
+        start_time += window_size - overlap
+    power_bands = {}
+    for band in BANDS:
+        band_power = np.zeros(signal_length)
+        band_power[0:window_size-1] = np.nan
+        band_power[window_size-1:signal_length-1] = [row[band] for row in rows]
+        power_bands[band] = band_power
+    return power_bands
+
+
+@pytest.mark.parametrize("window_size,overlap", [(3, 2), (5, 4), (1, 0)])
+@pytest.mark.parametrize("max_chunk_bytes", [1, 64 * 1024 * 1024])
+def test_power_bands_match_windowed_engine(window_size, overlap, max_chunk_bytes):
+    eeg = _eeg()
+    power_bands = prepare_power_bands(eeg, 128, window_size, overlap,
+                                      max_chunk_bytes=max_chunk_bytes)
+    expected = _windowed_power_bands(eeg, 128, window_size, overlap)
+    assert list(power_bands) == list(expected)
+    for band in BANDS:
+        np.testing.assert_allclose(power_bands[band], expected[band], rtol=1e-5)
+
+
+def test_window_bigger_than_signal():
+    with pytest.raises(Exception):
+        prepare_power_bands(_eeg(seconds=2), 128, 3, 2)
+
+
+@pytest.mark.parametrize("seconds", [4, 5, 10])
+def test_channel_power_bands_match_bandpower(seconds):
+    # One PSD for all channels and bands gives what bandpower gives for each
+    # channel and band with the same segment length
+    eeg = _eeg()
+    powers = prepare_channel_power_bands(eeg, 128, 3, seconds)
+    window = eeg[:, 3*128:(3+seconds)*128]
+    window_sec = 2 / min(low for low, _ in DEFAULT_EEG_BANDS.values())
+    for channel in range(eeg.shape[0]):
+        for idx, band in enumerate(DEFAULT_EEG_BANDS.values()):
+            expected = bandpower(window[channel], 128, band, window_sec=window_sec,
+                                 relative=True)
+            assert powers[channel, idx] == pytest.approx(expected, rel=1e-6)
+
+
+def test_on_the_fly_averages_channels():
+    eeg = _eeg()
+    bands = parse_eeg_bands("Theta: 4-8, Alpha: 8-12")
+    powers = prepare_channel_power_bands(eeg, 128, 0, 5, bands)
+    averages = prepare_power_bands_on_the_fly(eeg, 128, 0, 5, bands)
+    assert list(averages) == ["Theta", "Alpha"]
+    assert averages["Alpha"] == pytest.approx(powers[:, 1].mean())
+    # The 10 Hz sine of the signal is in the alpha band
+    assert averages["Alpha"] > averages["Theta"]
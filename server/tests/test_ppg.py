@@ -0,0 +1,63 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import warnings
+
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer.prepare_data.ppg import prepare_ppg_components
+
+SAMPLING_RATE = 128
+
+
+def _ppg(seconds=120):
+    # A pulse wave whose rate varies with breathing (0.25 Hz), plus baseline
+    # wander and noise
+    times = np.arange(seconds * SAMPLING_RATE) / SAMPLING_RATE
+    heart_rate = 70 + 5 * np.sin(2 * np.pi * 0.25 * times)
+    phase = np.cumsum(heart_rate / 60 / SAMPLING_RATE) % 1
+    pulse = np.exp(-((phase - 0.2) / 0.08) ** 2) + 0.4 * np.exp(-((phase - 0.5) / 0.1) ** 2)
+    noise = 2 * np.random.default_rng(0).standard_normal(times.shape[0])
+    return (500 + 100 * pulse + 10 * np.sin(2 * np.pi * 0.05 * times) + noise).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def components():
+    ppg = _ppg()
+    with warnings.catch_warnings():
+        # heartpy warns about the deprecated numpy functions it uses
+        warnings.simplefilter("ignore")
+        heartpy = prepare_ppg_components(ppg, SAMPLING_RATE, engine="heartpy")
+    return prepare_ppg_components(ppg, SAMPLING_RATE), heartpy
+
+
+@pytest.mark.parametrize("key,tolerance", [("hr", 1), ("hrv", 2), ("breathing_rate", 0.1)])
+def test_single_pass_is_close_to_heartpy(components, key, tolerance):
+    single_pass, heartpy = components
+    assert single_pass[key].shape == heartpy[key].shape
+    np.testing.assert_array_equal(np.isnan(single_pass[key]), np.isnan(heartpy[key]))
+    np.testing.assert_allclose(single_pass[key], heartpy[key], atol=tolerance)
+
+
+def test_single_pass_measures(components):
+    single_pass, _ = components
+    assert np.isnan(single_pass["hr"][:19]).all()
+    assert single_pass["hr"][-1] == 0
+    np.testing.assert_allclose(single_pass["hr"][19:-1], 70, atol=2)
+    np.testing.assert_allclose(single_pass["breathing_rate"][19:-1], 0.25, atol=0.1)
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        prepare_ppg_components(_ppg(30), SAMPLING_RATE, engine="neurokit")
@@ -0,0 +1,132 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import configparser
+
+import numpy as np
+import pytest
+
+from octopus_sensing_visualizer.downsample import downsample
+from octopus_sensing_visualizer.end_point import EndPoint
+from octopus_sensing_visualizer.pyramid import SignalPyramid
+
+
+def _signal(shape, seed=0):
+    return np.random.default_rng(seed).standard_normal(shape).astype(np.float32)
+
+
+def test_levels_are_built_on_first_use():
+    pyramid = SignalPyramid(_signal(1000))
+    assert not pyramid.built
+    assert pyramid.level_count == 3
+    assert len(pyramid.levels) == pyramid.level_count
+    assert pyramid.built
+    lengths = [low.shape[-1] for low, _, _ in pyramid.levels]
+    assert lengths == [500, 250, 125]
+
+
+def test_build():
+    pyramid = SignalPyramid(_signal(1000))
+    pyramid.build()
+    assert pyramid.built
+    levels = pyramid.levels
+    pyramid.build()
+    assert pyramid.levels is levels
+
+
+@pytest.mark.parametrize("cache", [True, False])
+def test_end_point_builds_pyramids_of_signals_in_memory(tmp_path, cache):
+    samples = 128 * 60
+    np.savetxt(tmp_path / "gsr.csv", np.linspace(0, 1, samples), fmt="%.4f")
+    config = configparser.RawConfigParser()
+    config.read_dict({"SERVER": {"cache": str(cache)},
+                      "GSR": {"path": str(tmp_path / "gsr.csv"), "sampling_rate": "128",
+                              "display_signal": "true", "display_phasic": "false",
+                              "display_tonic": "false"}})
+    end_point = EndPoint(config, precompute=False)
+    pyramid = end_point.pyramids["gsr"]
+    # Memory mapped recordings of the cache are built by the first request
+    assert pyramid.built is not cache
+    size = end_point.memory_size()
+    pyramid.window(0, samples, 100)
+    assert pyramid.built
+    if cache:
+        assert end_point.memory_size() > size + samples * 2
+    else:
+        assert end_point.memory_size() == size
+
+
+def test_short_window_is_not_reduced():
+    data = _signal(1000)
+    pyramid = SignalPyramid(data)
+    window, step = pyramid.window(100, 200, 100)
+    np.testing.assert_array_equal(window, data[100:200])
+    assert step == 1
+    assert not pyramid.built
+
+
+def test_levels_keep_minimum_maximum_and_mean():
+    data = _signal((2, 1001))
+    low, high, mean = SignalPyramid(data).levels[0]
+    np.testing.assert_array_equal(low[:, :500], np.minimum(data[:, 0:1000:2], data[:, 1:1000:2]))
+    np.testing.assert_array_equal(high[:, :500], np.maximum(data[:, 0:1000:2], data[:, 1:1000:2]))
+    np.testing.assert_allclose(mean[:, :500], (data[:, 0:1000:2] + data[:, 1:1000:2]) / 2,
+                               rtol=1e-6)
+    # An odd last sample is kept as it is
+    np.testing.assert_array_equal(low[:, 500], data[:, 1000])
+
+
+@pytest.mark.parametrize("start,end", [(0, 65536), (1000, 40000), (3, 7777)])
+def test_min_max_window_keeps_extremes(start, end):
+    data = _signal(65536)
+    window, step = SignalPyramid(data).window(start, end, 200)
+    assert window.shape[-1] <= 200
+    assert step > 1
+    # Level windows are aligned to their buckets, so they may reach a little
+    # further than the requested window, but never miss its extremes
+    assert window.max() >= data[start:end].max()
+    assert window.min() <= data[start:end].min()
+
+
+def test_whole_signal_matches_downsample():
+    data = _signal(4096)
+    window, step = SignalPyramid(data).window(0, 4096, 256)
+    expected, expected_step = downsample(data, 256)
+    # Levels don't keep which of the minimum and the maximum came first
+    np.testing.assert_array_equal(np.sort(window.reshape(-1, 2), axis=-1),
+                                  np.sort(expected.reshape(-1, 2), axis=-1))
+    assert step == expected_step
+
+
+def test_mean_window_ignores_nan():
+    data = np.ones(4096, dtype=np.float32)
+    data[::2] = np.nan
+    window, _ = SignalPyramid(data).window(0, 4096, 64, aggregate="mean")
+    np.testing.assert_array_equal(window, np.ones(64, dtype=np.float32))
+
+
+def test_shared_levels_are_used_as_they_are():
+    data = _signal(1000)
+    levels = SignalPyramid(data).levels
+    shared = SignalPyramid(data, levels=levels)
+    assert shared.built
+    assert shared.level_count == len(levels)
+    assert shared.levels[0][0] is levels[0][0]
+
+
+def test_invalid_parameters():
+    pyramid = SignalPyramid(_signal(1000))
+    with pytest.raises(ValueError):
+        pyramid.window(0, 1000, 100, aggregate="median")
+    with pytest.raises(ValueError):
+        pyramid.window(0, 1000, 1)
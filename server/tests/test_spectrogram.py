@@ -0,0 +1,123 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import numpy as np
+import pytest
+from scipy.signal import spectrogram
+from scipy.signal.windows import hann
+
+from octopus_sensing_visualizer.prepare_data.eeg import prepare_spectrogram, _decibels, \
+    _frames_power, _quantize
+from octopus_sensing_visualizer.spectrogram import Spectrogram
+
+SAMPLING_RATE = 128
+WINDOW = 128
+HOP = 32
+
+
+def _eeg(channels=3, seconds=120):
+    rng = np.random.default_rng(0)
+    times = np.arange(seconds * SAMPLING_RATE) / SAMPLING_RATE
+    return (rng.standard_normal((channels, times.shape[0])) +
+            np.sin(2 * np.pi * 10 * times)).astype(np.float32)
+
+
+def _scipy_power(eeg):
+    # Power of every channel and their average, like _frames_power returns
+    _, _, power = spectrogram(eeg.astype(np.float64), SAMPLING_RATE, window="hann",
+                              nperseg=WINDOW, noverlap=WINDOW - HOP, detrend=False,
+                              scaling="density", mode="psd", axis=-1)
+    power = np.swapaxes(power, 1, 2)
+    return np.concatenate([power, power.mean(axis=0, keepdims=True)])
+
+
+@pytest.mark.parametrize("window,hop", [(128, 32), (127, 16)])
+def test_power_matches_scipy(window, hop):
+    eeg = _eeg()
+    _, _, expected = spectrogram(eeg.astype(np.float64), SAMPLING_RATE, window="hann",
+                                 nperseg=window, noverlap=window - hop, detrend=False,
+                                 scaling="density", mode="psd", axis=-1)
+    frames = np.lib.stride_tricks.sliding_window_view(eeg, window, axis=-1)[:, ::hop]
+    frames = frames[:, :expected.shape[-1]]
+    taper = hann(window, sym=False).astype(np.float32)
+    power = _frames_power(frames, taper, 1 / (SAMPLING_RATE * np.sum(taper ** 2)))
+    np.testing.assert_allclose(power[:-1], np.swapaxes(expected, 1, 2), rtol=1e-3,
+                               atol=1e-6 * expected.max())
+    np.testing.assert_allclose(power[-1], power[:-1].mean(axis=0), rtol=1e-5)
+
+
+def test_levels_are_quantized_scipy_power():
+    eeg = _eeg()
+    levels = prepare_spectrogram(eeg, SAMPLING_RATE, WINDOW, HOP)
+    low, high = levels["db_range"]
+    power = _scipy_power(eeg)
+    for level in range(len(levels) - 1):
+        expected = _quantize(_decibels(power), low, high).astype(int)
+        actual = levels[f"level_{level}"]
+        assert actual.shape == expected.shape
+        # float32 rounding may move a value to the next level of 256
+        assert np.abs(actual.astype(int) - expected).max() <= 1
+        assert np.mean(actual != expected) < 0.01
+        even = power.shape[1] // 2 * 2
+        power = (power[:, 0:even:2] + power[:, 1:even:2]) / 2
+
+
+@pytest.mark.parametrize("seconds", [120, 97])
+def test_chunks_do_not_change_the_result(seconds):
+    eeg = _eeg(seconds=seconds)
+    whole = prepare_spectrogram(eeg, SAMPLING_RATE, WINDOW, HOP, max_chunk_bytes=1 << 30)
+    # Chunks of a few frames, rounded up to the alignment of the coarsest level
+    chunked = prepare_spectrogram(eeg, SAMPLING_RATE, WINDOW, HOP, max_chunk_bytes=1)
+    assert whole.keys() == chunked.keys()
+    assert len(whole) > 3
+    for key in whole:
+        assert whole[key].dtype == chunked[key].dtype
+        np.testing.assert_array_equal(whole[key], chunked[key])
+
+
+def test_level_lengths():
+    levels = prepare_spectrogram(_eeg(seconds=30), SAMPLING_RATE, WINDOW, HOP, min_frames=16)
+    frames = [levels[f"level_{level}"].shape[1] for level in range(len(levels) - 1)]
+    assert frames == [117, 58, 29]
+
+
+@pytest.fixture(scope="module")
+def spectrogram_levels():
+    return Spectrogram(prepare_spectrogram(_eeg(), SAMPLING_RATE, WINDOW, HOP),
+                       SAMPLING_RATE, WINDOW, HOP)
+
+
+@pytest.mark.parametrize("max_frames", [10000, 477, 476, 238, 237, 119, 100, 30, 1])
+def test_max_frames_picks_the_finest_level_that_fits(spectrogram_levels, max_frames):
+    # Levels have 477, 238 and 119 frames. The first one that fits in max_frames
+    # is used, or the coarsest one with a step between the returned frames.
+    levels = spectrogram_levels.levels
+    level = next((level for level, frames in enumerate(levels) if frames.shape[1] <= max_frames),
+                 len(levels) - 1)
+    step = -(-levels[level].shape[1] // max_frames)
+    frames, info = spectrogram_levels.window(0, 120, max_frames)
+    assert frames.shape[0] <= max_frames
+    np.testing.assert_array_equal(frames, levels[level][-1, ::step])
+    assert info["frame_rate"] == pytest.approx(SAMPLING_RATE / HOP / 2 ** level / step)
+
+
+def test_window_of_a_channel_and_frequencies(spectrogram_levels):
+    frames, info = spectrogram_levels.window(10, 20, 1000, max_frequency=20, channel=1)
+    np.testing.assert_array_equal(frames, spectrogram_levels.levels[0][1, 40:80, :21])
+    assert info["frequencies"][-1] == 20
+    assert info["start_time"] == pytest.approx(10 + WINDOW / SAMPLING_RATE / 2)
+    assert info["frame_rate"] == SAMPLING_RATE / HOP
+    with pytest.raises(ValueError):
+        spectrogram_levels.window(0, 10, 10, channel=3)
+    with pytest.raises(ValueError):
+        spectrogram_levels.window(0, 10, 0)
@@ -0,0 +1,107 @@
+# This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+# Copyright © Nastaran Saffaryazdi 2021
+#
+# Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+#  either version 3 of the License, or (at your option) any later version.
+#
+# Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+# If not, see <https://www.gnu.org/licenses/>.
+import configparser
+import itertools
+import json
+
+import cherrypy
+import numpy as np
+import pytest
+from cherrypy import _cprequest
+
+from octopus_sensing_visualizer.end_point import EndPoint
+
+SAMPLING_RATE = 64
+SECONDS = 10
+
+
+@pytest.fixture
+def end_point(tmp_path):
+    gsr = np.random.default_rng(0).standard_normal(SAMPLING_RATE * SECONDS)
+    np.savetxt(tmp_path / "gsr.csv", gsr, fmt="%.4f")
+    config = configparser.RawConfigParser()
+    config.read_dict({"SERVER": {"cache": "false", "max_streams": "1"},
+                      "GSR": {"path": str(tmp_path / "gsr.csv"),
+                              "sampling_rate": str(SAMPLING_RATE), "display_signal": "true",
+                              "display_phasic": "false", "display_tonic": "false"}})
+    return EndPoint(config, precompute=False)
+
+
+def _new_request():
+    # Each call of a handler gets its own request, like CherryPy gives it
+    request = _cprequest.Request(cherrypy.lib.httputil.Host("127.0.0.1", 8080),
+                                 cherrypy.lib.httputil.Host("127.0.0.1", 50000))
+    # As Request.run does, so hooks aren't shared between requests
+    request.hooks = request.hooks.copy()
+    cherrypy.serving.load(request, _cprequest.Response())
+    return request
+
+
+def _parse(event):
+    lines = event.decode("utf-8").rstrip("\n").split("\n")
+    assert lines[0].startswith("event: ")
+    assert lines[1].startswith("data: ")
+    return lines[0][len("event: "):], json.loads(lines[1][len("data: "):])
+
+
+def test_events(end_point):
+    request = _new_request()
+    events = [_parse(event) for event in end_point.stream(3, 5, interval=0)]
+    assert cherrypy.serving.response.headers["Content-Type"] == "text/event-stream"
+    gsr = np.asarray(end_point.data["gsr"], dtype=np.float32)
+
+    assert [name for name, _ in events] == ["window", "append", "append", "end"]
+    _, window = events[0]
+    assert window["start_time"] == 3
+    np.testing.assert_array_equal(np.array(window["data"]["gsr"], dtype=np.float32),
+                                  gsr[3 * SAMPLING_RATE:8 * SAMPLING_RATE])
+    # Each append has the second that became visible at the end of the window
+    for (_, event), start_time in zip(events[1:3], (4, 5)):
+        assert event["start_time"] == start_time
+        end = (start_time + 5) * SAMPLING_RATE
+        np.testing.assert_array_equal(np.array(event["data"]["gsr"], dtype=np.float32),
+                                      gsr[end - SAMPLING_RATE:end])
+    assert events[-1][1] == {"start_time": 5}
+    request.hooks.run("on_end_request")
+
+
+def test_window_at_the_end(end_point):
+    request = _new_request()
+    events = [_parse(event) for event in end_point.stream(5, 5, interval=0)]
+    assert [name for name, _ in events] == ["window", "end"]
+    request.hooks.run("on_end_request")
+
+
+def test_live_streams_keep_alive(end_point):
+    request = _new_request()
+    end_point.live = True
+    events = list(itertools.islice(end_point.stream(5, 5, interval=0), 3))
+    assert _parse(events[0])[0] == "window"
+    assert events[1:] == [b": keep-alive\n\n"] * 2
+    request.hooks.run("on_end_request")
+
+
+def test_stream_slots(end_point):
+    first = _new_request()
+    end_point.stream(0, 5, interval=0)
+    # max_streams is 1
+    _new_request()
+    with pytest.raises(cherrypy.HTTPError) as raised:
+        end_point.stream(0, 5, interval=0)
+    assert raised.value.status == 503
+    # The slot is released when the request of the first stream ends
+    first.hooks.run("on_end_request")
+    third = _new_request()
+    end_point.stream(0, 5, interval=0)
+    third.hooks.run("on_end_request")
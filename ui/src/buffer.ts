@@ -0,0 +1,152 @@
+/* This file is part of Octopus Sensing <https://octopus-sensing.nastaran-saffar.me/>
+* Copyright © Nastaran Saffaryazdi 2021
+*
+* Octopus Sensing Visualizer is a free software: you can redistribute it and/or modify it under the
+* terms of the GNU General Public License as published by the Free Software Foundation,
+*  either version 3 of the License, or (at your option) any later version.
+*
+* Octopus Sensing Visualizer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+* See the GNU General Public License for more details.
+*
+ You should have received a copy of the GNU General Public License along with Octopus Sensing Visualizer.
+* If not, see <https://www.gnu.org/licenses/>.
+*/
+
+
+import { Series } from './types'
+
+// Samples of a signal in the range [start, end), in sample positions from the start of
+// the recording. At most 'capacity' samples are kept.
+export class RingBuffer {
+    start = 0
+    end = 0
+    private values: Float32Array
+
+    constructor(capacity: number) {
+        this.values = new Float32Array(Math.max(1, capacity))
+    }
+
+    get capacity(): number {
+        return this.values.length
+    }
+
+    // Writes data[from:to] at sample position 'offset'. Held samples that aren't
+    // contiguous with the new ones are dropped. When the buffer is full, the samples
+    // farthest from the new ones are dropped.
+    write(offset: number, data: Series, from = 0, to = data.length): void {
+        if (to - from > this.capacity) {
+            offset += to - from - this.capacity
+            from = to - this.capacity
+        }
+        const end = offset + to - from
+
+        if (this.start == this.end || offset > this.end || end < this.start) {
+            this.start = offset
+            this.end = end
+        } else {
+            const forward = end > this.end
+            this.start = Math.min(this.start, offset)
+            this.end = Math.max(this.end, end)
+            if (this.end - this.start > this.capacity) {
+                if (forward) {
+                    this.start = this.end - this.capacity
+                } else {
+                    this.end = this.start + this.capacity
+                }
+            }
+        }
+
+        for (let idx = from; idx < to; idx++) {
+            const value = data[idx]
+            this.values[(offset + idx - from) % this.capacity] = value == null ? NaN : value
+        }
+    }
+
+    // Copy of the samples in [start, end). It stops at the end of the held samples, like
+    // a window that passes the end of the recording. Samples before them are NaN.
+    read(start: number, end: number): Float32Array {
+        const output = new Float32Array(Math.max(0, Math.min(end, this.end) - start))
+        for (let idx = 0; idx < output.length; idx++) {
+            const position = start + idx
+            output[idx] = position >= this.start ? this.values[position % this.capacity] : NaN
+        }
+        return output
+    }
+}
+
+// A ring buffer for every signal (and every channel of the EEG) of the windows that
+// were fetched with get_data's 'held' ranges. It keeps one window, or two when the next
+// window is prefetched.
+export class WindowBuffers {
+    readonly windowSize: number
+    readonly prefetch: boolean
+    private samplingRates: { [key: string]: number }
+    private buffers: { [key: string]: RingBuffer[] } = {}
+    // Keys of the signals with more than one channel
+    private multiChannel = new Set<string>()
+
+    constructor(windowSize: number, samplingRates: { [key: string]: number }, prefetch: boolean) {
+        this.windowSize = windowSize
+        this.samplingRates = samplingRates
+        this.prefetch = prefetch
+    }
+
+    // Range of seconds held for all the signals, as get_data's 'held' field
+    held(): Array<[number, number]> {
+        let start = -Infinity
+        let end = Infinity
+        for (const key in this.buffers) {
+            const samplingRate = this.samplingRates[key]
+            for (const buffer of this.buffers[key]) {
+                start = Math.max(start, Math.ceil(buffer.start / samplingRate))
+                end = Math.min(end, Math.floor(buffer.end / samplingRate))
+            }
+        }
+        return start < end && isFinite(start) ? [[start, end]] : []
+    }
+
+    // Stores the samples of a get_data response that was requested with 'held'
+    write(response: Record<string, unknown>): void {
+        const ranges = response.ranges as { [key: string]: Array<[number, number]> }
+        for (const key in ranges) {
+            const value = response[key] as Series | Series[]
+            const rows = isMultiChannel(value) ? value : [value]
+            if (isMultiChannel(value)) {
+                this.multiChannel.add(key)
+            }
+
+            if (this.buffers[key] == null || this.buffers[key].length != rows.length) {
+                const seconds = this.prefetch ? 2 * this.windowSize : this.windowSize
+                const capacity = Math.ceil(seconds * this.samplingRates[key])
+                this.buffers[key] = rows.map(() => new RingBuffer(capacity))
+            }
+
+            rows.forEach((row, idx) => {
+                let position = 0
+                for (const [offset, length] of ranges[key]) {
+                    this.buffers[key][idx].write(offset, row, position, position + length)
+                    position += length
+                }
+            })
+        }
+    }
+
+    // The window at startTime, in the format of a get_data response
+    read(startTime: number, windowSize: number): Record<string, Float32Array | Float32Array[]> {
+        const output: Record<string, Float32Array | Float32Array[]> = {}
+        for (const key in this.buffers) {
+            const samplingRate = this.samplingRates[key]
+            const rows = this.buffers[key].map((buffer) =>
+                buffer.read(startTime * samplingRate, (startTime + windowSize) * samplingRate),
+            )
+            output[key] = this.multiChannel.has(key) ? rows : rows[0]
+        }
+        return output
+    }
+}
+
+function isMultiChannel(value: Series | Series[]): value is Series[] {
+    // Channels are arrays, samples are numbers (or null for missing values)
+    return value.length > 0 && typeof value[0] == 'object' && value[0] != null
+}
@@ -1,6 +1,6 @@
 import { Chart } from 'chart.js'
 
-import type { Charts } from './types'
+import type { Charts, Series } from './types'
 
 export const charts: Charts = {
     gsr: null,
@@ -88,15 +88,16 @@ export function makeBarChart(id: string, color: string): Chart {
     })
 }
 
-export function updateChart(chart: Chart, data: Array<number | null>, time: number): void {
+export function updateChart(chart: Chart, data: Series, time: number, samplingRate = 128): void {
     if (!chart.data.datasets) {
         throw new Error("in updateChart: 'chart.data.datasets' is undefined! Should never happen!")
     }
-    chart.data.datasets[0].data = data
+    // Chart.js accepts typed arrays as well. NaN values are drawn as gaps, like null.
+    chart.data.datasets[0].data = data as Array<number | null>
 
     const labels = Array(data.length)
     for (let idx = 0; idx < data.length; idx++) {
-        labels[idx] = (idx / 128 + time).toFixed(2)
+        labels[idx] = (idx / samplingRate + time).toFixed(2)
     }
     chart.data.labels = labels
 
@@ -104,6 +105,19 @@ export function updateChart(chart: Chart, data: Array<number | null>, time: numb
     chart.update('none')
 }
 
+// Slides the chart forward: drops as many samples from the beginning as there are new
+// ones, and adds the new samples at the end. time is the start of the new window.
+export function appendToChart(chart: Chart, data: Series, time: number, samplingRate = 128): void {
+    if (!chart.data.datasets) {
+        throw new Error(
+            "in appendToChart: 'chart.data.datasets' is undefined! Should never happen!",
+        )
+    }
+    const current = chart.data.datasets[0].data as Array<number | null>
+    const updated = current.slice(Math.min(data.length, current.length)).concat(Array.from(data))
+    updateChart(chart, updated, time, samplingRate)
+}
+
 export function clearCharts(): void {
     let key: keyof Charts
     for (key in charts) {
@@ -38,13 +38,24 @@ Chart.register(
     LineElement,
 )
 
-import { fetchServerData, fetchServerMetadata } from './services'
-import { charts, createCharts, updateChart, clearCharts } from './chart'
-import { ServerMetaData } from './types'
+import {
+    fetchServerData,
+    fetchBufferedServerData,
+    fetchServerMetadata,
+    openPlaybackStream,
+    SUPERSEDED,
+} from './services'
+import { charts, createCharts, updateChart, appendToChart, clearCharts } from './chart'
+import { Series, ServerData, ServerMetaData } from './types'
 
 let playFlag = false
+// Server-Sent Events stream of the playback. Only open while playing.
+let playbackStream: EventSource | null = null
 let window_size = 3
 let dataLength = 3
+let samplingRates: { [key: string]: number } = {}
+// Fetch the next window in the background while showing a window sample by sample
+const prefetchNextWindow = true
 
 function makeCanvas(id: string, htmlClass: string): string {
     return `
@@ -59,6 +70,9 @@ function onWindowSizeChange() {
     window_size = parseInt(windowSizeBox.value)
     const slider = document.getElementById('slider') as HTMLInputElement
     slider.max = (dataLength - window_size + 1).toString()
+    if (playFlag == true) {
+        startPlayback()
+    }
 }
 
 function onPlayPauseClick() {
@@ -66,15 +80,48 @@ function onPlayPauseClick() {
     if (playFlag == true) {
         playFlag = false
         playPauseButton.textContent = '\ue019'
+        stopPlayback()
     } else {
         playFlag = true
         playPauseButton.textContent = '\ue01a'
+        startPlayback()
     }
     console.log('playpause button is clicked')
 }
 
+// The server pushes the next second of the signals every second, so the charts are
+// slid forward instead of fetching the whole window again.
+function startPlayback() {
+    const slider = document.getElementById('slider') as HTMLInputElement
+    stopPlayback()
+    playbackStream = openPlaybackStream(
+        window_size,
+        Number.parseInt(slider.value),
+        (start_time: number, data: ServerData) => showData(data, start_time, updateChart),
+        (start_time: number, data: ServerData) => {
+            slider.value = start_time.toString()
+            showData(data, start_time, appendToChart)
+        },
+        () => {
+            // End of the recording
+            playbackStream = null
+            playFlag = false
+            const playPauseButton = document.getElementById('play-pause-button') as HTMLInputElement
+            playPauseButton.textContent = '\ue019'
+        },
+    )
+}
+
+function stopPlayback() {
+    if (playbackStream != null) {
+        playbackStream.close()
+        playbackStream = null
+    }
+}
+
 function onResetClick() {
     playFlag = false
+    stopPlayback()
     const playPauseButton = document.getElementById('play-pause-button') as HTMLInputElement
     playPauseButton.textContent = '\ue01a'
     const slider = document.getElementById('slider') as HTMLInputElement
@@ -88,13 +135,43 @@ export async function onSliderChange(sliderAmount: string): Promise<void> {
 
     const start_time = Number.parseInt(sliderAmount)
 
-    const data = await fetchServerData(window_size, start_time)
+    // One sample per pixel is enough, the server reduces longer signals. Shorter windows
+    // are kept on the client, so moving them only fetches the seconds that are new.
+    const rates = Object.keys(samplingRates).map((key) => samplingRates[key])
+    let data: ServerData
+    try {
+        if (rates.length > 0 && window_size * Math.max(...rates) <= window.innerWidth) {
+            data = await fetchBufferedServerData(
+                window_size,
+                start_time,
+                samplingRates,
+                prefetchNextWindow,
+            )
+        } else {
+            data = await fetchServerData(window_size, start_time, window.innerWidth)
+        }
+    } catch (error) {
+        // A newer position of the slider is being fetched
+        if (error == SUPERSEDED) {
+            return
+        }
+        throw error
+    }
+    showData(data, start_time, updateChart)
+}
+
+type DrawFunction = (chart: Chart, data: Series, time: number, samplingRate?: number) => void
+
+// Draws each signal of data on its chart. draw either replaces the content of the
+// chart (updateChart) or slides it forward (appendToChart).
+function showData(data: ServerData, start_time: number, draw: DrawFunction) {
+    const rates = data.samplingRates ?? {}
     if (charts.eeg != null) {
         if (data.eeg) {
             const eegData = data.eeg
             charts.eeg.forEach((chart: Chart, idx: number) => {
                 if (eegData.length > idx) {
-                    updateChart(chart, eegData[idx], start_time)
+                    draw(chart, eegData[idx], start_time, rates.eeg)
                 } else {
                     console.error(
                         `Not enough data! charts: ${charts.eeg?.length} data: ${eegData.length}`,
@@ -106,75 +183,74 @@ export async function onSliderChange(sliderAmount: string): Promise<void> {
 
     if (charts.gsr != null) {
         if (data.gsr) {
-            updateChart(charts.gsr, data.gsr, start_time)
+            draw(charts.gsr, data.gsr, start_time, rates.gsr)
         }
     }
 
     if (charts.ppg != null) {
         if (data.ppg) {
-            updateChart(charts.ppg, data.ppg, start_time)
+            draw(charts.ppg, data.ppg, start_time, rates.ppg)
         }
     }
-    console.log(data.powerBands)
     if (charts.powerBands != null) {
         if (data.powerBands) {
-            console.log(data.powerBands)
+            // Power bands of the window are always replaced as a whole
             updateChart(charts.powerBands, data.powerBands, start_time)
         }
     }
 
     if (charts.deltaBand != null) {
         if (data.deltaBand) {
-            updateChart(charts.deltaBand, data.deltaBand, start_time)
+            draw(charts.deltaBand, data.deltaBand, start_time, rates.delta_band)
         }
     }
     if (charts.thetaBand != null) {
         if (data.thetaBand) {
-            updateChart(charts.thetaBand, data.thetaBand, start_time)
+            draw(charts.thetaBand, data.thetaBand, start_time, rates.theta_band)
         }
     }
     if (charts.alphaBand != null) {
         if (data.alphaBand) {
-            updateChart(charts.alphaBand, data.alphaBand, start_time)
+            draw(charts.alphaBand, data.alphaBand, start_time, rates.alpha_band)
         }
     }
     if (charts.betaBand != null) {
         if (data.betaBand) {
-            updateChart(charts.betaBand, data.betaBand, start_time)
+            draw(charts.betaBand, data.betaBand, start_time, rates.beta_band)
         }
     }
     if (charts.gammaBand != null) {
         if (data.gammaBand) {
-            updateChart(charts.gammaBand, data.gammaBand, start_time)
+            draw(charts.gammaBand, data.gammaBand, start_time, rates.gamma_band)
         }
     }
     if (charts.gsrPhasic != null) {
         if (data.gsrPhasic) {
-            updateChart(charts.gsrPhasic, data.gsrPhasic, start_time)
+            draw(charts.gsrPhasic, data.gsrPhasic, start_time, rates.gsr_phasic)
         }
     }
 
     if (charts.gsrTonic != null) {
         if (data.gsrTonic) {
-            updateChart(charts.gsrTonic, data.gsrTonic, start_time)
+            draw(charts.gsrTonic, data.gsrTonic, start_time, rates.gsr_tonic)
         }
     }
 
     if (charts.hr != null) {
         if (data.hr) {
-            updateChart(charts.hr, data.hr, start_time)
+            draw(charts.hr, data.hr, start_time, rates.hr)
         }
     }
 
     if (charts.hrv != null) {
         if (data.hrv) {
-            updateChart(charts.hrv, data.hrv, start_time)
+            draw(charts.hrv, data.hrv, start_time, rates.hrv)
         }
     }
 
     if (charts.breathingRate != null) {
         if (data.breathingRate) {
-            updateChart(charts.breathingRate, data.breathingRate, start_time)
+            draw(charts.breathingRate, data.breathingRate, start_time, rates.breathing_rate)
         }
     }
 }
@@ -186,7 +262,14 @@ function initControls() {
         slider.min = '0'
         slider.max = (dataLength - window_size + 1).toString()
         slider.step = '1'
-        slider.onchange = () => onSliderChange(slider.value)
+        slider.onchange = () => {
+            if (playFlag == true) {
+                // Continue playing from the new position
+                startPlayback()
+            } else {
+                onSliderChange(slider.value)
+            }
+        }
 
         const windowSizeBox = document.getElementById('window-size-box') as HTMLInputElement
         windowSizeBox.min = '1'
@@ -207,15 +290,6 @@ function initControls() {
     }
 }
 
-function changeSliderValue() {
-    if (playFlag == true) {
-        const slider = document.getElementById('slider') as HTMLInputElement
-        const sliderAmount = Number.parseInt(slider.value) + 1
-        slider.value = sliderAmount.toString()
-        onSliderChange(slider.value)
-    }
-}
-
 async function makeHtml(metaData: ServerMetaData): Promise<string> {
     let pageHtml = '<div id="signal-container">'
 
@@ -301,6 +375,7 @@ async function main() {
     const metadata = await fetchServerMetadata()
     const pageHtml = await makeHtml(metadata)
     dataLength = metadata.dataLength
+    samplingRates = metadata.samplingRates
 
     const dataElement = document.getElementById('data-container')
     if (!dataElement) {
@@ -310,7 +385,6 @@ async function main() {
     dataElement.innerHTML = pageHtml
     createCharts(metadata.enabledGraphs)
     initControls()
-    setInterval(changeSliderValue, 1000)
 }
 
 main()
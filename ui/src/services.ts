@@ -13,58 +13,239 @@
 * If not, see <https://www.gnu.org/licenses/>.
 */
 
-import { ServerData, ServerMetaData } from './types'
+import { WindowBuffers } from './buffer'
+import { BinaryData, Series, ServerData, ServerMetaData } from './types'
 
-// data to be sent to the POST request
+const BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+// Rejection reason of a get_data request that the server dropped, because a newer one
+// of the same page arrived before it was computed
+export const SUPERSEDED = 'superseded'
+
+// Identifies the requests of this page, so the server can drop the stale ones while the
+// slider is being dragged
+const SCRUB_ID = Math.random().toString(36).slice(2)
+
+// URL of an API handler. When the server has many datasets, the one to show is chosen
+// with the 'dataset' query parameter of the page, like '/?dataset=session-12'.
+function apiUrl(handler: string): string {
+    const dataset = new URLSearchParams(window.location.search).get('dataset')
+    const prefix = dataset ? '/api/' + encodeURIComponent(dataset) + '/' : '/api/'
+    return 'http://' + window.location.host + prefix + handler
+}
 
 export async function fetchServerData(
     window_size: number,
     start_time: number,
+    max_points: number | null = null,
+    binary = true,
+): Promise<ServerData> {
+    const parameters = {
+        window_size: window_size,
+        start_time: start_time,
+        max_points: max_points ?? undefined,
+    }
+
+    return toServerData(await requestData(parameters, binary))
+}
+
+// Signals of the last windows, kept on the client. See fetchBufferedServerData.
+let windowBuffers: WindowBuffers | null = null
+
+// Like fetchServerData without max_points, but only the seconds of the window that
+// aren't held on the client yet are transferred. So moving the window forward by one
+// second transfers one second of data. If prefetch is true, the next window is fetched
+// in the background as well.
+export async function fetchBufferedServerData(
+    window_size: number,
+    start_time: number,
+    samplingRates: { [key: string]: number },
+    prefetch = false,
+    binary = true,
 ): Promise<ServerData> {
-    const post_data = {
+    if (
+        windowBuffers == null ||
+        windowBuffers.windowSize != window_size ||
+        windowBuffers.prefetch != prefetch
+    ) {
+        windowBuffers = new WindowBuffers(window_size, samplingRates, prefetch)
+    }
+    const buffers = windowBuffers
+
+    const parameters = {
         window_size: window_size,
         start_time: start_time,
+        held: buffers.held(),
+    }
+    const response = await requestData(parameters, binary)
+    buffers.write(response)
+
+    if (prefetch) {
+        const next_parameters = {
+            window_size: window_size,
+            start_time: start_time + window_size,
+            held: buffers.held(),
+        }
+        requestData(next_parameters, binary)
+            .then((nextResponse) => buffers.write(nextResponse))
+            .catch((error) => {
+                if (error != SUPERSEDED) {
+                    console.error(error)
+                }
+            })
+    }
+
+    const windowData = buffers.read(start_time, window_size)
+    return toServerData(Object.assign(windowData, { power_bands: response.power_bands }))
+}
+
+// Requests get_data with GET, so the browser can cache the responses
+async function requestData(
+    parameters: Record<string, unknown>,
+    binary: boolean,
+): Promise<Record<string, unknown>> {
+    const query = new URLSearchParams()
+    for (const key in parameters) {
+        const value = parameters[key]
+        if (value != null) {
+            query.set(key, typeof value == 'object' ? JSON.stringify(value) : String(value))
+        }
     }
 
     const body = {
-        method: 'POST',
+        method: 'GET',
         headers: {
-            Accept: 'application/json',
-            'Content-Type': 'application/json',
+            Accept: binary ? BINARY_CONTENT_TYPE : 'application/json',
+            'X-Scrub-Id': SCRUB_ID,
         },
-        body: JSON.stringify(post_data),
     }
 
-    const response = await fetch('http://' + window.location.host + '/api/get_data', body)
+    const response = await fetch(apiUrl('get_data') + '?' + query, body)
 
+    if (response.status == 409) {
+        return Promise.reject(SUPERSEDED)
+    }
     if (!response.ok) {
         return Promise.reject('Could not fetch data from the server: ' + response.statusText)
     }
 
-    const jsonResponse = await response.json()
+    if (response.headers.get('Content-Type')?.startsWith(BINARY_CONTENT_TYPE)) {
+        const decoded = decodeBinaryData(await response.arrayBuffer())
+        // Metadata of the header, like 'ranges', is returned next to the signals
+        return Object.assign({}, decoded.metadata, decoded.data)
+    }
+    return await response.json()
+}
 
+function toServerData(jsonResponse: Record<string, unknown>): ServerData {
     const data: ServerData = {
-        eeg: jsonResponse.eeg ?? null,
-        gsr: jsonResponse.gsr ?? null,
-        ppg: jsonResponse.ppg ?? null,
-        powerBands: jsonResponse.power_bands ?? null,
-        deltaBand: jsonResponse.delta_band ?? null,
-        thetaBand: jsonResponse.theta_band ?? null,
-        alphaBand: jsonResponse.alpha_band ?? null,
-        betaBand: jsonResponse.beta_band ?? null,
-        gammaBand: jsonResponse.gamma_band ?? null,
-        gsrPhasic: jsonResponse.gsr_phasic ?? null,
-        gsrTonic: jsonResponse.gsr_tonic ?? null,
-        hr: jsonResponse.hr ?? null,
-        hrv: jsonResponse.hrv ?? null,
-        breathingRate: jsonResponse.breathing_rate ?? null,
+        eeg: (jsonResponse.eeg ?? null) as Series[],
+        gsr: (jsonResponse.gsr ?? null) as Series,
+        ppg: (jsonResponse.ppg ?? null) as Series,
+        powerBands: (jsonResponse.power_bands ?? null) as Series,
+        deltaBand: (jsonResponse.delta_band ?? null) as Series,
+        thetaBand: (jsonResponse.theta_band ?? null) as Series,
+        alphaBand: (jsonResponse.alpha_band ?? null) as Series,
+        betaBand: (jsonResponse.beta_band ?? null) as Series,
+        gammaBand: (jsonResponse.gamma_band ?? null) as Series,
+        gsrPhasic: (jsonResponse.gsr_phasic ?? null) as Series,
+        gsrTonic: (jsonResponse.gsr_tonic ?? null) as Series,
+        hr: (jsonResponse.hr ?? null) as Series,
+        hrv: (jsonResponse.hrv ?? null) as Series,
+        breathingRate: (jsonResponse.breathing_rate ?? null) as Series,
+        samplingRates: jsonResponse.sampling_rates as ServerData['samplingRates'],
     }
 
     return data
 }
 
+// Playback pushed by the server. onWindow receives the whole first window, then
+// onAppend receives only the newly visible second of each signal (and the power bands
+// of the new window) every second. onEnd is called when the end of the recording is
+// reached. Closing the returned EventSource stops the playback.
+export function openPlaybackStream(
+    window_size: number,
+    start_time: number,
+    onWindow: (start_time: number, data: ServerData) => void,
+    onAppend: (start_time: number, data: ServerData) => void,
+    onEnd: () => void,
+): EventSource {
+    const params = new URLSearchParams({
+        window_size: window_size.toString(),
+        start_time: start_time.toString(),
+    })
+    const source = new EventSource(apiUrl('stream') + '?' + params)
+
+    source.addEventListener('window', (event) => {
+        const message = JSON.parse((event as MessageEvent).data)
+        onWindow(message.start_time, toServerData(message.data))
+    })
+    source.addEventListener('append', (event) => {
+        const message = JSON.parse((event as MessageEvent).data)
+        onAppend(message.start_time, toServerData(message.data))
+    })
+    source.addEventListener('end', () => {
+        source.close()
+        onEnd()
+    })
+    return source
+}
+
+type BinaryHeaderEntry = {
+    key: string
+    dtype: string
+    shape: number[]
+    offset: number
+    labels?: string[]
+}
+
+type DecodedBinaryData = {
+    data: BinaryData
+    // Small values sent in the header as they are, like 'ranges'
+    metadata: Record<string, unknown>
+}
+
+// Decodes the binary columnar format of get_data. See server's encoding.py for the
+// layout. Buffers are viewed in place, nothing is copied.
+export function decodeBinaryData(buffer: ArrayBuffer): DecodedBinaryData {
+    const headerLength = new DataView(buffer).getUint32(0, true)
+    const headerText = new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength))
+    const header = JSON.parse(headerText)
+    const entries: BinaryHeaderEntry[] = header.entries
+    const base = 4 + headerLength
+
+    const data: BinaryData = {}
+    for (const entry of entries) {
+        const length = entry.shape.reduce((a, b) => a * b, 1)
+        let values: Float32Array | Uint8Array
+        if (entry.dtype == '<f4') {
+            values = new Float32Array(buffer, base + entry.offset, length)
+        } else if (entry.dtype == '|u1') {
+            values = new Uint8Array(buffer, base + entry.offset, length)
+        } else {
+            throw new Error(`Unsupported dtype '${entry.dtype}' for '${entry.key}'`)
+        }
+
+        if (entry.labels) {
+            const labeled: { [label: string]: number } = {}
+            entry.labels.forEach((label, idx) => (labeled[label] = values[idx]))
+            data[entry.key] = labeled
+        } else if (entry.shape.length == 2) {
+            const [rows, columns] = entry.shape
+            const rowViews = Array(rows)
+            for (let row = 0; row < rows; row++) {
+                rowViews[row] = values.subarray(row * columns, (row + 1) * columns)
+            }
+            data[entry.key] = rowViews
+        } else {
+            data[entry.key] = values
+        }
+    }
+    return { data: data, metadata: header.metadata ?? {} }
+}
+
 export async function fetchServerMetadata(): Promise<ServerMetaData> {
-    const response = await fetch('http://' + window.location.host + '/api/get_metadata')
+    const response = await fetch(apiUrl('get_metadata'))
 
     if (!response.ok) {
         return Promise.reject('Could not fetch data from the server: ' + response.statusText)
@@ -74,7 +255,7 @@ export async function fetchServerMetadata(): Promise<ServerMetaData> {
         dataLength: jsonResponse.data_length ?? null,
         enabledGraphs: jsonResponse.enabled_graphs ?? null,
         eegChannels: jsonResponse.eeg_channels ?? null,
-        samplingRates: jsonResponse.sampling_rate ?? null,
+        samplingRates: jsonResponse.sampling_rates ?? {},
     }
     return metadata
 }
@@ -15,28 +15,49 @@
 
 import { Chart } from 'chart.js'
 
+// A signal as received from the server. It's a plain array when the response was
+// JSON (missing values are null) and a Float32Array when it was binary (missing
+// values are NaN).
+export type Series = ArrayLike<number | null>
+
 export type ServerData = {
-    eeg?: number[][]
-    gsr?: number[]
-    ppg?: number[]
-    deltaBand?: number[]
-    thetaBand?: number[]
-    alphaBand?: number[]
-    betaBand?: number[]
-    gammaBand?: number[]
-    powerBands?: number[]
-    gsrPhasic?: number[]
-    gsrTonic?: number[]
-    hr?: Array<number | null>
-    hrv?: Array<number | null>
-    breathingRate?: Array<number | null>
+    eeg?: Series[]
+    gsr?: Series
+    ppg?: Series
+    deltaBand?: Series
+    thetaBand?: Series
+    alphaBand?: Series
+    betaBand?: Series
+    gammaBand?: Series
+    powerBands?: Series
+    gsrPhasic?: Series
+    gsrTonic?: Series
+    hr?: Series
+    hrv?: Series
+    breathingRate?: Series
+    // Sampling rate of each signal after being reduced by the server. Only
+    // available when 'max_points' was requested.
+    samplingRates?: { [key: string]: number }
+}
+
+// Decoded content of a binary get_data response. Two dimensional buffers become an
+// array of rows, and buffers with labels (power bands) become a label-value map.
+// Buffers are Float32Array, except quantized ones (like spectrograms) that are
+// Uint8Array.
+export type BinaryData = {
+    [key: string]:
+        | Float32Array
+        | Float32Array[]
+        | Uint8Array
+        | Uint8Array[]
+        | { [label: string]: number }
 }
 
 export type ServerMetaData = {
     dataLength: number
     enabledGraphs: string[]
     eegChannels: string[] | null
-    samplingRates: number[]
+    samplingRates: { [key: string]: number }
 }
 
 export type Charts = {